@@ -88,6 +88,16 @@ class AdvancedExpensesGUI:
             )
         ''')
         
+        # شهر المصروف عمود مولد مفهرس مع المبلغ، فالتجميع الشهري يقرأ الفهرس مرتباً
+        columns = [row[1] for row in self.cursor.execute('PRAGMA table_xinfo(expenses)')]
+        if 'expense_month' not in columns:
+            self.cursor.execute('''
+                ALTER TABLE expenses ADD COLUMN expense_month TEXT
+                GENERATED ALWAYS AS (strftime('%Y-%m', expense_date)) VIRTUAL
+            ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS ix_expenses_expense_month ON expenses (expense_month, amount)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS ix_expenses_expense_date ON expenses (expense_date, id)')
+        
         # جدول المرفقات
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS attachments (
@@ -769,10 +779,10 @@ class AdvancedExpensesGUI:
         """عرض الرسم الشريطي الشهري"""
         # استعلام البيانات الشهرية
         self.cursor.execute('''
-            SELECT strftime('%Y-%m', expense_date) as month, SUM(amount) as total
+            SELECT expense_month as month, SUM(amount) as total
             FROM expenses
-            GROUP BY strftime('%Y-%m', expense_date)
-            ORDER BY month
+            GROUP BY expense_month
+            ORDER BY expense_month
         ''')
 
         data = self.cursor.fetchall()
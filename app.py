@@ -5,24 +5,155 @@
 Complete Accounting System with Discount Fields
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, g, has_request_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, date
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateColumn, DDL
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.exc import OperationalError
+from functools import wraps
+from datetime import datetime, date, timedelta
 import logging
 import os
 import json
 import time
+import base64
+import copy
+import threading
+import queue
+import sqlite3
+import glob
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+from urllib.request import pathname2url
+from concurrent.futures import Future
+
+from src.database.sequences import (
+    RESERVE_SEQUENCE_SQL, MAX_RESERVATION_BLOCK, block_range, day_period, format_document_number, sequence_params
+)
+from src.database.search_index import (
+    SearchSource, build_match_query, ensure_search_index, matching_ids_sql, search_params, search_sql
+)
+from src.database.rollups import (
+    DAILY_ROLLUP_UPSERT_SQL, MONTHLY_ROLLUP_UPSERT_SQL, MONTH_GRAINS, ROLLUP_DIMENSIONS, ROLLUP_GRAINS,
+    ROLLUP_MEASURES, month_start, period_key, split_period
+)
+from src.database.ledger import (
+    ACCOUNT_BALANCE_UPSERT_SQL, BALANCE_TOLERANCE, CHART_OF_ACCOUNTS, account_balance,
+    document_lines, signed_lines
+)
+from src.utils.autocomplete import PrefixIndex, word_keys
+from src.utils.arabic_normalization import SEARCH_KEY_LENGTH, normalize_arabic, prefix_upper_bound, search_key
 
 # إعداد التطبيق
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'complete-accounting-system-with-discount'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///accounting.db'
+
+def database_url(variable='DATABASE_URL', default='sqlite:///accounting.db'):
+    """DATABASE_URL من البيئة (PostgreSQL على Render) أو SQLite المحلي"""
+    url = os.environ.get(variable, default)
+    # Render و Heroku يعطيان postgres:// وSQLAlchemy 2 يقبل postgresql:// فقط
+    if url and url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # مجمع اتصالات لكل عامل: مجموع (DB_POOL_SIZE + DB_MAX_OVERFLOW) × عدد العمال على
+    # كل الخوادم يجب أن يبقى أقل من max_connections في PostgreSQL
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        # فحص الاتصال قبل استخدامه وتجديده قبل أن يغلقه الخادم أو الموازن
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+    }
+
+# أصناف المطعم غالباً لا يتابع مخزونها، لذلك البيع بدون رصيد مسموح افتراضياً
+app.config['ALLOW_NEGATIVE_STOCK'] = os.environ.get('ALLOW_NEGATIVE_STOCK', '1') == '1'
+# كاتب الاعتماد الجماعي (اختياري): الكتابات الصغيرة من الطلبات المتزامنة تعتمد معاً
+app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT', '0') == '1'
+app.config['GROUP_COMMIT_MAX_BATCH'] = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '64'))
+app.config['GROUP_COMMIT_MAX_WAIT_MS'] = float(os.environ.get('GROUP_COMMIT_MAX_WAIT_MS', '0'))
+# مسارات التقارير الثقيلة تقرأ من نسخة تحدث كل REPORTING_SNAPSHOT_MAX_AGE ثانية (SQLite)
+# أو من النسخة المتماثلة REPORTING_DATABASE_URL (PostgreSQL) بدلاً من قاعدة الكتابة
+app.config['REPORTING_SNAPSHOT'] = os.environ.get('REPORTING_SNAPSHOT', '1') == '1'
+app.config['REPORTING_SNAPSHOT_MAX_AGE'] = float(os.environ.get('REPORTING_SNAPSHOT_MAX_AGE', '60'))
+app.config['REPORTING_DATABASE_URL'] = database_url('REPORTING_DATABASE_URL', None)
+# فهرس الإكمال التلقائي في الذاكرة يتبع إصدار الجدول (autocomplete_version)، ويعاد بناؤه
+# كل AUTOCOMPLETE_MAX_AGE ثانية على الأكثر ليلتقط التعديل المباشر في القاعدة خارج التطبيق
+app.config['AUTOCOMPLETE_MAX_AGE'] = float(os.environ.get('AUTOCOMPLETE_MAX_AGE', '300'))
+# أقصى عدد قنوات بث /api/events المفتوحة في العامل؛ ما بعده يرفض بـ 503 فيرجع التبويب
+# إلى الفحص الدوري، حتى لا تحجز القنوات كل خيوط gthread عن الطلبات الأخرى
+app.config['EVENT_STREAM_MAX_CLIENTS'] = int(os.environ.get('EVENT_STREAM_MAX_CLIENTS', '40'))
+
+class RoutingSession(FlaskSession):
+    """جلسة Flask-SQLAlchemy توجه قراءات مسارات @reporting_snapshot إلى نسخة التقارير"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            engine = g.get('reporting_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 # إعداد قاعدة البيانات
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+# أعمدة اليوم والشهر مولدة من عمود date ومفهرسة، فالتجميع حسب الفترة يقرأ الفهرس
+# مرتباً بدلاً من حساب المفتاح لكل صف. التعبير يترجم لكل قاعدة: strftime في
+# SQLite، و EXTRACT/lpad في PostgreSQL لأن to_char ليست IMMUTABLE
+DATE_KEY_FIELDS = {'YEAR': ('%Y', 4), 'MONTH': ('%m', 2), 'DAY': ('%d', 2)}
+
+class date_key(FunctionElement):
+    """مفتاح الفترة النصي لعمود تاريخ: YYYY-MM-DD (day_key) أو YYYY-MM (month_key)"""
+    type = db.String()
+    inherit_cache = True
+    fields = ()
+
+class day_key(date_key):
+    inherit_cache = True
+    fields = ('YEAR', 'MONTH', 'DAY')
+
+class month_key(date_key):
+    inherit_cache = True
+    fields = ('YEAR', 'MONTH')
+
+@compiles(date_key)
+def compile_date_key(element, compiler, **kw):
+    pattern = '-'.join(DATE_KEY_FIELDS[field][0] for field in element.fields)
+    return f"strftime('{pattern}', {compiler.process(element.clauses, **kw)})"
+
+@compiles(date_key, 'postgresql')
+def compile_date_key_postgresql(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return " || '-' || ".join(
+        f"lpad(CAST(CAST(EXTRACT({field} FROM {column}) AS INTEGER) AS TEXT), {DATE_KEY_FIELDS[field][1]}, '0')"
+        for field in element.fields
+    )
+
+def day_column():
+    return db.Column(db.String(10), db.Computed(day_key(db.column('date'))))
+
+def month_column():
+    return db.Column(db.String(7), db.Computed(month_key(db.column('date'))))
+
+# أعمدة *_search_key تقارن بترتيب نقاط الترميز (prefix_upper_bound)، وهو ترتيب
+# SQLite الافتراضي؛ في PostgreSQL يلزم COLLATE "C" حتى يعمل نطاق البادئة على الفهرس
+SEARCH_KEY_TYPE = db.String(SEARCH_KEY_LENGTH).with_variant(
+    db.String(SEARCH_KEY_LENGTH, collation='C'), 'postgresql'
+)
 
 # إعداد نظام تسجيل الدخول
 login_manager = LoginManager()
@@ -33,6 +164,172 @@ login_manager.login_view = 'login'
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ============================================================================
+# SQLITE STORAGE PROFILE
+# ============================================================================
+
+# تطبق على كل اتصال جديد في المجمع. WAL يسمح بالقراءة أثناء الكتابة، و NORMAL مع
+# WAL يؤجل fsync إلى نقطة الفحص (checkpoint) بدلاً من كل اعتماد، و busy_timeout
+# يجعل الكاتب الثاني ينتظر القفل بدلاً من "database is locked" فوراً
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', '65536')),  # القيمة السالبة بالكيلوبايت
+    'temp_store': 'MEMORY',
+}
+
+class SnapshotConnection(sqlite3.Connection):
+    """اتصال نسخة التقارير - ملف immutable لا تنطبق عليه إعدادات WAL والقفل"""
+
+@db.event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection) or isinstance(dbapi_connection, SnapshotConnection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+# ============================================================================
+# REPORTING SNAPSHOT
+# ============================================================================
+
+class ReportingSnapshot:
+    """نسخة قراءة فقط من ملف SQLite لمسارات التقارير
+
+    تؤخذ بواجهة النسخ الاحتياطي (sqlite3 backup) في خطوة واحدة: قراءة متسقة لا توقف
+    الكتابة في WAL، ثم تفتح الاستعلامات الملف الجديد بـ immutable=1 بلا أي أقفال، فلا
+    يؤخر مسح تقرير طويل حفظ نقاط البيع. أول طلب تقرير بعد مرور max_age ثانية يبدأ
+    التحديث في خيط خلفي ويكمل بالنسخة الحالية حتى تجهز الجديدة، وعمال gunicorn
+    الآخرون يستخدمون أحدث نسخة في نفس المجلد إن كانت حديثة. النسخة الأقدم من ضعف
+    العمر (قد يحذفها عامل آخر) أو غير الموجودة بعد لا تستخدم: يقرأ الطلب من قاعدة الكتابة.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.path = None
+        self.taken_at = 0
+        self.refreshing = False
+        # بدون مجمع: كل جلسة تفتح النسخة الحالية، والملف القديم يغلق مع آخر قارئ له
+        self.engine = create_engine('sqlite://', creator=self.connect, poolclass=NullPool)
+
+    def connect(self):
+        return sqlite3.connect(f'file:{pathname2url(self.path)}?immutable=1', uri=True,
+                               check_same_thread=False, factory=SnapshotConnection)
+
+    def current(self, source):
+        """(engine, وقت النسخة) أو (None, None) إذا لم تتوفر نسخة صالحة بعد"""
+        with self.lock:
+            now = time.time()
+            if now - self.taken_at > self.max_age:
+                # نسخة أحدث أخذها عامل آخر تغني عن التحديث
+                snapshots = self.snapshots(source)
+                if snapshots and snapshots[0][0] > self.taken_at:
+                    self.taken_at, self.path = snapshots[0]
+            if now - self.taken_at > self.max_age and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self.refresh, args=(source,), daemon=True,
+                                 name='reporting-snapshot').start()
+            if self.path is None or now - self.taken_at > 2 * self.max_age:
+                return None, None
+            return self.engine, datetime.fromtimestamp(self.taken_at)
+
+    def snapshots(self, source):
+        """النسخ الموجودة لملف القاعدة: [(وقت الأخذ, المسار)] من الأحدث"""
+        found = []
+        for path in glob.glob(f'{glob.escape(source)}.report-*.db'):
+            stamp = path[len(source) + len('.report-'):-len('.db')]
+            if stamp.isdigit():
+                found.append((int(stamp) / 1000, path))
+        return sorted(found, reverse=True)
+
+    def refresh(self, source):
+        """أخذ نسخة جديدة (في الخيط الخلفي) ثم التحويل إليها وحذف المنتهية"""
+        try:
+            taken_at, path = self.take(source)
+            with self.lock:
+                self.taken_at, self.path = taken_at, path
+            # لا يقرأ أي عامل من نسخة أقدم من ضعف العمر (يحدث قبل ذلك)
+            for taken_at, path in self.snapshots(source):
+                if path != self.path and time.time() - taken_at > 2 * self.max_age:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass  # مفتوح في عامل آخر على ويندوز - يحذف في تحديث لاحق
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحديث نسخة التقارير: {e}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def take(self, source):
+        taken_at = time.time()
+        path = f'{source}.report-{int(taken_at * 1000)}.db'
+        source_connection = sqlite3.connect(source)
+        target = sqlite3.connect(path + '.tmp')
+        try:
+            source_connection.backup(target)
+            # الملف لن يتغير بعد الآن: journal عادي حتى يفتح دون ملفات -wal و -shm
+            target.execute('PRAGMA journal_mode = DELETE')
+        except Exception:
+            target.close()
+            os.remove(path + '.tmp')
+            raise
+        finally:
+            source_connection.close()
+        target.close()
+        # إعادة التسمية ذرية: العمال الآخرون لا يرون نسخة ناقصة
+        os.replace(path + '.tmp', path)
+        return taken_at, path
+
+reporting_snapshot_store = ReportingSnapshot(app.config['REPORTING_SNAPSHOT_MAX_AGE'])
+reporting_replica_engine = None
+
+def reporting_source():
+    """(engine, وقت البيانات) لمسارات التقارير، أو (None, None) للقراءة من قاعدة الكتابة"""
+    global reporting_replica_engine
+    if not app.config['REPORTING_SNAPSHOT']:
+        return None, None
+
+    if app.config['REPORTING_DATABASE_URL']:
+        if reporting_replica_engine is None:
+            reporting_replica_engine = create_engine(app.config['REPORTING_DATABASE_URL'],
+                                                     **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        with reporting_replica_engine.connect() as connection:
+            replayed = connection.execute(db.text('SELECT pg_last_xact_replay_timestamp()')).scalar()
+        # NULL يعني أن العنوان للخادم الأساسي وليس نسخة متماثلة: البيانات حية
+        return reporting_replica_engine, replayed.astimezone().replace(tzinfo=None) if replayed else datetime.now()
+
+    source = db.engine.url.database
+    if db.engine.dialect.name != 'sqlite' or not source or source == ':memory:':
+        return None, None
+    return reporting_snapshot_store.current(source)
+
+def reporting_snapshot(view):
+    """يقرأ المسار من نسخة التقارير بدلاً من قاعدة الكتابة
+
+    وقت النسخة في g.reporting_snapshot_at (للقوالب) وفي ترويسة X-Snapshot-At. إذا
+    لم تجهز نسخة بعد أو تعذر الوصول إليها يقرأ المسار من قاعدة الكتابة كالمعتاد.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            engine, snapshot_at = reporting_source()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحديث نسخة التقارير - القراءة من القاعدة الأساسية: {e}")
+            engine, snapshot_at = None, None
+        g.reporting_engine = engine
+        g.reporting_snapshot_at = snapshot_at
+
+        response = app.make_response(view(*args, **kwargs))
+        if snapshot_at:
+            response.headers['X-Snapshot-At'] = snapshot_at.isoformat(timespec='seconds')
+        return response
+    return wrapper
+
 # نماذج قاعدة البيانات
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -54,6 +351,7 @@ class Customer(db.Model):
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100))
     address = db.Column(db.Text)
+    name_search_key = db.Column(SEARCH_KEY_TYPE, index=True)  # الاسم بعد التطبيع العربي
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -64,6 +362,7 @@ class Product(db.Model):
     quantity = db.Column(db.Integer, default=0)  # Changed from stock_quantity to quantity
     category = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    name_search_key = db.Column(SEARCH_KEY_TYPE, index=True)  # الاسم بعد التطبيع العربي
 
 class Supplier(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -72,6 +371,7 @@ class Supplier(db.Model):
     email = db.Column(db.String(100))
     address = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    name_search_key = db.Column(SEARCH_KEY_TYPE, index=True)  # الاسم بعد التطبيع العربي
 
 # Product class already defined above - removing duplicate
 
@@ -80,19 +380,30 @@ class Sale(db.Model):
     invoice_number = db.Column(db.String(50), unique=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
     subtotal = db.Column(db.Float, nullable=False, default=0)
-    discount = db.Column(db.Float, nullable=False, default=0)
+    discount = db.column_property(db.Column(db.Float, nullable=False, default=0), active_history=True)
     tax_rate = db.Column(db.Float, default=15.0)  # Default VAT rate 15%
-    tax_amount = db.Column(db.Float, default=0)
-    total = db.Column(db.Float, nullable=False)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    tax_amount = db.column_property(db.Column(db.Float, default=0), active_history=True)
+    total = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
+    date = db.column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
     notes = db.Column(db.Text)
     # حقول نظام المدفوعات
-    payment_status = db.Column(db.String(20), default='unpaid')  # unpaid, partial, paid, overdue
-    paid_amount = db.Column(db.Float, default=0)
+    payment_status = db.column_property(db.Column(db.String(20), default='unpaid'), active_history=True)  # unpaid, partial, paid, overdue
+    paid_amount = db.column_property(db.Column(db.Float, default=0), active_history=True)
     payment_date = db.Column(db.DateTime)
     payment_method = db.Column(db.String(50))
+    branch_code = db.column_property(db.Column(db.String(20), default=''), active_history=True)
+    day = day_column()
+    month = month_column()
     customer = db.relationship('Customer', backref='sales')
 
+    __table_args__ = (
+        db.Index('ix_sale_date_id', 'date', 'id'),
+        db.Index('ix_sale_payment_status_date', 'payment_status', 'date'),
+        db.Index('ix_sale_customer_id_date', 'customer_id', 'date'),
+        db.Index('ix_sale_day_total', 'day', 'total'),
+        db.Index('ix_sale_month_total', 'month', 'total'),
+    )
+
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
@@ -107,43 +418,72 @@ class SaleItem(db.Model):
     sale = db.relationship('Sale', backref='items')
     product = db.relationship('Product', backref='sale_items')
 
+    __table_args__ = (
+        db.Index('ix_sale_item_sale_id', 'sale_id'),
+        db.Index('ix_sale_item_product_id', 'product_id'),
+    )
+
 class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'))
     subtotal = db.Column(db.Float, nullable=False, default=0)
-    discount = db.Column(db.Float, nullable=False, default=0)
-    total = db.Column(db.Float, nullable=False)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    discount = db.column_property(db.Column(db.Float, nullable=False, default=0), active_history=True)
+    total = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
+    date = db.column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
     notes = db.Column(db.Text)
     # حقول نظام المدفوعات
-    payment_status = db.Column(db.String(20), default='unpaid')
-    paid_amount = db.Column(db.Float, default=0)
+    payment_status = db.column_property(db.Column(db.String(20), default='unpaid'), active_history=True)
+    paid_amount = db.column_property(db.Column(db.Float, default=0), active_history=True)
     payment_date = db.Column(db.DateTime)
     payment_method = db.Column(db.String(50))
+    day = day_column()
+    month = month_column()
     supplier = db.relationship('Supplier', backref='purchases')
 
+    __table_args__ = (
+        db.Index('ix_purchase_date_id', 'date', 'id'),
+        db.Index('ix_purchase_payment_status_date', 'payment_status', 'date'),
+        db.Index('ix_purchase_supplier_id_date', 'supplier_id', 'date'),
+        db.Index('ix_purchase_day_total', 'day', 'total'),
+        db.Index('ix_purchase_month_total', 'month', 'total'),
+    )
+
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     expense_number = db.Column(db.String(50), unique=True)
     description = db.Column(db.String(200), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     expense_type = db.Column(db.String(100))  # نوع المصروف
-    category = db.Column(db.String(50))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    category = db.column_property(db.Column(db.String(50)), active_history=True)
+    date = db.column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
     reference = db.Column(db.String(100))  # رقم المرجع
     vendor = db.Column(db.String(200))  # المورد
     notes = db.Column(db.Text)
     # حقول نظام المدفوعات
-    payment_status = db.Column(db.String(20), default='unpaid')
-    paid_amount = db.Column(db.Float, default=0)
+    payment_status = db.column_property(db.Column(db.String(20), default='unpaid'), active_history=True)
+    paid_amount = db.column_property(db.Column(db.Float, default=0), active_history=True)
     payment_date = db.Column(db.DateTime)
     payment_method = db.Column(db.String(50))
+    # الوصف والمورد بعد التطبيع العربي
+    description_search_key = db.Column(SEARCH_KEY_TYPE, index=True)
+    vendor_search_key = db.Column(SEARCH_KEY_TYPE, index=True)
+    branch_code = db.column_property(db.Column(db.String(20), default=''), active_history=True)
+    day = day_column()
+    month = month_column()
+
+    __table_args__ = (
+        db.Index('ix_expense_date_id', 'date', 'id'),
+        db.Index('ix_expense_payment_status_date', 'payment_status', 'date'),
+        db.Index('ix_expense_vendor_date', 'vendor', 'date'),
+        db.Index('ix_expense_day_amount', 'day', 'amount'),
+        db.Index('ix_expense_month_amount', 'month', 'amount'),
+    )
 
 class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     position = db.Column(db.String(50))
-    salary = db.Column(db.Float, nullable=False)
+    salary = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100))
     hire_date = db.Column(db.Date, default=date.today)
@@ -151,25 +491,1270 @@ class Employee(db.Model):
 class Payroll(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'))
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     month = db.Column(db.String(7))  # YYYY-MM format
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
     notes = db.Column(db.Text)
     # حقول نظام المدفوعات
-    payment_status = db.Column(db.String(20), default='unpaid')
-    paid_amount = db.Column(db.Float, default=0)
+    payment_status = db.column_property(db.Column(db.String(20), default='unpaid'), active_history=True)
+    paid_amount = db.column_property(db.Column(db.Float, default=0), active_history=True)
     payment_date = db.Column(db.DateTime)
     payment_method = db.Column(db.String(50))
+    day = day_column()  # الشهر هنا هو شهر الراتب المخزن في month وليس شهر التاريخ
     employee = db.relationship('Employee', backref='payrolls')
 
+    __table_args__ = (
+        db.Index('ix_payroll_date_id', 'date', 'id'),
+        db.Index('ix_payroll_payment_status_date', 'payment_status', 'date'),
+        db.Index('ix_payroll_employee_id_date', 'employee_id', 'date'),
+        db.Index('ix_payroll_day_amount', 'day', 'amount'),
+        db.Index('ix_payroll_month_amount', 'month', 'amount'),
+    )
+
+class DashboardStats(db.Model):
+    """ملخص لوحة التحكم - صف واحد تحدثه كل عملية حفظ في نفس المعاملة"""
+    id = db.Column(db.Integer, primary_key=True)
+    sales_count = db.Column(db.Integer, nullable=False, default=0)
+    purchases_count = db.Column(db.Integer, nullable=False, default=0)
+    expenses_count = db.Column(db.Integer, nullable=False, default=0)
+    employees_count = db.Column(db.Integer, nullable=False, default=0)
+    total_sales = db.Column(db.Float, nullable=False, default=0)
+    total_purchases = db.Column(db.Float, nullable=False, default=0)
+    total_expenses = db.Column(db.Float, nullable=False, default=0)
+    total_discount_sales = db.Column(db.Float, nullable=False, default=0)
+    total_discount_purchases = db.Column(db.Float, nullable=False, default=0)
+    total_salaries = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# عمود مفتاح البحث -> أعمدة المصدر (src/utils/arabic_normalization.py)
+SEARCH_KEY_COLUMNS = {
+    Customer: {'name_search_key': ('name',)},
+    Supplier: {'name_search_key': ('name',)},
+    Product: {'name_search_key': ('name',)},
+    Expense: {'description_search_key': ('description',), 'vendor_search_key': ('vendor',)},
+}
+
+def search_key_values(model, values):
+    """مفاتيح البحث لصف (قاموس أعمدة) - لمسارات الإدراج المجمع التي لا تمر بالجلسة"""
+    return {key_column: search_key(*(values.get(column) for column in columns))
+            for key_column, columns in SEARCH_KEY_COLUMNS.get(model, {}).items()}
+
+@db.event.listens_for(db.session, 'before_flush')
+def fill_search_keys(session, flush_context, instances):
+    """تحديث أعمدة *_search_key مع كل إضافة أو تعديل لعمود المصدر"""
+    for obj in list(session.new) + list(session.dirty):
+        sources = SEARCH_KEY_COLUMNS.get(type(obj))
+        if not sources:
+            continue
+        state = db.inspect(obj)
+        for key_column, columns in sources.items():
+            if obj in session.new or any(state.attrs[column].history.has_changes() for column in columns):
+                setattr(obj, key_column, search_key(*(getattr(obj, column) for column in columns)))
+
+def search_key_prefix(column, text):
+    """شرط بادئة قابل لاستخدام الفهرس على عمود *_search_key (None إذا كان النص فارغاً)"""
+    key = search_key(text)
+    if not key:
+        return None
+    return db.and_(column >= key, column < prefix_upper_bound(key))
+
+# PostgreSQL لا يملك FTS5: فهارس pg_trgm على مفاتيح البحث تخدم مطابقة "يحتوي"
+db.event.listen(db.metadata, 'before_create',
+                DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for _model, _sources in SEARCH_KEY_COLUMNS.items():
+    for _key_column in _sources:
+        db.Index(f'ix_{_model.__tablename__}_{_key_column}_trgm', getattr(_model, _key_column),
+                 postgresql_using='gin', postgresql_ops={_key_column: 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+
+# ترتيب القوائم (date DESC NULLS LAST, id DESC): SQLite يضع NULL أصغر القيم فيخدمه ix_*_date_id،
+# أما PostgreSQL فالمسح العكسي لذلك الفهرس يعطي NULLS FIRST فيحتاج فهرساً بنفس الترتيب
+for _model in (Sale, Purchase, Expense, Payroll):
+    db.Index(f'ix_{_model.__tablename__}_date_desc_id', _model.date.desc().nulls_last(),
+             _model.id.desc()).ddl_if(dialect='postgresql')
+
+def search_key_contains(model, text):
+    """بديل فهرس FTS5 على القواعد الأخرى: كل كلمة مطبعة موجودة في أحد أعمدة مفتاح البحث
+
+    يعيد None إذا كان النص فارغاً.
+    """
+    words = normalize_arabic(text).split()
+    if not words:
+        return None
+    columns = [getattr(model, key_column) for key_column in SEARCH_KEY_COLUMNS[model]]
+    return db.and_(*[db.or_(*[column.contains(word, autoescape=True) for column in columns]) for word in words])
+
+DASHBOARD_STATS_ROW_ID = 1
+
+# عمود الملخص -> الحقل المجمع في النموذج (None يعني العدد)
+DASHBOARD_STATS_SOURCES = {
+    Sale: {'sales_count': None, 'total_sales': 'total', 'total_discount_sales': 'discount'},
+    Purchase: {'purchases_count': None, 'total_purchases': 'total', 'total_discount_purchases': 'discount'},
+    Expense: {'expenses_count': None, 'total_expenses': 'amount'},
+    Employee: {'employees_count': None, 'total_salaries': 'salary'},
+}
+
+@db.event.listens_for(db.session, 'before_flush')
+def track_dashboard_stats(session, flush_context, instances):
+    """تحويل الإضافات والتعديلات والحذف إلى فروقات تضاف لصف الملخص
+
+    التحديث يتم بـ UPDATE ... SET col = col + delta داخل نفس المعاملة، فإذا
+    فشل الحفظ وتم التراجع يتراجع الملخص معه. العمليات المجمعة مثل
+    query.delete() لا تمر من هنا - استخدم rebuild_dashboard_stats() بعدها.
+    """
+    deltas = {}
+
+    def add(column, value):
+        if value:
+            deltas[column] = deltas.get(column, 0) + value
+
+    for obj in session.new:
+        for column, attr in DASHBOARD_STATS_SOURCES.get(type(obj), {}).items():
+            add(column, 1 if attr is None else (getattr(obj, attr) or 0))
+
+    for obj in session.deleted:
+        for column, attr in DASHBOARD_STATS_SOURCES.get(type(obj), {}).items():
+            add(column, -1 if attr is None else -(getattr(obj, attr) or 0))
+
+    for obj in session.dirty:
+        sources = DASHBOARD_STATS_SOURCES.get(type(obj))
+        if not sources:
+            continue
+        state = db.inspect(obj)
+        for column, attr in sources.items():
+            if attr is None:
+                continue
+            history = state.attrs[attr].history
+            if history.has_changes():
+                add(column, sum(v or 0 for v in history.added) - sum(v or 0 for v in history.deleted))
+
+    apply_dashboard_stats_deltas(session, deltas)
+
+def apply_dashboard_stats_deltas(session, deltas):
+    """إضافة فروقات {عمود: قيمة} لصف الملخص - تجمع في المعاملة وتكتب عند الاعتماد
+
+    تستدعى أيضاً من مسارات الإدراج المجمع التي لا تمر بـ before_flush. الكتابة في
+    before_commit (write_deferred_rows) لا عند flush حتى لا يبقى الصف الوحيد مقفلاً
+    طوال المعاملة فتنتظر كل الكتابات المتزامنة بعضها.
+    """
+    pending = session.info.setdefault('dashboard_stats_deltas', {})
+    for column, delta in deltas.items():
+        pending[column] = pending.get(column, 0) + delta
+
+def write_dashboard_stats_deltas(session, deltas):
+    """إضافة الفروقات لصف الملخص بجملة UPDATE ... SET col = col + delta واحدة"""
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if deltas:
+        table = DashboardStats.__table__
+        values = {column: table.c[column] + delta for column, delta in deltas.items()}
+        values['updated_at'] = datetime.utcnow()
+        session.execute(table.update().where(table.c.id == DASHBOARD_STATS_ROW_ID).values(**values))
+
+DASHBOARD_STATS_COLUMNS = [column for sources in DASHBOARD_STATS_SOURCES.values() for column in sources]
+
+# إعادة الحساب تكتب الصف كاملاً: عمليتان متزامنتان لا تتسابقان على إدراج id=1
+DASHBOARD_STATS_UPSERT_SQL = f'''
+    INSERT INTO {DashboardStats.__tablename__} (id, {', '.join(DASHBOARD_STATS_COLUMNS)}, updated_at)
+    VALUES (:id, {', '.join(f':{column}' for column in DASHBOARD_STATS_COLUMNS)}, :updated_at)
+    ON CONFLICT (id) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in DASHBOARD_STATS_COLUMNS)},
+        updated_at = excluded.updated_at
+'''
+
+def dashboard_stats_values():
+    """قيم الملخص محسوبة من الجداول: استعلام تجميع واحد لكل نموذج"""
+    values = {}
+    for model, sources in DASHBOARD_STATS_SOURCES.items():
+        columns = [db.func.count(model.id) if attr is None else db.func.coalesce(db.func.sum(getattr(model, attr)), 0)
+                   for attr in sources.values()]
+        values.update(zip(sources.keys(), db.session.query(*columns).one()))
+    return values
+
+def rebuild_dashboard_stats():
+    """إعادة حساب صف الملخص بالكامل من الجداول - للتهيئة أو بعد التعديل المباشر على القاعدة"""
+    # الحساب من الجداول يشمل ما حفظ في هذه المعاملة - الفروقات المؤجلة تكررها
+    db.session.info.pop('dashboard_stats_deltas', None)
+    db.session.execute(db.text(DASHBOARD_STATS_UPSERT_SQL),
+                       dict(dashboard_stats_values(), id=DASHBOARD_STATS_ROW_ID, updated_at=datetime.utcnow()))
+    db.session.commit()
+
+def get_dashboard_stats():
+    """قراءة صف الملخص (قراءة صف واحد بالمفتاح الأساسي) - لا يكتب شيئاً
+
+    الصف ينشأ في init_database. قبل ذلك تحسب القيم من الجداول دون حفظها.
+    """
+    return db.session.get(DashboardStats, DASHBOARD_STATS_ROW_ID) or \
+        DashboardStats(id=DASHBOARD_STATS_ROW_ID, **dashboard_stats_values())
+
+# ============================================================================
+# DAILY / MONTHLY ROLLUPS
+# ============================================================================
+
+class DailyRollup(db.Model):
+    """مجاميع كل يوم لكل (نوع المستند، الفرع، الفئة، حالة الدفع) - src/database/rollups.py"""
+    __tablename__ = 'daily_rollup'
+
+    doc_type = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.String(10), primary_key=True)  # YYYY-MM-DD
+    branch_code = db.Column(db.String(20), primary_key=True, default='')
+    category = db.Column(db.String(50), primary_key=True, default='')
+    payment_status = db.Column(db.String(20), primary_key=True, default='unpaid')
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    discount = db.Column(db.Float, nullable=False, default=0)
+    tax_amount = db.Column(db.Float, nullable=False, default=0)
+    paid_amount = db.Column(db.Float, nullable=False, default=0)
+
+class MonthlyRollup(db.Model):
+    """مجاميع كل شهر بنفس مفاتيح daily_rollup"""
+    __tablename__ = 'monthly_rollup'
+
+    doc_type = db.Column(db.String(20), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    branch_code = db.Column(db.String(20), primary_key=True, default='')
+    category = db.Column(db.String(50), primary_key=True, default='')
+    payment_status = db.Column(db.String(20), primary_key=True, default='unpaid')
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    discount = db.Column(db.Float, nullable=False, default=0)
+    tax_amount = db.Column(db.Float, nullable=False, default=0)
+    paid_amount = db.Column(db.Float, nullable=False, default=0)
+
+# النموذج -> (نوع المستند، عمود الفئة، {المقياس: العمود}). الرواتب تجمع بتاريخ الصرف،
+# وشهر الاستحقاق المخزن في Payroll.month يبقى في /api/reports/periods
+ROLLUP_SOURCES = {
+    Sale: ('sales', None, {'amount': 'total', 'discount': 'discount', 'tax_amount': 'tax_amount',
+                           'paid_amount': 'paid_amount'}),
+    Purchase: ('purchases', None, {'amount': 'total', 'discount': 'discount', 'paid_amount': 'paid_amount'}),
+    Expense: ('expenses', 'category', {'amount': 'amount', 'paid_amount': 'paid_amount'}),
+    Payroll: ('payroll', None, {'amount': 'amount', 'paid_amount': 'paid_amount'}),
+}
+
+def rollup_attributes(model):
+    """أعمدة النموذج التي يغير تعديلها صف التجميع"""
+    _, category_attr, measures = ROLLUP_SOURCES[model]
+    attrs = ['date', 'payment_status', *measures.values()]
+    if category_attr:
+        attrs.append(category_attr)
+    if hasattr(model, 'branch_code'):
+        attrs.append('branch_code')
+    return attrs
+
+def rollup_entry(model, get):
+    """(مفتاح الصف، قيم المقاييس) لمستند واحد - get(attr) تعيد قيمة العمود أو None"""
+    doc_type, category_attr, measures = ROLLUP_SOURCES[model]
+    key = (
+        doc_type,
+        get('date').strftime('%Y-%m-%d'),
+        (get('branch_code') if hasattr(model, 'branch_code') else None) or '',
+        (get(category_attr) if category_attr else None) or '',
+        get('payment_status') or 'unpaid',
+    )
+    values = [1] + [get(measures[name]) or 0 if name in measures else 0 for name in ROLLUP_MEASURES[1:]]
+    return key, values
+
+def add_rollup_delta(deltas, model, get, sign):
+    if get('date') is None:
+        return  # صفوف قديمة بلا تاريخ لا تدخل التجميع (ولا rebuild_rollups)
+    key, values = rollup_entry(model, get)
+    totals = deltas.setdefault(key, [0] * len(ROLLUP_MEASURES))
+    for index, value in enumerate(values):
+        totals[index] += sign * value
+
+def rollup_row_deltas(model, rows, sign=1):
+    """فروقات مجموعة صفوف (قواميس أعمدة) - لمسارات الإدراج والحذف المجمع التي لا تمر بالجلسة"""
+    deltas = {}
+    for row in rows:
+        get = row.get if isinstance(row, dict) else row._mapping.get
+        add_rollup_delta(deltas, model, get, sign)
+    return deltas
+
+@db.event.listens_for(db.session, 'before_flush')
+def track_rollups(session, flush_context, instances):
+    """تحويل الإضافات والتعديلات والحذف إلى فروقات على صفوف اليوم والشهر
+
+    التعديل الذي ينقل المستند بين مفتاحين (حالة الدفع أو التاريخ مثلاً) يطرح من القديم
+    ويضيف للجديد. مثل الملخص: العمليات المجمعة تستدعي apply_rollup_deltas بنفسها.
+    """
+    deltas = {}
+
+    for obj in session.new:
+        if type(obj) in ROLLUP_SOURCES:
+            if obj.date is None:
+                obj.date = datetime.utcnow()
+            add_rollup_delta(deltas, type(obj), lambda attr: getattr(obj, attr), 1)
+
+    for obj in session.deleted:
+        if type(obj) in ROLLUP_SOURCES:
+            add_rollup_delta(deltas, type(obj), lambda attr: getattr(obj, attr), -1)
+
+    for obj in session.dirty:
+        model = type(obj)
+        if model not in ROLLUP_SOURCES:
+            continue
+        state = db.inspect(obj)
+        if not any(state.attrs[attr].history.has_changes() for attr in rollup_attributes(model)):
+            continue
+
+        def previous(attr):
+            history = state.attrs[attr].history
+            if history.has_changes():
+                return history.deleted[0] if history.deleted else None
+            return getattr(obj, attr)
+
+        add_rollup_delta(deltas, model, previous, -1)
+        add_rollup_delta(deltas, model, lambda attr: getattr(obj, attr), 1)
+
+    apply_rollup_deltas(session, deltas)
+
+def apply_rollup_deltas(session, deltas):
+    """إضافة فروقات {مفتاح: مقاييس} لجدولي اليوم والشهر - تجمع في المعاملة وتكتب عند الاعتماد"""
+    pending = session.info.setdefault('rollup_deltas', {})
+    for key, values in deltas.items():
+        totals = pending.setdefault(key, [0] * len(ROLLUP_MEASURES))
+        for index, value in enumerate(values):
+            totals[index] += value
+
+def write_rollup_deltas(session, deltas):
+    """جملة UPSERT واحدة لكل جدول - المفاتيح مرتبة ليقفل كل المعاملات الصفوف بنفس الترتيب"""
+    daily, monthly = [], {}
+    for (doc_type, day, branch_code, category, payment_status), values in sorted(deltas.items()):
+        if not any(values):
+            continue
+        row = {'doc_type': doc_type, 'period': day, 'branch_code': branch_code, 'category': category,
+               'payment_status': payment_status, **dict(zip(ROLLUP_MEASURES, values))}
+        daily.append(row)
+        month_row = monthly.setdefault((doc_type, day[:7], branch_code, category, payment_status),
+                                       dict(row, period=day[:7], **dict.fromkeys(ROLLUP_MEASURES, 0)))
+        for name in ROLLUP_MEASURES:
+            month_row[name] += row[name]
+
+    if daily:
+        session.execute(db.text(DAILY_ROLLUP_UPSERT_SQL), daily)
+        session.execute(db.text(MONTHLY_ROLLUP_UPSERT_SQL), [monthly[key] for key in sorted(monthly)])
+
+def rollup_dimension_columns(model):
+    """تعابير (الفرع، الفئة، حالة الدفع) لصفوف النموذج بنفس تطبيع rollup_entry"""
+    _, category_attr, _ = ROLLUP_SOURCES[model]
+    return {
+        'branch_code': db.func.coalesce(model.branch_code, '') if hasattr(model, 'branch_code') else db.literal(''),
+        'category': db.func.coalesce(getattr(model, category_attr), '') if category_attr else db.literal(''),
+        'payment_status': db.func.coalesce(model.payment_status, 'unpaid'),
+    }
+
+def rollup_grouping(dimensions):
+    """أبعاد GROUP BY من تعابير الأبعاد: الثابتة (literal) لا تجمع - PostgreSQL يرفض التجميع بثابت"""
+    return [dimension for dimension in dimensions if not isinstance(dimension, BindParameter)]
+
+def rollup_measure_columns(model):
+    _, _, measures = ROLLUP_SOURCES[model]
+    return [db.func.count(model.id)] + [
+        db.func.coalesce(db.func.sum(getattr(model, measures[name])), 0) if name in measures else db.literal(0)
+        for name in ROLLUP_MEASURES[1:]
+    ]
+
+def rebuild_rollups():
+    """إعادة بناء جداول التجميع بالكامل من الجداول بجملة INSERT ... SELECT لكل نوع
+
+    للتهيئة أو بعد تعديل مباشر على القاعدة؛ تشغل دون كتابة متزامنة:
+    flask --app app rebuild-rollups
+    """
+    db.session.info.pop('rollup_deltas', None)
+    db.session.execute(DailyRollup.__table__.delete())
+    db.session.execute(MonthlyRollup.__table__.delete())
+
+    for model, (doc_type, _, _) in ROLLUP_SOURCES.items():
+        dimensions = list(rollup_dimension_columns(model).values())
+        # شهر التاريخ لكل الأنواع (عمود month في الرواتب هو شهر الاستحقاق)
+        for table, period in ((DailyRollup.__table__, model.day),
+                              (MonthlyRollup.__table__, db.func.substr(model.day, 1, 7))):
+            columns = [c.name for c in table.primary_key.columns] + list(ROLLUP_MEASURES)
+            select = db.select(db.literal(doc_type), period, *dimensions, *rollup_measure_columns(model)) \
+                .where(model.day.isnot(None)).group_by(period, *rollup_grouping(dimensions))
+            db.session.execute(table.insert().from_select(columns, select))
+
+    db.session.commit()
+
+def rollup_report(doc_types, grain, date_from, date_to, group_by=(), filters=None):
+    """مجاميع الفترات من جداول التجميع باستعلام واحد
+
+    الأشهر الكاملة من monthly_rollup (للتقارير الشهرية والربعية والسنوية)، وبقية الأيام
+    من daily_rollup، واليوم المفتوح وحده من صفوف المستندات. الأسبوع والربع والسنة تجمع
+    هنا من صفوف اليوم أو الشهر. ترجع صفاً لكل (نوع، فترة، قيم group_by) مرتبة بالفترة.
+    """
+    filters = filters or {}
+    # اليوم الذي تكتب فيه المستندات بتاريخها الافتراضي (datetime.utcnow)
+    open_day = datetime.utcnow().date()
+    months, day_ranges, open_day = split_period(date_from, date_to, open_day, grain in MONTH_GRAINS)
+
+    def rollup_select(table, period_column, condition):
+        dimensions = [table.c[name] for name in group_by]
+        return db.select(
+            table.c.doc_type, table.c[period_column].label('period'), *dimensions,
+            *[db.func.sum(table.c[name]).label(name) for name in ROLLUP_MEASURES]
+        ).where(
+            table.c.doc_type.in_(doc_types), condition,
+            *[table.c[name] == value for name, value in filters.items()]
+        ).group_by(table.c.doc_type, table.c[period_column], *dimensions)
+
+    selects = []
+    if months:
+        table = MonthlyRollup.__table__
+        selects.append(rollup_select(table, 'month', table.c.month.in_(months)))
+    if day_ranges:
+        table = DailyRollup.__table__
+        selects.append(rollup_select(table, 'day', db.or_(*[
+            table.c.day.between(start.isoformat(), end.isoformat()) for start, end in day_ranges
+        ])))
+    if open_day:
+        for model, (doc_type, _, _) in ROLLUP_SOURCES.items():
+            if doc_type not in doc_types:
+                continue
+            dimensions = rollup_dimension_columns(model)
+            selects.append(db.select(
+                db.literal(doc_type).label('doc_type'), model.day.label('period'),
+                *[dimensions[name].label(name) for name in group_by], *rollup_measure_columns(model)
+            ).where(
+                model.day == open_day.isoformat(),
+                *[dimensions[name] == value for name, value in filters.items()]
+            ).group_by(model.day, *rollup_grouping(dimensions[name] for name in group_by)))
+
+    if not selects:
+        return []
+
+    buckets = {}
+    for row in db.session.execute(db.union_all(*selects) if len(selects) > 1 else selects[0]):
+        doc_type, period, *rest = row
+        day = month_start(period) if len(period) == 7 else date.fromisoformat(period)
+        key = (doc_type, period_key(grain, day), *rest[:len(group_by)])
+        totals = buckets.setdefault(key, [0] * len(ROLLUP_MEASURES))
+        for index, value in enumerate(rest[len(group_by):]):
+            totals[index] += value or 0
+
+    return [
+        {'doc_type': key[0], 'period': key[1], **dict(zip(group_by, key[2:])), **dict(zip(ROLLUP_MEASURES, totals))}
+        for key, totals in sorted(buckets.items(), key=lambda item: (item[0][1], item[0][0], *item[0][2:]))
+        if totals[0]
+    ]
+
+class ChangeLog(db.Model):
+    """سجل التغييرات - كل إضافة/تعديل/حذف لمستند يضيف صفاً برقم إصدار متزايد"""
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)  # رقم الإصدار
+    entity = db.Column(db.String(20), nullable=False)  # sales, purchases, expenses, payroll
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+CHANGE_FEED_ENTITIES = {
+    Sale: 'sales',
+    Purchase: 'purchases',
+    Expense: 'expenses',
+    Payroll: 'payroll',
+}
+
+@db.event.listens_for(db.session, 'after_flush')
+def record_change_feed(session, flush_context):
+    """تسجيل تغييرات المستندات بعد أن تأخذ الصفوف الجديدة معرفاتها - تكتب عند الاعتماد"""
+    changes = []
+    now = datetime.utcnow()
+
+    for action, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = CHANGE_FEED_ENTITIES.get(type(obj))
+            if not entity:
+                continue
+            if action == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            # الصفوف الجديدة لا تملك identity قبل انتهاء الحفظ لكن معرفها معبأ
+            state = db.inspect(obj)
+            changes.append({
+                'entity': entity,
+                'entity_id': state.identity[0] if state.identity else obj.id,
+                'action': action,
+                'created_at': now
+            })
+
+    log_change_feed(session, changes)
+
+# مفتاح قفل PostgreSQL الذي يرتب كتابة سجل التغييرات (pg_advisory_xact_lock)
+CHANGE_FEED_LOCK_KEY = 7300001
+
+def log_change_feed(session, changes):
+    """إضافة صفوف سجل التغييرات إلى قائمة المعاملة - تدرج دفعة واحدة في before_commit"""
+    if changes:
+        session.info.setdefault('change_feed_rows', []).extend(changes)
+
+@db.event.listens_for(db.session, 'before_commit')
+def write_deferred_rows(session):
+    """كتابة ما أجلته المعاملة إلى الاعتماد: صف الملخص وصفوف التجميع وأرصدة الحسابات ثم سجل التغييرات
+
+    هذه صفوف مشتركة بين كل الكتابات (صف الملخص الوحيد، يوم الفرع، رصيد حساب الشهر)،
+    فتحديثها عند flush يقفلها حتى نهاية المعاملة وتنتظر المعاملات المتزامنة بعضها طوال
+    عملها. هنا تقفل لحظة الكتابة والاعتماد فقط.
+    """
+    # إطلاق SAVEPOINT يطلق before_commit أيضاً - الكتابة عند اعتماد المعاملة الخارجية فقط
+    if session.in_nested_transaction():
+        return
+    # flush أولاً: commit يطلق before_commit قبل flush الأخير فتسجل تغييراته هنا
+    session.flush()
+    for key, write in (('dashboard_stats_deltas', write_dashboard_stats_deltas),
+                       ('rollup_deltas', write_rollup_deltas),
+                       ('account_balance_deltas', write_account_balance_deltas)):
+        pending = session.info.pop(key, None)
+        if pending:
+            write(session, pending)
+    write_change_feed(session)
+
+def write_change_feed(session):
+    """إدراج صفوف سجل التغييرات آخر خطوة قبل الاعتماد
+
+    في PostgreSQL يحجز الرقم عند الإدراج ويظهر عند الاعتماد، فقد يظهر الإصدار 11
+    قبل 10 ويتخطاه القارئ. القفل يرتب الإدراج والاعتماد، ويؤخذ هنا لا عند أول flush
+    حتى لا تنتظر المعاملات المتزامنة بعضها طوال عملها بل لحظة الإدراج والاعتماد فقط.
+    """
+    changes = session.info.pop('change_feed_rows', None)
+    if not changes:
+        return
+    if session.connection().dialect.name == 'postgresql':
+        session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGE_FEED_LOCK_KEY})
+    session.execute(ChangeLog.__table__.insert(), changes)
+    session.info['change_feed_pending'] = True
+
+# إشعار قنوات البث (SSE) في نفس العملية فور اعتماد المعاملة
+change_feed_condition = threading.Condition()
+change_feed_generation = [0]
+
+@db.event.listens_for(db.session, 'after_commit')
+def notify_change_feed(session):
+    if session.info.pop('change_feed_pending', False):
+        with change_feed_condition:
+            change_feed_generation[0] += 1
+            change_feed_condition.notify_all()
+
+# أعمال مؤجلة إلى الاعتماد في session.info. after_rollback يطلق أيضاً عند ROLLBACK TO
+# SAVEPOINT فيمسح ما سجلته العمليات السابقة في نفس المعاملة، لذلك تؤخذ نسخة قبل SAVEPOINT
+# وتستعاد إذا فشل
+DEFERRED_SESSION_WORK = ('autocomplete_pending', 'autocomplete_versions', 'change_feed_rows',
+                         'dashboard_stats_deltas', 'rollup_deltas', 'account_balance_deltas')
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_deferred_rows(session):
+    for key in DEFERRED_SESSION_WORK:
+        session.info.pop(key, None)
+    session.info.pop('change_feed_pending', None)
+
+def deferred_session_work():
+    return {key: copy.deepcopy(db.session.info[key]) for key in DEFERRED_SESSION_WORK if key in db.session.info}
+
+def restore_deferred_session_work(snapshot):
+    for key in DEFERRED_SESSION_WORK:
+        if key in snapshot:
+            db.session.info[key] = snapshot[key]
+        else:
+            db.session.info.pop(key, None)
+
+class DocumentSequence(db.Model):
+    """عدادات أرقام المستندات لكل (نوع، فرع، يوم) - الحجز في src/database/sequences.py"""
+    __tablename__ = 'document_sequence'
+
+    doc_type = db.Column(db.String(20), primary_key=True)
+    branch_code = db.Column(db.String(20), primary_key=True, default='')
+    period = db.Column(db.String(8), primary_key=True, default='')  # YYYYMMDD
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+def reserve_document_numbers(doc_type, branch_code='', day=None, count=1):
+    """حجز count رقماً متتالياً داخل معاملة الجلسة الحالية
+
+    الحجز يثبت مع commit المستند أو يلغى مع rollback، ولا يحتاج قراءة آخر مستند.
+    """
+    period = day_period(day)
+    last_value = db.session.execute(
+        db.text(RESERVE_SEQUENCE_SQL), sequence_params(doc_type, branch_code, period, count)
+    ).scalar_one()
+    prefix = LEDGER_SOURCES[doc_type][3]
+    return [format_document_number(prefix, number, branch_code, period) for number in block_range(last_value, count)]
+
+def next_document_number(doc_type, branch_code='', day=None):
+    """رقم المستند التالي مثل INV-20250115-0001"""
+    return reserve_document_numbers(doc_type, branch_code, day)[0]
+
+# ============================================================================
+# STOCK LEDGER
+# ============================================================================
+
+STOCK_MOVEMENT_TYPES = ('sale', 'purchase', 'transfer', 'adjustment')
+
+class StockMovement(db.Model):
+    """حركة مخزون - سجل إلحاقي فقط، والرصيد الحالي محفوظ في Product.quantity"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    movement_type = db.Column(db.String(20), nullable=False)  # sale, purchase, transfer, adjustment
+    quantity = db.Column(db.Float, nullable=False)  # موجب = وارد، سالب = صادر
+    reference_type = db.Column(db.String(20))  # sales, purchases ...
+    reference_id = db.Column(db.Integer)
+    branch_code = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_id_created_at', 'product_id', 'created_at'),
+        db.Index('ix_stock_movement_reference', 'reference_type', 'reference_id'),
+    )
+
+def post_stock_movements(movements):
+    """تسجيل حركات المخزون وتحديث الرصيد داخل المعاملة الحالية
+
+    movements: قوائم dict بحقول StockMovement. الرصيد يحدث بجملة
+    UPDATE product SET quantity = quantity + ? واحدة لكل منتج (صافي كل الحركات)
+    بدلاً من قراءة المنتج وتعديله. إذا كان ALLOW_NEGATIVE_STOCK معطلاً يكون
+    التحديث مشروطاً بألا يصبح الرصيد سالباً، ويرفع ValueError عند عدم كفايته.
+    رقم منتج غير موجود (حذف بعد المستند، والمسارات تتحقق منه قبل الحفظ بـ require_products)
+    لا يتتبع مخزونه: حركاته تتجاهل بدلاً من اعتبارها نقصاً في الرصيد.
+    يعيد عدد الحركات المسجلة فعلاً.
+    """
+    movements = [movement for movement in movements if movement.get('product_id') and movement.get('quantity')]
+    if not movements:
+        return 0
+
+    net = {}
+    for movement in movements:
+        if movement['movement_type'] not in STOCK_MOVEMENT_TYPES:
+            raise ValueError(f"نوع حركة المخزون غير صحيح: {movement['movement_type']}")
+        net[movement['product_id']] = net.get(movement['product_id'], 0) + movement['quantity']
+
+    table = Product.__table__
+    strict = not app.config.get('ALLOW_NEGATIVE_STOCK', True)
+    missing = set()
+    for product_id, delta in net.items():
+        if not delta:
+            continue
+        update = table.update().where(table.c.id == product_id)
+        conditional = strict and delta < 0
+        if conditional:
+            update = update.where(table.c.quantity + delta >= 0)
+        if db.session.execute(update.values(quantity=table.c.quantity + delta)).rowcount == 1:
+            continue
+        # لا صف محدث: إما المنتج غير موجود أو (في الوضع الصارم فقط) الرصيد لا يكفي
+        if conditional and db.session.query(Product.id).filter(Product.id == product_id).first():
+            raise ValueError(f'الكمية المتوفرة من المنتج {product_id} غير كافية')
+        missing.add(product_id)
+
+    movements = [movement for movement in movements if movement['product_id'] not in missing]
+    if not movements:
+        return 0
+
+    now = datetime.utcnow()
+    db.session.execute(StockMovement.__table__.insert(), [
+        {'created_at': now, 'reference_type': None, 'reference_id': None, 'branch_code': None, 'notes': None, **movement}
+        for movement in movements
+    ])
+    return len(movements)
+
+def require_products(product_ids):
+    """رفع ValueError لأول رقم منتج غير موجود قبل إدراج أصناف تشير إليه
+
+    نفس رسالة الإدراج المجمع؛ بدونها يرفض PostgreSQL الصنف بخطأ المفتاح الأجنبي
+    ويقبله SQLite دون منتج.
+    """
+    ids = {int(product_id) for product_id in product_ids if product_id}
+    if not ids:
+        return
+    known = {row.id for row in db.session.query(Product.id).filter(Product.id.in_(ids))}
+    for product_id in sorted(ids - known):
+        raise ValueError(f'المنتج {product_id} غير موجود')
+
+def sale_stock_movements(sale_id, items, branch_code=None):
+    """حركات الصرف لأصناف فاتورة مبيعات (الأصناف المرتبطة بمنتج فقط)"""
+    return [{
+        'product_id': item['product_id'],
+        'movement_type': 'sale',
+        'quantity': -item['quantity'],
+        'reference_type': 'sales',
+        'reference_id': sale_id,
+        'branch_code': branch_code
+    } for item in items if item.get('product_id')]
+
+def reverse_stock_movements(reference_type, reference_ids, movement_type):
+    """عكس صافي حركات مستندات (عند حذفها أو استبدال أصنافها) بحركات معاكسة - لا يحذف من السجل"""
+    rows = db.session.query(
+        StockMovement.reference_id, StockMovement.product_id, StockMovement.branch_code,
+        db.func.sum(StockMovement.quantity).label('quantity')
+    ).filter(
+        StockMovement.reference_type == reference_type, StockMovement.reference_id.in_(reference_ids)
+    ).group_by(StockMovement.reference_id, StockMovement.product_id, StockMovement.branch_code).all()
+    post_stock_movements([{
+        'product_id': row.product_id,
+        'movement_type': movement_type,
+        'quantity': -row.quantity,
+        'reference_type': reference_type,
+        'reference_id': row.reference_id,
+        'branch_code': row.branch_code,
+        'notes': 'عكس حركة'
+    } for row in rows if row.quantity])
+
+# ============================================================================
+# GENERAL LEDGER
+# ============================================================================
+
+class Account(db.Model):
+    """حساب في دليل الحسابات - سطور القيود والأرصدة تشير إلى رمزه"""
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(20), unique=True, nullable=False)
+    key = db.Column(db.String(50), unique=True)  # مفتاح ثابت للقوالب: cash, bank ...
+    name_ar = db.Column(db.String(100), nullable=False)
+    name_en = db.Column(db.String(100))
+    account_type = db.Column(db.String(20), nullable=False)  # asset, liability, equity, revenue, expense
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class JournalEntry(db.Model):
+    """قيد يومية - سجل إلحاقي فقط: تعديل المستند يعكس قيده ويرحل قيداً جديداً"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.DateTime, nullable=False)
+    doc_type = db.Column(db.String(20))  # sales, purchases, expenses, payroll (فارغ للقيود اليدوية)
+    doc_id = db.Column(db.Integer)
+    entry_type = db.Column(db.String(20), nullable=False, default='posting')  # posting, reversal, manual
+    description = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_journal_entry_doc', 'doc_type', 'doc_id'),
+        db.Index('ix_journal_entry_date', 'date'),
+    )
+
+class JournalLine(db.Model):
+    """سطر قيد - تاريخ القيد مكرر هنا حتى تقرأ نطاقات الأيام من فهرس السطور وحده"""
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entry.id'), nullable=False)
+    account_code = db.Column(db.String(20), db.ForeignKey('account.code'), nullable=False)
+    debit = db.Column(db.Float, nullable=False, default=0)
+    credit = db.Column(db.Float, nullable=False, default=0)
+    date = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_journal_line_entry_id', 'entry_id'),
+        db.Index('ix_journal_line_account_code_date', 'account_code', 'date'),
+        db.Index('ix_journal_line_date_account_code', 'date', 'account_code'),
+    )
+
+class AccountBalance(db.Model):
+    """مجموع مدين ودائن حساب في شهر - يحدث مع كل قيد في نفس المعاملة"""
+    __tablename__ = 'account_balance'
+
+    account_code = db.Column(db.String(20), db.ForeignKey('account.code'), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    debit = db.Column(db.Float, nullable=False, default=0)
+    credit = db.Column(db.Float, nullable=False, default=0)
+
+# النموذج -> (نوع المستند، وصف القيد، أعمدة المبالغ في قواعد الترحيل)
+POSTING_SOURCES = {
+    Sale: ('sales', 'فاتورة مبيعات', ('total', 'tax_amount')),
+    Purchase: ('purchases', 'فاتورة مشتريات', ('total',)),
+    Expense: ('expenses', 'مصروف', ('amount',)),
+    Payroll: ('payroll', 'راتب', ('amount',)),
+}
+
+def posting_attributes(model):
+    """أعمدة المستند التي يغير تعديلها قيده"""
+    return ['date', 'paid_amount', 'payment_method', *POSTING_SOURCES[model][2]]
+
+def document_entry(model, doc_id, get):
+    """قيد ترحيل مستند من قيمه الحالية، أو None لصف قديم بلا تاريخ"""
+    if get('date') is None:
+        return None
+    doc_type, title, _ = POSTING_SOURCES[model]
+    return {
+        'date': get('date'),
+        'doc_type': doc_type,
+        'doc_id': doc_id,
+        'entry_type': 'posting',
+        'description': f'{title} {doc_id}',
+        'lines': document_lines(doc_type, get)
+    }
+
+def document_row_entries(model, ids, rows):
+    """قيود مجموعة صفوف (قواميس أعمدة) بمعرفاتها - لمسارات الإدراج المجمع التي لا تمر بالجلسة"""
+    entries = []
+    for doc_id, row in zip(ids, rows):
+        get = row.get if isinstance(row, dict) else row._mapping.get
+        entries.append(document_entry(model, doc_id, get))
+    return [entry for entry in entries if entry]
+
+def reversal_entries(session, model, doc_ids):
+    """قيود تعكس صافي ما رحل لمستندات، قيد لكل (مستند، تاريخ) - لا يحذف من الدفتر
+
+    العكس بتاريخ القيد الأصلي، فيبقى رصيد كل شهر مساوياً لمستنداته بحالتها الحالية.
+    """
+    doc_type, title, _ = POSTING_SOURCES[model]
+    rows = session.execute(db.select(
+        JournalEntry.doc_id, JournalLine.date, JournalLine.account_code,
+        db.func.sum(JournalLine.debit - JournalLine.credit).label('amount')
+    ).join(JournalEntry, JournalEntry.id == JournalLine.entry_id).where(
+        JournalEntry.doc_type == doc_type, JournalEntry.doc_id.in_(doc_ids)
+    ).group_by(JournalEntry.doc_id, JournalLine.date, JournalLine.account_code))
+
+    net = {}
+    for row in rows:
+        net.setdefault((row.doc_id, row.date), []).append((row.account_code, -row.amount))
+    return [{
+        'date': entry_date,
+        'doc_type': doc_type,
+        'doc_id': doc_id,
+        'entry_type': 'reversal',
+        'description': f'عكس {title} {doc_id}',
+        'lines': signed_lines(amounts)
+    } for (doc_id, entry_date), amounts in net.items()]
+
+def post_journal_entries(session, entries):
+    """إدراج القيود وسطورها وتحديث الأرصدة الشهرية داخل المعاملة الحالية
+
+    entries: قواميس بحقول JournalEntry مع lines [(رمز الحساب، مدين، دائن)]. القيود تدرج
+    بجملة واحدة (RETURNING للمعرفات) والسطور بجملة واحدة، وصافي كل (حساب، شهر) يجمع
+    في المعاملة ويكتب بجملة UPSERT واحدة عند الاعتماد. يرفع ValueError إذا لم يتوازن
+    قيد. يعيد معرفات القيود.
+    """
+    entries = [entry for entry in entries if entry['lines']]
+    if not entries:
+        return []
+
+    for entry in entries:
+        debit = sum(line[1] for line in entry['lines'])
+        credit = sum(line[2] for line in entry['lines'])
+        if abs(debit - credit) > BALANCE_TOLERANCE:
+            raise ValueError(f'القيد غير متوازن: مدين {debit:.2f} ودائن {credit:.2f}')
+
+    now = datetime.utcnow()
+    table = JournalEntry.__table__
+    entry_ids = session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), [{
+        'date': entry['date'],
+        'doc_type': entry.get('doc_type'),
+        'doc_id': entry.get('doc_id'),
+        'entry_type': entry.get('entry_type', 'posting'),
+        'description': entry.get('description'),
+        'created_at': now
+    } for entry in entries]).scalars().all()
+
+    lines = []
+    balances = session.info.setdefault('account_balance_deltas', {})
+    for entry_id, entry in zip(entry_ids, entries):
+        month = entry['date'].strftime('%Y-%m')
+        for account_code, debit, credit in entry['lines']:
+            lines.append({'entry_id': entry_id, 'account_code': account_code, 'debit': debit,
+                          'credit': credit, 'date': entry['date']})
+            totals = balances.setdefault((account_code, month), [0, 0])
+            totals[0] += debit
+            totals[1] += credit
+
+    session.execute(JournalLine.__table__.insert(), lines)
+    return entry_ids
+
+def write_account_balance_deltas(session, balances):
+    """UPSERT واحد لصافي كل (حساب، شهر) بترتيب المفاتيح"""
+    session.execute(db.text(ACCOUNT_BALANCE_UPSERT_SQL), [
+        {'account_code': account_code, 'month': month, 'debit': debit, 'credit': credit}
+        for (account_code, month), (debit, credit) in sorted(balances.items())
+    ])
+
+@db.event.listens_for(db.session, 'after_flush')
+def post_document_entries(session, flush_context):
+    """ترحيل المستندات المضافة، وعكس المحذوفة، وعكس المعدلة وإعادة ترحيلها
+
+    بعد الحفظ لأن القيد يحتاج معرف المستند الجديد، وفي نفس المعاملة مثل سجل
+    التغييرات. المسارات المجمعة تستدعي post_journal_entries بنفسها.
+    """
+    entries, reverse = [], {}
+
+    for obj in session.new:
+        model = type(obj)
+        if model in POSTING_SOURCES:
+            entries.append(document_entry(model, obj.id, lambda attr: getattr(obj, attr)))
+
+    for obj in session.deleted:
+        if type(obj) in POSTING_SOURCES:
+            reverse.setdefault(type(obj), []).append(obj.id)
+
+    for obj in session.dirty:
+        model = type(obj)
+        if model not in POSTING_SOURCES:
+            continue
+        state = db.inspect(obj)
+        if any(state.attrs[attr].history.has_changes() for attr in posting_attributes(model)):
+            reverse.setdefault(model, []).append(obj.id)
+            entries.append(document_entry(model, obj.id, lambda attr: getattr(obj, attr)))
+
+    reversals = []
+    for model, doc_ids in reverse.items():
+        reversals += reversal_entries(session, model, doc_ids)
+    post_journal_entries(session, reversals + [entry for entry in entries if entry])
+
+def seed_chart_of_accounts():
+    """إضافة حسابات الدليل الأساسي الناقصة (برمزها) - لا يعدل الحسابات الموجودة"""
+    existing = {row.code for row in db.session.query(Account.code)}
+    missing = [
+        {'code': code, 'key': key, 'name_ar': name_ar, 'name_en': name_en, 'account_type': account_type,
+         'is_active': True, 'created_at': datetime.utcnow()}
+        for code, key, name_ar, name_en, account_type in CHART_OF_ACCOUNTS if code not in existing
+    ]
+    if missing:
+        db.session.execute(Account.__table__.insert(), missing)
+        db.session.commit()
+        logger.info(f"✅ تمت إضافة {len(missing)} حساب إلى دليل الحسابات")
+
+def post_unposted_documents(chunk_size=5000):
+    """ترحيل المستندات التي ليس لها قيد (بيانات قبل الدفتر أو مدرجة من خارج التطبيق)
+
+    دفعات بترتيب المعرف، وكل دفعة في معاملتها: القيود والسطور بجملة واحدة لكل منهما
+    والأرصدة بجملة UPSERT واحدة. آمن للتكرار ويكمل من حيث توقف. يعيد عدد المستندات.
+
+    flask --app app post-ledger
+    """
+    posted = 0
+    for model, (doc_type, _, amount_attrs) in POSTING_SOURCES.items():
+        columns = [model.id, model.date, model.paid_amount, model.payment_method,
+                   *[getattr(model, attr) for attr in amount_attrs]]
+        unposted = ~db.exists().where(JournalEntry.doc_type == doc_type, JournalEntry.doc_id == model.id)
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(*columns).where(model.id > last_id, model.date.isnot(None), unposted)
+                .order_by(model.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            post_journal_entries(db.session, document_row_entries(model, [row.id for row in rows], rows))
+            db.session.commit()
+            posted += len(rows)
+            last_id = rows[-1].id
+    return posted
+
+def rebuild_account_balances():
+    """إعادة بناء account_balance من سطور القيود (بعد تعديل الدفتر مباشرة في القاعدة)
+
+    flask --app app rebuild-ledger-balances
+    """
+    db.session.info.pop('account_balance_deltas', None)
+    table = AccountBalance.__table__
+    line = JournalLine.__table__
+    month = month_key(line.c.date)
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['account_code', 'month', 'debit', 'credit'],
+        db.select(line.c.account_code, month, db.func.sum(line.c.debit), db.func.sum(line.c.credit))
+        .group_by(line.c.account_code, month)
+    ))
+    db.session.commit()
+
+def ledger_totals(date_from, date_to):
+    """{(رمز الحساب، 'opening' أو 'period'): [مدين، دائن]} باستعلام واحد
+
+    الأشهر الكاملة من account_balance (وكل ما قبل شهر البداية للرصيد الافتتاحي)، وأيام
+    الأشهر الجزئية في طرفي الفترة فقط من سطور القيود، فلا يمسح الاستعلام الدفتر كله.
+    """
+    balance = AccountBalance.__table__
+    line = JournalLine.__table__
+
+    def from_balances(section, condition):
+        return db.select(
+            db.literal(section).label('section'), balance.c.account_code,
+            db.func.sum(balance.c.debit).label('debit'), db.func.sum(balance.c.credit).label('credit')
+        ).where(condition).group_by(balance.c.account_code)
+
+    def from_lines(section, start, end):
+        return db.select(
+            db.literal(section).label('section'), line.c.account_code,
+            db.func.sum(line.c.debit).label('debit'), db.func.sum(line.c.credit).label('credit')
+        ).where(
+            line.c.date >= datetime.combine(start, datetime.min.time()),
+            line.c.date < datetime.combine(end + timedelta(days=1), datetime.min.time())
+        ).group_by(line.c.account_code)
+
+    first_month = date_from.replace(day=1)
+    selects = [from_balances('opening', balance.c.month < first_month.strftime('%Y-%m'))]
+    if date_from > first_month:
+        selects.append(from_lines('opening', first_month, date_from - timedelta(days=1)))
+
+    months, day_ranges, _ = split_period(date_from, date_to, None, True)
+    if months:
+        selects.append(from_balances('period', balance.c.month.in_(months)))
+    for start, end in day_ranges:
+        selects.append(from_lines('period', start, end))
+
+    totals = {}
+    for row in db.session.execute(db.union_all(*selects) if len(selects) > 1 else selects[0]):
+        bucket = totals.setdefault((row.account_code, row.section), [0, 0])
+        bucket[0] += row.debit or 0
+        bucket[1] += row.credit or 0
+    return totals
+
+def trial_balance(date_from, date_to):
+    """ميزان المراجعة لكل حساب: الرصيد الافتتاحي، حركة الفترة، والرصيد الختامي"""
+    totals = ledger_totals(date_from, date_to)
+    rows = []
+    for account in Account.query.order_by(Account.code):
+        opening_debit, opening_credit = totals.get((account.code, 'opening'), (0, 0))
+        debit, credit = totals.get((account.code, 'period'), (0, 0))
+        closing = opening_debit + debit - opening_credit - credit
+        rows.append({
+            'code': account.code,
+            'key': account.key,
+            'name_ar': account.name_ar,
+            'name_en': account.name_en,
+            'account_type': account.account_type,
+            'opening_balance': account_balance(account.account_type, opening_debit, opening_credit),
+            'debit': debit,
+            'credit': credit,
+            'movement': account_balance(account.account_type, debit, credit),
+            'closing_balance': account_balance(account.account_type, opening_debit + debit, opening_credit + credit),
+            # ميزان الأرصدة: الرصيد الختامي في عمود المدين أو الدائن
+            'closing_debit': max(closing, 0),
+            'closing_credit': max(-closing, 0)
+        })
+    return rows
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# إنشاء الجداول
-with app.app_context():
+def ensure_columns():
+    """إضافة أعمدة النماذج الناقصة إلى الجداول الموجودة مسبقاً
+
+    db.create_all() لا يعدل جدولاً موجوداً. الأعمدة المولدة (day/month) تضاف
+    VIRTUAL في SQLite لأنه لا يسمح بإضافة عمود STORED لجدول فيه بيانات، و STORED
+    في PostgreSQL.
+    """
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+                logger.info(f"✅ تمت إضافة العمود {table.name}.{column.name}")
+            except Exception as e:
+                logger.warning(f"تعذرت إضافة العمود {table.name}.{column.name}: {e}")
+
+def ensure_search_key_columns():
+    """تعبئة أعمدة *_search_key للصفوف التي ليس لها مفتاح
+
+    تشمل الصفوف القديمة قبل إضافة العمود والصفوف المدرجة من خارج التطبيق
+    (سكربتات sqlite3 مباشرة).
+    """
+    for model, sources in SEARCH_KEY_COLUMNS.items():
+        table = model.__table__
+        with db.engine.begin() as conn:
+            source_columns = sorted({column for columns in sources.values() for column in columns})
+            missing = db.or_(*[
+                db.and_(table.c[key_column].is_(None), db.or_(*[table.c[column].isnot(None) for column in columns]))
+                for key_column, columns in sources.items()
+            ])
+            rows = conn.execute(db.select(table.c.id, *[table.c[column] for column in source_columns]).where(missing))
+            updates = [{'row_id': row.id, **search_key_values(model, row._asdict())} for row in rows]
+            if updates:
+                conn.execute(
+                    table.update().where(table.c.id == db.bindparam('row_id'))
+                    .values({key_column: db.bindparam(key_column) for key_column in sources}),
+                    updates
+                )
+                logger.info(f"✅ تم تعبئة مفاتيح البحث لـ {len(updates)} صف في {table.name}")
+
+def sync_postgres_sequences():
+    """مزامنة عدادات SERIAL في PostgreSQL مع أكبر معرف في كل جدول
+
+    البيانات المنقولة بمعرفاتها (من SQLite مثلاً) لا تحرك العداد، فيفشل أول
+    إدراج بتكرار المفتاح. جملة واحدة لكل جدول عند التشغيل.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            column = table.autoincrement_column
+            if column is None:
+                continue
+            table_name = preparer.format_table(table)
+            conn.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence(:table, :column), COALESCE(MAX({column.name}), 0) + 1, false) "
+                f"FROM {table_name}"
+            ), {'table': table_name, 'column': column.name})
+
+def ensure_indexes():
+    """إنشاء الفهارس المعرفة في النماذج على قواعد البيانات الموجودة مسبقاً
+
+    db.create_all() لا يضيف فهارس لجداول موجودة، لذلك نمر على كل فهرس
+    وننشئه إذا لم يكن موجوداً.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# مصادر فهرس البحث النصي: (رقم المصدر، النوع، الجدول، العنوان، أعمدة المحتوى)
+SEARCH_SOURCES = [
+    SearchSource(0, 'expenses', 'expense', "COALESCE({expense_number}, '')",
+                 ['description', 'vendor', 'category', 'reference', 'notes',
+                  'description_search_key', 'vendor_search_key']),
+    SearchSource(1, 'products', 'product', '{name}', ['description', 'category', 'name_search_key']),
+    SearchSource(2, 'customers', 'customer', '{name}', ['phone', 'email', 'address', 'name_search_key']),
+    SearchSource(3, 'suppliers', 'supplier', '{name}', ['phone', 'email', 'address', 'name_search_key']),
+    SearchSource(4, 'sales', 'sale', "COALESCE({invoice_number}, '')", ['notes']),
+    SearchSource(5, 'purchases', 'purchase', "printf('PUR-%06d', {id})", ['notes']),
+]
+
+def ensure_text_search():
+    """إنشاء فهرس FTS5 ومحفزاته (SQLite فقط) وبناؤه من البيانات الموجودة أول مرة"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        if ensure_search_index(conn.connection.driver_connection, SEARCH_SOURCES):
+            logger.info("✅ تم بناء فهرس البحث النصي")
+
+# ============================================================================
+# AUTOCOMPLETE INDEX (in-memory prefix search)
+# ============================================================================
+
+# النوع -> (النموذج، الأعمدة المعادة للواجهة، الأعمدة المفهرسة)
+AUTOCOMPLETE_SOURCES = {
+    'products': (Product, ('name', 'price', 'category'), ('name',)),
+    'customers': (Customer, ('name', 'phone'), ('name', 'phone')),
+    'suppliers': (Supplier, ('name', 'phone'), ('name', 'phone')),
+}
+AUTOCOMPLETE_ENTITIES = {model: entity for entity, (model, _, _) in AUTOCOMPLETE_SOURCES.items()}
+
+class AutocompleteVersion(db.Model):
+    """رقم إصدار لكل نوع في فهرس الإكمال - يزيد في نفس معاملة أي تعديل على جدوله"""
+    __tablename__ = 'autocomplete_version'
+
+    entity = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# زيادة ذرية تعيد الإصدار الجديد؛ قفل الصف يرتب المعاملات فالإصدار قبلها هو الجديد - 1
+AUTOCOMPLETE_VERSION_BUMP_SQL = '''
+    INSERT INTO autocomplete_version (entity, version) VALUES (:entity, 1)
+    ON CONFLICT (entity) DO UPDATE SET version = autocomplete_version.version + 1
+    RETURNING version
+'''
+
+# النوع -> (الفهرس، إصدار الجدول الذي يطابقه محتوى الفهرس، وقت البناء)
+autocomplete_indexes = {}
+autocomplete_lock = threading.Lock()
+
+def autocomplete_record(entity, obj):
+    _, columns, _ = AUTOCOMPLETE_SOURCES[entity]
+    return {'id': obj.id, **{column: getattr(obj, column) for column in columns}}
+
+def autocomplete_version(entity):
+    """إصدار الجدول الحالي - قراءة صف واحد بالمفتاح الأساسي"""
+    return db.session.query(AutocompleteVersion.version).filter_by(entity=entity).scalar() or 0
+
+def get_autocomplete_index(entity):
+    """فهرس النوع - يبنى من القاعدة باستعلام واحد عند أول طلب أو عندما يصبح قديماً
+
+    الفهرس محلي للعملية، فكل طلب يقارن إصدار الجدول بالإصدار الذي بني منه الفهرس
+    ويعيد البناء إذا اختلفا (كتابة من عامل آخر) أو إذا تجاوز عمره AUTOCOMPLETE_MAX_AGE
+    (تعديل مباشر في القاعدة لا يمر بالتطبيق). الإصدار يقرأ قبل الصفوف، فالفهرس المبني
+    لا يدعي إصداراً أحدث من محتواه؛ وإن كان محتواه أحدث يعاد بناؤه في الطلب التالي.
+    """
+    model, columns, key_columns = AUTOCOMPLETE_SOURCES[entity]
+    version = autocomplete_version(entity)
+    with autocomplete_lock:
+        cached = autocomplete_indexes.get(entity)
+        if cached is not None:
+            index, known_version, built_at = cached
+            if known_version == version and time.monotonic() - built_at < app.config['AUTOCOMPLETE_MAX_AGE']:
+                return index
+
+        index = PrefixIndex(lambda record: word_keys(*(record[column] for column in key_columns)))
+        rows = db.session.query(model.id, *(getattr(model, column) for column in columns))
+        index.load(row._asdict() for row in rows)
+        autocomplete_indexes[entity] = (index, version, time.monotonic())
+        return index
+
+@db.event.listens_for(db.session, 'after_flush')
+def track_autocomplete_changes(session, flush_context):
+    """تسجيل الصفوف المضافة والمعدلة والمحذوفة لتطبيقها على الفهرس بعد الاعتماد"""
+    pending = session.info.setdefault('autocomplete_pending', [])
+    for action, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = AUTOCOMPLETE_ENTITIES.get(type(obj))
+            if not entity:
+                continue
+            if action == 'delete':
+                pending.append((entity, obj.id, None))
+            elif action == 'insert' or session.is_modified(obj, include_collections=False):
+                pending.append((entity, obj.id, autocomplete_record(entity, obj)))
+
+@db.event.listens_for(db.session, 'before_commit')
+def bump_autocomplete_versions(session):
+    """زيادة إصدار كل نوع عدلته المعاملة - بعد write_deferred_rows فتغييرات آخر flush مسجلة"""
+    if session.in_nested_transaction():
+        return
+    pending = session.info.get('autocomplete_pending')
+    if pending:
+        session.info['autocomplete_versions'] = {
+            entity: session.execute(db.text(AUTOCOMPLETE_VERSION_BUMP_SQL), {'entity': entity}).scalar_one()
+            for entity in sorted({entity for entity, _, _ in pending})
+        }
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_autocomplete_changes(session):
+    """تطبيق تغييرات المعاملة على الفهرس إذا كان يطابق الإصدار السابق لها مباشرة
+
+    وإلا فاتته تغييرات من عملية أخرى: يبقى إصداره القديم ويعاد بناؤه عند الطلب التالي.
+    """
+    pending = session.info.pop('autocomplete_pending', [])
+    for entity, version in session.info.pop('autocomplete_versions', {}).items():
+        with autocomplete_lock:
+            cached = autocomplete_indexes.get(entity)
+            if cached is None or cached[1] != version - 1:
+                continue
+            index, _, built_at = cached
+            for changed_entity, record_id, record in pending:
+                if changed_entity != entity:
+                    continue
+                if record is None:
+                    index.remove(record_id)
+                else:
+                    index.upsert(record)
+            autocomplete_indexes[entity] = (index, version, built_at)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_autocomplete_changes(session):
+    session.info.pop('autocomplete_pending', None)
+
+# ============================================================================
+# DATABASE INIT / MIGRATE (run once per deploy, not at import)
+# ============================================================================
+
+def init_database():
+    """إنشاء الجداول وترحيل القواعد القديمة والبيانات الأساسية - آمن للتكرار
+
+    لا يعمل عند استيراد الملف: يشغل مرة واحدة قبل بدء عمال gunicorn
+    (flask --app app init-db أو python init_db.py) حتى لا تتسابق العمليات على
+    create_all والترحيل وإنشاء المستخدم الافتراضي.
+    """
     db.create_all()
-    
+    ensure_columns()
+    sync_postgres_sequences()
+    ensure_search_key_columns()
+    ensure_indexes()
+    ensure_text_search()
+
+    if not db.session.get(DashboardStats, DASHBOARD_STATS_ROW_ID):
+        rebuild_dashboard_stats()
+    if not db.session.query(DailyRollup.doc_type).first():
+        rebuild_rollups()
+    seed_chart_of_accounts()
+    if not db.session.query(JournalEntry.id).first():
+        posted = post_unposted_documents()
+        if posted:
+            logger.info(f"✅ تم ترحيل {posted} مستند إلى دفتر الأستاذ")
+
     # إنشاء مستخدم افتراضي
     if not User.query.filter_by(username='admin').first():
         admin_user = User(
@@ -181,37 +1766,219 @@ with app.app_context():
         db.session.commit()
         logger.info("✅ تم إنشاء المستخدم الافتراضي")
 
-# إنشاء الجداول فقط
-with app.app_context():
-    db.create_all()
+@app.cli.command('init-db')
+def init_db_command():
+    """إنشاء الجداول وترحيلها: flask --app app init-db"""
+    init_database()
+    print("✅ قاعدة البيانات جاهزة")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """إعادة بناء جداول التجميع اليومية والشهرية: flask --app app rebuild-rollups"""
+    rebuild_rollups()
+    print("✅ تمت إعادة بناء جداول التجميع")
+
+@app.cli.command('post-ledger')
+def post_ledger_command():
+    """ترحيل المستندات التي ليس لها قيد إلى دفتر الأستاذ: flask --app app post-ledger"""
+    seed_chart_of_accounts()
+    print(f"✅ تم ترحيل {post_unposted_documents()} مستند")
+
+@app.cli.command('rebuild-ledger-balances')
+def rebuild_ledger_balances_command():
+    """إعادة بناء أرصدة الحسابات الشهرية من سطور القيود: flask --app app rebuild-ledger-balances"""
+    rebuild_account_balances()
+    print("✅ تمت إعادة بناء أرصدة الحسابات")
+
+def create_app(config=None):
+    """نقطة دخول gunicorn مع التحميل المسبق: gunicorn "app:create_app()" -c gunicorn.conf.py
+
+    المسارات والنماذج تسجل على app عند الاستيراد دون أي اتصال بالقاعدة، لذلك يعيد
+    المصنع نفس التطبيق بعد تطبيق config (إعدادات التشغيل مثل GROUP_COMMIT). عنوان
+    القاعدة يؤخذ من DATABASE_URL قبل الاستيراد، والجداول من أمر init-db.
+    """
+    if config:
+        app.config.update(config)
+    return app
 
-    # إنشاء مستخدم افتراضي إذا لم يكن موجوداً
-    if not User.query.filter_by(username='admin').first():
-        admin_user = User(
-            username='admin',
-            password_hash=generate_password_hash('admin112233'),
-            is_admin=True
+# ============================================================================
+# VIEW QUERY LAYER (column projection + eager loading)
+# ============================================================================
+
+def list_projection(module):
+    """صفوف خفيفة للقوائم والطباعة والتصدير: الأعمدة المطلوبة فقط مع اسم الطرف المقابل
+
+    الاستعلام يعيد صفوفاً (Row) لا كائنات مسجلة في الجلسة، واسم العميل أو
+    المورد أو الموظف يأتي من JOIN في نفس الاستعلام بدلاً من استعلام لكل صف.
+    """
+    if module == 'sales':
+        return db.session.query(
+            Sale.id, Sale.invoice_number, Sale.date, Sale.customer_id, Sale.subtotal, Sale.discount,
+            Sale.tax_rate, Sale.tax_amount, Sale.total, Sale.notes, Sale.payment_status, Sale.paid_amount,
+            Sale.payment_method, Customer.name.label('counterparty')
+        ).outerjoin(Customer, Sale.customer_id == Customer.id)
+
+    if module == 'purchases':
+        return db.session.query(
+            Purchase.id, Purchase.date, Purchase.supplier_id, Purchase.subtotal, Purchase.discount,
+            Purchase.total, Purchase.notes, Purchase.payment_status, Purchase.paid_amount,
+            Purchase.payment_method, Supplier.name.label('counterparty')
+        ).outerjoin(Supplier, Purchase.supplier_id == Supplier.id)
+
+    if module == 'expenses':
+        return db.session.query(
+            Expense.id, Expense.expense_number, Expense.date, Expense.description, Expense.amount,
+            Expense.expense_type, Expense.category, Expense.vendor, Expense.reference, Expense.notes,
+            Expense.payment_status, Expense.paid_amount, Expense.payment_method
         )
-        db.session.add(admin_user)
-        db.session.commit()
-        logger.info("✅ تم إنشاء المستخدم الافتراضي")
 
-    # إنشاء منتجات تجريبية (معطل مؤقتاً لحل مشكلة قاعدة البيانات)
-    # إنشاء منتجات تجريبية (معطل مؤقتاً لحل مشكلة قاعدة البيانات)
-    # if Product.query.count() == 0:
-    #     sample_products = [
-    #         Product(name='لابتوب ديل', description='لابتوب ديل انسبايرون 15', price=2500.00, cost=2000.00, stock_quantity=10, category='إلكترونيات'),
-    #         Product(name='ماوس لاسلكي', description='ماوس لاسلكي لوجيتك', price=150.00, cost=100.00, stock_quantity=50, category='إكسسوارات'),
-    #         Product(name='كيبورد ميكانيكي', description='كيبورد ميكانيكي للألعاب', price=300.00, cost=200.00, stock_quantity=25, category='إكسسوارات'),
-    #         Product(name='شاشة 24 بوصة', description='شاشة LED 24 بوصة', price=800.00, cost=600.00, stock_quantity=15, category='إلكترونيات'),
-    #         Product(name='طابعة HP', description='طابعة HP ليزر', price=1200.00, cost=900.00, stock_quantity=8, category='مكتبية')
-    #     ]
-    #
-    #     for product in sample_products:
-    #         db.session.add(product)
-    #
-    #     db.session.commit()
-    #     logger.info("✅ تم إنشاء المنتجات التجريبية")
+    if module == 'payroll':
+        return db.session.query(
+            Payroll.id, Payroll.date, Payroll.employee_id, Payroll.month, Payroll.amount, Payroll.notes,
+            Payroll.payment_status, Payroll.paid_amount, Payroll.payment_method,
+            Employee.name.label('counterparty'), Employee.position.label('position')
+        ).outerjoin(Employee, Payroll.employee_id == Employee.id)
+
+    raise ValueError('نوع الوحدة غير صحيح')
+
+# خيارات التحميل المسبق للشاشات التي تحتاج الكائن الكامل مع علاقاته
+VIEW_LOAD_OPTIONS = {
+    'sale_detail': lambda: (db.joinedload(Sale.customer), db.selectinload(Sale.items)),
+    'purchase_detail': lambda: (db.joinedload(Purchase.supplier),),
+    'payroll_detail': lambda: (db.joinedload(Payroll.employee),),
+}
+
+def load_for_view(model, view):
+    """model.query مع التحميل المسبق المعرف للشاشة"""
+    return model.query.options(*VIEW_LOAD_OPTIONS[view]())
+
+# ----------------------------------------------------------------------------
+# ميزانية الاستعلامات لكل طلب: عدد الاستعلامات يجب ألا يعتمد على عدد الصفوف
+# ----------------------------------------------------------------------------
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def count_request_queries(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        counter = g.get('query_counter')
+        if counter is not None:
+            counter['count'] += 1
+
+def query_budget(max_queries):
+    """يتحقق بعد انتهاء الاستجابة (بما فيها المتدفقة) أن عدد الاستعلامات ثابت
+
+    يسجل تحذيراً عند التجاوز، ويرفع AssertionError إذا كان
+    QUERY_BUDGET_STRICT مفعلاً (في الاختبارات).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            counter = {'count': 0}
+            g.query_counter = counter
+            response = app.make_response(view(*args, **kwargs))
+
+            def check_budget():
+                if counter['count'] > max_queries:
+                    message = f"{view.__name__}: {counter['count']} استعلام (الحد {max_queries})"
+                    logger.warning(f"⚠️ تجاوز ميزانية الاستعلامات - {message}")
+                    if app.config.get('QUERY_BUDGET_STRICT'):
+                        raise AssertionError(message)
+
+            response.call_on_close(check_budget)
+            return response
+        return wrapper
+    return decorator
+
+# ============================================================================
+# GROUP COMMIT WRITER (opt-in)
+# ============================================================================
+
+class GroupCommitWriter:
+    """خيط كتابة واحد يجمع الكتابات الصغيرة من الطلبات المتزامنة في معاملة واحدة
+
+    الخيط يأخذ كل ما وصل أثناء اعتماد الدفعة السابقة (وينتظر المزيد حتى
+    GROUP_COMMIT_MAX_WAIT_MS، بحد GROUP_COMMIT_MAX_BATCH عملية)، وينفذ كل عملية في
+    SAVEPOINT خاص، ثم يعتمد الدفعة مرة واحدة: قفل كتابة واحد و fsync واحد بدلاً
+    من واحد لكل طلب. العملية الفاشلة يتراجع SAVEPOINT الخاص
+    بها فقط ويعاد خطؤها إلى طلبها.
+    """
+
+    def __init__(self, max_batch, max_wait):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, work):
+        """تنفيذ work() في الدفعة التالية وإعادة نتيجتها بعد الاعتماد (أو رفع خطئها)"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='group-commit-writer', daemon=True)
+                self.thread.start()
+        future = Future()
+        self.jobs.put((work, future))
+        return future.result()
+
+    def next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.jobs.get(timeout=remaining) if remaining > 0 else self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        with app.app_context():
+            while True:
+                self.commit_batch(self.next_batch())
+
+    def commit_batch(self, batch):
+        outcomes = {}
+        try:
+            begin_batch_transaction()
+            for work, future in batch:
+                # تغييرات فهرس الإكمال وسجل التغييرات المسجلة داخل SAVEPOINT تم التراجع عنه لا تطبق
+                pending = deferred_session_work()
+                try:
+                    with db.session.begin_nested():
+                        outcomes[future] = (work(), None)
+                except Exception as e:
+                    restore_deferred_session_work(pending)
+                    outcomes[future] = (None, e)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            outcomes = {future: (None, outcomes.get(future, (None, None))[1] or e) for _, future in batch}
+        finally:
+            db.session.remove()
+
+        for _, future in batch:
+            result, error = outcomes.get(future, (None, None))
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+group_commit_writer = GroupCommitWriter(
+    app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_WAIT_MS'] / 1000
+)
+
+def commit_write(work):
+    """تنفيذ كتابة صغيرة واعتمادها - work() يضيف إلى db.session بدون commit ويعيد النتيجة
+
+    مع GROUP_COMMIT تنفذ work() في خيط الكاتب ضمن دفعة مشتركة، لذلك تقرأ بيانات
+    الطلب قبلها ولا تستخدم request أو كائنات محملة في جلسة الطلب.
+    """
+    if app.config['GROUP_COMMIT']:
+        # إعادة اتصال الطلب إلى المجمع أثناء الانتظار حتى لا يبقى الكاتب بلا اتصال
+        db.session.close()
+        return group_commit_writer.submit(work)
+    result = work()
+    db.session.commit()
+    return result
 
 # Routes الأساسية
 @app.route('/')
@@ -251,62 +2018,185 @@ def logout():
 @login_required
 def dashboard():
     """لوحة التحكم"""
-    # إحصائيات سريعة
-    stats = {
-        'sales_count': Sale.query.count(),
-        'purchases_count': Purchase.query.count(),
-        'expenses_count': Expense.query.count(),
-        'employees_count': Employee.query.count(),
-        'total_sales': db.session.query(db.func.sum(Sale.total)).scalar() or 0,
-        'total_purchases': db.session.query(db.func.sum(Purchase.total)).scalar() or 0,
-        'total_expenses': db.session.query(db.func.sum(Expense.amount)).scalar() or 0,
-        'total_discount_sales': db.session.query(db.func.sum(Sale.discount)).scalar() or 0,
-        'total_discount_purchases': db.session.query(db.func.sum(Purchase.discount)).scalar() or 0,
-        'total_salaries': db.session.query(db.func.sum(Employee.salary)).scalar() or 0
-    }
+    # إحصائيات سريعة من صف الملخص المحدث مع كل حفظ
+    stats = get_dashboard_stats()
 
     return render_template('dashboard_new.html', stats=stats)
 
+# ============================================================================
+# UNIFIED PAYMENTS LEDGER (UNION ALL)
+# ============================================================================
+
+PAYMENT_STATUSES = ('paid', 'partial', 'unpaid', 'overdue')
+
+# نوع المستند -> (النموذج، حقل المبلغ، حقل الرقم، بادئة الرقم الافتراضي)
+LEDGER_SOURCES = {
+    'sales': (Sale, 'total', 'invoice_number', 'INV'),
+    'purchases': (Purchase, 'total', None, 'PUR'),
+    'expenses': (Expense, 'amount', 'expense_number', 'EXP'),
+    'payroll': (Payroll, 'amount', None, 'PAY'),
+}
+
+LEDGER_SORT_COLUMNS = ('date', 'amount', 'remaining', 'number')
+
+def ledger_branch(doc_type, with_details=False, status=None, date_from=None, date_to=None):
+    """SELECT لنوع مستند واحد بأعمدة موحدة ليدخل في UNION ALL"""
+    model, amount_attr, number_attr, _ = LEDGER_SOURCES[doc_type]
+    amount = db.func.coalesce(getattr(model, amount_attr), 0)
+    payment_status = db.func.coalesce(model.payment_status, 'unpaid')
+    # الفواتير القديمة المعلمة كمدفوعة قد لا يكون لها paid_amount
+    settled = db.case((payment_status == 'paid', amount), else_=db.func.coalesce(model.paid_amount, 0))
+
+    columns = [
+        db.literal(doc_type).label('doc_type'),
+        payment_status.label('payment_status'),
+        amount.label('amount'),
+        settled.label('paid_amount'),
+    ]
+    select = None
+
+    if with_details:
+        columns += [
+            model.id.label('doc_id'),
+            (getattr(model, number_attr) if number_attr else db.null()).label('number'),
+            model.date.label('date'),
+            (amount - settled).label('remaining'),
+        ]
+        if doc_type == 'sales':
+            select = db.select(*columns, Customer.name.label('counterparty')).outerjoin(Customer, Sale.customer_id == Customer.id)
+        elif doc_type == 'purchases':
+            select = db.select(*columns, Supplier.name.label('counterparty')).outerjoin(Supplier, Purchase.supplier_id == Supplier.id)
+        elif doc_type == 'payroll':
+            select = db.select(*columns, Employee.name.label('counterparty')).outerjoin(Employee, Payroll.employee_id == Employee.id)
+        else:
+            select = db.select(*columns, Expense.vendor.label('counterparty'))
+    else:
+        select = db.select(*columns)
+
+    if status:
+        select = select.where(model.payment_status == status)
+    # فترة نصف مفتوحة [date_from, date_to) على العمود نفسه حتى يستخدم الفهرس
+    if date_from:
+        select = select.where(model.date >= date_from)
+    if date_to:
+        select = select.where(model.date < date_to)
+    return select
+
+def payment_status_breakdown(doc_types, date_from=None, date_to=None):
+    """العدد والمبلغ والمدفوع لكل (نوع مستند، حالة دفع) في استعلام GROUP BY واحد"""
+    ledger = db.union_all(*[
+        ledger_branch(doc_type, date_from=date_from, date_to=date_to) for doc_type in doc_types
+    ]).subquery('ledger')
+    return db.session.execute(db.select(
+        ledger.c.doc_type,
+        ledger.c.payment_status,
+        db.func.count().label('count'),
+        db.func.sum(ledger.c.amount).label('amount'),
+        db.func.sum(ledger.c.paid_amount).label('paid_amount'),
+    ).group_by(ledger.c.doc_type, ledger.c.payment_status)).all()
+
+def payments_ledger_summary(date_from=None, date_to=None):
+    """ملخص المدفوعات والمستحقات من استعلام GROUP BY واحد فوق UNION ALL"""
+    rows = payment_status_breakdown(list(LEDGER_SOURCES), date_from, date_to)
+
+    summary = {
+        'total_amount': 0, 'total_paid': 0, 'total_due': 0,
+        'invoices_count': 0, 'unpaid_count': 0,
+    }
+    summary['status_counts'] = {status: 0 for status in PAYMENT_STATUSES}
+    summary.update({f'{doc_type}_amount': 0 for doc_type in LEDGER_SOURCES})
+
+    for row in rows:
+        summary['total_amount'] += row.amount or 0
+        summary['total_paid'] += row.paid_amount or 0
+        summary['invoices_count'] += row.count
+        summary[f'{row.doc_type}_amount'] += row.amount or 0
+        if row.payment_status in PAYMENT_STATUSES:
+            summary['status_counts'][row.payment_status] += row.count
+        if row.payment_status != 'paid':
+            summary['unpaid_count'] += row.count
+
+    summary['total_due'] = summary['total_amount'] - summary['total_paid']
+    return summary
+
 @app.route('/payments_dues')
 @login_required
 def payments_dues():
     """صفحة المدفوعات والمستحقات"""
-    # جمع البيانات من جميع الجداول
-    sales_list = Sale.query.all()
-    purchases_list = Purchase.query.all()
-    expenses_list = Expense.query.all()
-    payrolls_list = Payroll.query.all()
+    # الإحصائيات من استعلام تجميعي واحد - الصفوف تجلب من /api/payments/ledger
+    summary_data = payments_ledger_summary()
 
-    # حساب الإحصائيات
-    total_sales = sum(s.total for s in sales_list)
-    total_purchases = sum(p.total for p in purchases_list)
-    total_expenses = sum(e.amount for e in expenses_list)
-    total_payrolls = sum(p.amount for p in payrolls_list)
+    return render_template('payments_dues.html', summary_data=summary_data)
 
-    summary_data = {
-        'total_amount': total_sales + total_purchases + total_expenses + total_payrolls,
-        'total_paid': total_sales + total_purchases + total_expenses + total_payrolls,  # افتراض أن كل شيء مدفوع
-        'total_due': 0,  # يمكن حسابها لاحقاً
-        'unpaid_count': 0,  # يمكن حسابها لاحقاً
-        'sales_amount': total_sales,
-        'purchases_amount': total_purchases,
-        'expenses_amount': total_expenses,
-        'payroll_amount': total_payrolls
-    }
+@app.route('/api/payments/ledger', methods=['GET'])
+@login_required
+def get_payments_ledger():
+    """سجل موحد للمبيعات والمشتريات والمصروفات والرواتب مع ترقيم وفرز وتصفية"""
+    try:
+        doc_types = [t for t in request.args.get('type', '').split(',') if t] or list(LEDGER_SOURCES)
+        if any(t not in LEDGER_SOURCES for t in doc_types):
+            return jsonify({'success': False, 'message': 'نوع المستند غير صحيح'})
+
+        status = request.args.get('payment_status', '')
+        if status and status not in PAYMENT_STATUSES:
+            return jsonify({'success': False, 'message': 'حالة الدفع غير صحيحة'})
+
+        sort = request.args.get('sort', 'date')
+        if sort not in LEDGER_SORT_COLUMNS:
+            return jsonify({'success': False, 'message': 'عمود الفرز غير صحيح'})
+        descending = request.args.get('order', 'desc') != 'asc'
+
+        page = max(request.args.get('page', 1, type=int), 1)
+        limit = min(max(request.args.get('limit', LIST_PAGE_SIZE, type=int), 1), LIST_PAGE_MAX)
+
+        ledger = db.union_all(*[ledger_branch(t, with_details=True, status=status) for t in doc_types]).subquery('ledger')
+        sort_column = ledger.c[sort]
+        query = db.select(ledger).order_by(
+            sort_column.desc() if descending else sort_column.asc(),
+            ledger.c.doc_type,
+            ledger.c.doc_id.desc() if descending else ledger.c.doc_id.asc()
+        ).limit(limit + 1).offset((page - 1) * limit)
+
+        rows = db.session.execute(query).all()
+        has_more = len(rows) > limit
+
+        items = []
+        for row in rows[:limit]:
+            prefix = LEDGER_SOURCES[row.doc_type][3]
+            items.append({
+                'type': row.doc_type,
+                'id': row.doc_id,
+                'number': row.number or f"{prefix}-{row.doc_id:06d}",
+                'counterparty': row.counterparty,
+                'date': row.date.isoformat() if row.date else None,
+                'amount': row.amount,
+                'paid_amount': row.paid_amount,
+                'remaining': row.remaining,
+                'payment_status': row.payment_status
+            })
 
-    return render_template('payments_dues.html',
-                         summary_data=summary_data,
-                         sales=sales_list,
-                         purchases=purchases_list,
-                         expenses=expenses_list,
-                         payrolls=payrolls_list)
+        return jsonify({
+            'success': True,
+            'items': items,
+            'count': len(items),
+            'page': page,
+            'limit': limit,
+            'has_more': has_more
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في جلب سجل المدفوعات: {str(e)}'})
 
 @app.route('/sales')
 @login_required
+@query_budget(4)
 def sales():
-    """صفحة المبيعات"""
-    sales_list = Sale.query.order_by(Sale.date.desc()).all()
-    customers = Customer.query.all()
+    """صفحة المبيعات - صفحة واحدة من الفواتير وملخص مجمع من SQL"""
+    try:
+        sales_list, next_cursor = list_page('sales')
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('sales'))
 
     # إضافة فروع وهمية للاختبار
     branches = [
@@ -316,46 +2206,59 @@ def sales():
 
     return render_template('sales.html',
                          sales=sales_list,
-                         customers=customers,
+                         next_cursor=next_cursor,
+                         summary_data=list_summary('sales'),
                          branches=branches,
                          selected_branch=None)
 
 @app.route('/purchases')
 @login_required
+@query_budget(4)
 def purchases():
-    """صفحة المشتريات"""
-    purchases_list = Purchase.query.order_by(Purchase.date.desc()).all()
-    suppliers = Supplier.query.all()
+    """صفحة المشتريات - صفحة واحدة من الفواتير وملخص مجمع من SQL"""
+    try:
+        purchases_list, next_cursor = list_page('purchases')
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('purchases'))
 
     # حساب الإحصائيات
+    summary = list_summary('purchases')
     summary_data = {
-        'total_purchases': sum(p.total for p in purchases_list),
-        'total_paid': sum(p.total for p in purchases_list),  # افتراض أن كل المشتريات مدفوعة
-        'pending_purchases': 0,  # يمكن حسابها لاحقاً
-        'invoices_count': len(purchases_list)
+        'total_purchases': summary['total'],
+        'total_paid': summary['paid'],
+        'pending_purchases': summary['pending'],
+        'invoices_count': summary['count']
     }
 
     return render_template('purchases.html',
                          purchases=purchases_list,
-                         suppliers=suppliers,
+                         next_cursor=next_cursor,
                          summary_data=summary_data)
 
 @app.route('/expenses')
 @login_required
+@query_budget(4)
 def expenses():
     """صفحة المصروفات - تم إعادة توجيهها للصفحة الجديدة التي تعمل"""
-    expenses_list = Expense.query.order_by(Expense.date.desc()).all()
+    try:
+        expenses_list, next_cursor = list_page('expenses')
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('expenses'))
 
     # حساب الإحصائيات
+    summary = list_summary('expenses')
     summary_data = {
-        'total_expenses': sum(e.amount for e in expenses_list),
-        'expenses_count': len(expenses_list),
-        'pending_expenses': sum(e.amount for e in expenses_list if e.payment_status != 'paid'),
-        'avg_expense': sum(e.amount for e in expenses_list) / len(expenses_list) if expenses_list else 0
+        'total_expenses': summary['total'],
+        'expenses_count': summary['count'],
+        'pending_expenses': summary['pending'],
+        'avg_expense': summary['average']
     }
 
     # استخدام الصفحة الجديدة التي تعمل
-    return render_template('expenses_new.html', expenses=expenses_list, summary_data=summary_data)
+    return render_template('expenses_new.html', expenses=expenses_list, next_cursor=next_cursor,
+                           summary_data=summary_data)
 
 # مسارات إنشاء الفواتير الجديدة
 @app.route('/sales/new')
@@ -425,31 +2328,261 @@ def preview_purchase_page(purchase_id):
     flash(f'🚧 معاينة فاتورة المشتريات رقم {purchase_id} قيد التطوير', 'info')
     return redirect(url_for('purchases'))
 
+# ============================================================================
+# STREAMING EXPORT ENGINE (CSV / XLSX)
+# ============================================================================
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+PAYMENT_STATUS_LABELS = {
+    'paid': 'مدفوع',
+    'partial': 'مدفوع جزئياً',
+    'unpaid': 'غير مدفوع',
+    'overdue': 'متأخر'
+}
+
+def format_export_date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+def export_definition(module):
+    """(عنوان الملف، العناوين، الاستعلام المصفى، دالة تحويل الصف إلى خلايا) لكل وحدة
+
+    الاستعلام يطبق نفس مرشحات البحث والقوائم على list_projection.
+    """
+    if module == 'sales':
+        query = filter_list_query(Sale, Sale.customer_id, 'customer_id', list_projection('sales'))
+        headers = ['رقم الفاتورة', 'التاريخ', 'العميل', 'المبلغ الفرعي', 'الخصم', 'الضريبة',
+                   'المجموع', 'المدفوع', 'حالة الدفع', 'طريقة الدفع', 'ملاحظات']
+        to_cells = lambda row: [
+            row.invoice_number or f"INV-{row.id:06d}", format_export_date(row.date), row.counterparty or 'عميل نقدي',
+            row.subtotal or 0, row.discount or 0, row.tax_amount or 0, row.total or 0, row.paid_amount or 0,
+            PAYMENT_STATUS_LABELS.get(row.payment_status, 'غير مدفوع'), row.payment_method or '', row.notes or ''
+        ]
+        model = Sale
+
+    elif module == 'purchases':
+        query = filter_list_query(Purchase, Purchase.supplier_id, 'supplier_id', list_projection('purchases'))
+        headers = ['رقم الفاتورة', 'التاريخ', 'المورد', 'المبلغ الفرعي', 'الخصم', 'المجموع',
+                   'المدفوع', 'حالة الدفع', 'طريقة الدفع', 'ملاحظات']
+        to_cells = lambda row: [
+            f"PUR-{row.id:06d}", format_export_date(row.date), row.counterparty or 'مورد نقدي',
+            row.subtotal or 0, row.discount or 0, row.total or 0, row.paid_amount or 0,
+            PAYMENT_STATUS_LABELS.get(row.payment_status, 'غير مدفوع'), row.payment_method or '', row.notes or ''
+        ]
+        model = Purchase
+
+    elif module == 'expenses':
+        query = apply_expense_search_filters(
+            filter_list_query(Expense, Expense.vendor, 'vendor', list_projection('expenses')))
+        headers = ['رقم المصروف', 'التاريخ', 'نوع المصروف', 'الوصف', 'المبلغ', 'طريقة الدفع',
+                   'المورد', 'رقم المرجع', 'حالة الدفع', 'ملاحظات']
+        to_cells = lambda row: [
+            row.expense_number or f"EXP-{row.id:06d}", format_export_date(row.date),
+            row.expense_type or row.category or '', row.description or '', row.amount or 0,
+            row.payment_method or '', row.vendor or '', row.reference or '',
+            PAYMENT_STATUS_LABELS.get(row.payment_status, 'غير مدفوع'), row.notes or ''
+        ]
+        model = Expense
+
+    elif module == 'payroll':
+        query = filter_list_query(Payroll, Payroll.employee_id, 'employee_id', list_projection('payroll'))
+        headers = ['رقم الكشف', 'التاريخ', 'الموظف', 'الشهر', 'المبلغ', 'المدفوع',
+                   'حالة الدفع', 'طريقة الدفع', 'ملاحظات']
+        to_cells = lambda row: [
+            f"PAY-{row.id:06d}", format_export_date(row.date), row.counterparty or 'موظف غير محدد', row.month or '',
+            row.amount or 0, row.paid_amount or 0,
+            PAYMENT_STATUS_LABELS.get(row.payment_status, 'غير مدفوع'), row.payment_method or '', row.notes or ''
+        ]
+        model = Payroll
+
+    else:
+        raise ValueError('نوع الوحدة غير صحيح')
+
+    query = query.order_by(model.date.desc(), model.id.desc())
+    return module, headers, query, to_cells
+
+def iter_export_rows(query, to_cells):
+    """جلب الصفوف على دفعات من مؤشر القاعدة بدلاً من .all()"""
+    for row in query.yield_per(EXPORT_CHUNK_SIZE):
+        yield to_cells(row)
+
+def generate_csv(headers, rows):
+    """توليد CSV على دفعات - BOM في البداية ليفتح Excel النص العربي بشكل صحيح"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    output.write('\ufeff')
+    writer.writerow(headers)
+    yield output.getvalue()
+
+    pending = 0
+    output.seek(0)
+    output.truncate()
+    for cells in rows:
+        writer.writerow(cells)
+        pending += 1
+        if pending >= EXPORT_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+            pending = 0
+
+    if pending:
+        yield output.getvalue()
+
+class StreamBuffer:
+    """ملف للكتابة فقط يجمع ما يكتبه zipfile ليفرغه المولد أولاً بأول
+
+    غياب seek يجعل zipfile يكتب واصفات البيانات بعد كل ملف، فيمكن إرسال
+    الأرشيف أثناء إنشائه.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# محارف التحكم غير المسموحة في XML
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = xml_escape(XML_INVALID_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def xlsx_row(cells):
+    return '<row>' + ''.join(xlsx_cell(value) for value in cells) + '</row>'
+
+def generate_xlsx(headers, rows, sheet_name):
+    """توليد ملف XLSX بالكتابة فقط: ورقة واحدة بنصوص مضمنة تكتب صفاً صفاً"""
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{xml_escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView rightToLeft="1" workbookViewId="0"/></sheetViews>'
+                '<sheetData>' + xlsx_row(headers)
+            ).encode('utf-8'))
+
+            chunk = []
+            for cells in rows:
+                chunk.append(xlsx_row(cells))
+                if len(chunk) >= EXPORT_CHUNK_SIZE:
+                    sheet.write(''.join(chunk).encode('utf-8'))
+                    chunk = []
+                    yield buffer.drain()
+
+            sheet.write((''.join(chunk) + '</sheetData></worksheet>').encode('utf-8'))
+
+    yield buffer.drain()
+
+def stream_export(module):
+    """استجابة تصدير متدفقة: أول بايت يخرج فوراً والذاكرة ثابتة مهما كبر الملف"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('صيغة التصدير غير مدعومة')
+
+    name, headers, query, to_cells = export_definition(module)
+    rows = iter_export_rows(query, to_cells)
+    filename = f'{name}_{datetime.now().strftime("%Y%m%d")}.{export_format}'
+
+    if export_format == 'xlsx':
+        body = generate_xlsx(headers, rows, name)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = generate_csv(headers, rows)
+        mimetype = 'text/csv; charset=utf-8'
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
 # مسارات API للتصدير
 @app.route('/api/sales/export')
 @login_required
+@reporting_snapshot
 def export_sales_api():
     """تصدير المبيعات"""
     try:
-        # يمكن إضافة منطق التصدير الفعلي هنا
-        flash('🚧 تصدير المبيعات قيد التطوير', 'info')
-        return redirect(url_for('sales'))
+        return stream_export('sales')
     except Exception as e:
         flash(f'❌ خطأ في تصدير المبيعات: {str(e)}', 'error')
         return redirect(url_for('sales'))
 
 @app.route('/api/purchases/export')
 @login_required
+@reporting_snapshot
 def export_purchases_api():
     """تصدير المشتريات"""
     try:
-        # يمكن إضافة منطق التصدير الفعلي هنا
-        flash('🚧 تصدير المشتريات قيد التطوير', 'info')
-        return redirect(url_for('purchases'))
+        return stream_export('purchases')
     except Exception as e:
         flash(f'❌ خطأ في تصدير المشتريات: {str(e)}', 'error')
         return redirect(url_for('purchases'))
 
+@app.route('/api/payroll/export')
+@login_required
+@reporting_snapshot
+def export_payroll_api():
+    """تصدير كشوف الرواتب"""
+    try:
+        return stream_export('payroll')
+    except Exception as e:
+        flash(f'❌ خطأ في تصدير الرواتب: {str(e)}', 'error')
+        return redirect(url_for('employee_payroll'))
+
 @app.route('/expenses_test')
 @login_required
 def expenses_test():
@@ -502,22 +2635,43 @@ def employees():
 
 @app.route('/employee_payroll')
 @login_required
+@query_budget(4)
 def employee_payroll():
-    """صفحة الموظفين والرواتب"""
-    payrolls_list = Payroll.query.order_by(Payroll.date.desc()).all()
-    employees_list = Employee.query.all()
+    """صفحة الموظفين والرواتب - صفحة واحدة من الرواتب وإجماليات مجمعة من SQL"""
+    try:
+        payrolls_list, next_cursor = list_page('payroll')
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('employee_payroll'))
+
+    # الموظفون مع عدد رواتب كل منهم ومجموعها في استعلام واحد (GROUP BY في SQL)
+    totals = db.session.query(
+        Payroll.employee_id,
+        db.func.count(Payroll.id).label('payroll_count'),
+        db.func.coalesce(db.func.sum(Payroll.amount), 0).label('payroll_total')
+    ).group_by(Payroll.employee_id).subquery()
+    employee_rows = db.session.query(
+        Employee,
+        db.func.coalesce(totals.c.payroll_count, 0),
+        db.func.coalesce(totals.c.payroll_total, 0)
+    ).outerjoin(totals, totals.c.employee_id == Employee.id).order_by(Employee.id).all()
+    employees_list = [employee for employee, _, _ in employee_rows]
+    employee_totals = {employee.id: {'count': count, 'total': total} for employee, count, total in employee_rows}
 
     # حساب الإحصائيات
+    summary = list_summary('payroll')
     summary_data = {
         'total_employees': len(employees_list),
-        'total_payrolls': len(payrolls_list),
-        'total_paid': sum(p.amount for p in payrolls_list),
-        'pending_amount': 0  # يمكن حسابها لاحقاً
+        'total_payrolls': summary['count'],
+        'total_paid': summary['total'],
+        'pending_amount': summary['pending']
     }
 
     return render_template('employee_payroll.html',
                          payrolls=payrolls_list,
+                         next_cursor=next_cursor,
                          employees=employees_list,
+                         employee_totals=employee_totals,
                          summary_data=summary_data)
 
 @app.route('/payroll')
@@ -526,25 +2680,33 @@ def payroll():
     """إعادة توجيه إلى صفحة الموظفين والرواتب"""
     return redirect(url_for('employee_payroll'))
 
+def search_by_name(model):
+    """قائمة النموذج مرشحة بمعامل search على name_search_key (نطاق على الفهرس)"""
+    query = model.query
+    condition = search_key_prefix(model.name_search_key, request.args.get('search', ''))
+    if condition is not None:
+        query = query.filter(condition).order_by(model.name_search_key)
+    return query
+
 @app.route('/customers')
 @login_required
 def customers():
-    """صفحة العملاء"""
-    customers_list = Customer.query.all()
+    """صفحة العملاء - search اختياري (بداية الاسم بعد التطبيع العربي)"""
+    customers_list = search_by_name(Customer).all()
     return render_template('customers.html', customers=customers_list)
 
 @app.route('/suppliers')
 @login_required
 def suppliers():
-    """صفحة الموردين"""
-    suppliers_list = Supplier.query.all()
+    """صفحة الموردين - search اختياري (بداية الاسم بعد التطبيع العربي)"""
+    suppliers_list = search_by_name(Supplier).all()
     return render_template('suppliers.html', suppliers=suppliers_list)
 
 @app.route('/products')
 @login_required
 def products():
-    """صفحة المنتجات الموحدة مع التكاليف"""
-    products_list = Product.query.all()
+    """صفحة المنتجات الموحدة مع التكاليف - search اختياري (بداية الاسم بعد التطبيع العربي)"""
+    products_list = search_by_name(Product).all()
     return render_template('unified_products.html', products=products_list)
 
 @app.route('/inventory')
@@ -554,6 +2716,318 @@ def inventory():
     products_list = Product.query.all()
     return render_template('inventory.html', products=products_list)
 
+# ============================================================================
+# PERIOD TOTALS (generated day/month columns)
+# ============================================================================
+
+PERIOD_GRAINS = ('day', 'month')
+
+def period_totals_query(doc_type, grain, date_from=None, date_to=None):
+    """العدد والمبلغ لكل يوم أو شهر مرتبة بالفترة
+
+    التجميع على العمود المولد المفهرس مع المبلغ (day/month, amount) فيقرأ
+    SQLite الفهرس بالترتيب دون حساب الفترة لكل صف ودون فرز مؤقت. date_from و
+    date_to (YYYY-MM-DD) شاملان للفترات التي يقعان فيها.
+    """
+    model, amount_attr, _, _ = LEDGER_SOURCES[doc_type]
+    # شهر الرواتب هو شهر الاستحقاق المخزن وليس شهر التاريخ
+    bucket = getattr(model, grain)
+    width = 10 if grain == 'day' else 7
+
+    query = db.session.query(
+        bucket.label('period'),
+        db.func.count().label('count'),
+        db.func.coalesce(db.func.sum(getattr(model, amount_attr)), 0).label('amount')
+    )
+    if date_from:
+        query = query.filter(bucket >= date_from.strftime('%Y-%m-%d')[:width])
+    if date_to:
+        query = query.filter(bucket <= date_to.strftime('%Y-%m-%d')[:width])
+    return query.filter(bucket.isnot(None)).group_by(bucket).order_by(bucket)
+
+@app.route('/api/reports/periods', methods=['GET'])
+@login_required
+@reporting_snapshot
+@query_budget(2)
+def api_period_totals():
+    """المجاميع اليومية أو الشهرية لنوع مستند: type, grain (day|month), date_from, date_to"""
+    try:
+        doc_type = request.args.get('type', 'sales')
+        grain = request.args.get('grain', 'month')
+        if doc_type not in LEDGER_SOURCES:
+            return jsonify({'success': False, 'message': 'نوع المستند غير صحيح'})
+        if grain not in PERIOD_GRAINS:
+            return jsonify({'success': False, 'message': 'الفترة يجب أن تكون day أو month'})
+
+        date_from = request.args.get('date_from', '')
+        date_to = request.args.get('date_to', '')
+        rows = period_totals_query(
+            doc_type, grain,
+            datetime.strptime(date_from, '%Y-%m-%d') if date_from else None,
+            datetime.strptime(date_to, '%Y-%m-%d') if date_to else None
+        ).all()
+
+        return jsonify({
+            'success': True,
+            'type': doc_type,
+            'grain': grain,
+            'periods': [{'period': row.period, 'count': row.count, 'amount': row.amount} for row in rows],
+            'snapshot_at': g.reporting_snapshot_at.isoformat(timespec='seconds') if g.reporting_snapshot_at else None
+        })
+
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في حساب مجاميع الفترات: {str(e)}'})
+
+ROLLUP_DOC_TYPES = [doc_type for doc_type, _, _ in ROLLUP_SOURCES.values()]
+
+def rollup_report_totals(doc_types, rows):
+    """إجمالي المقاييس لكل نوع مستند مطلوب من صفوف rollup_report (أصفار إن لم توجد صفوف)"""
+    totals = {doc_type: dict.fromkeys(ROLLUP_MEASURES, 0) for doc_type in doc_types}
+    for row in rows:
+        bucket = totals[row['doc_type']]
+        for name in ROLLUP_MEASURES:
+            bucket[name] += row[name]
+    return totals
+
+@app.route('/api/reports/rollup', methods=['GET'])
+@login_required
+@query_budget(1)
+def api_rollup_report():
+    """تقرير الفترات من جداول التجميع
+
+    types: أنواع المستندات مفصولة بفواصل (sales,purchases,expenses,payroll)؛ grain:
+    day|week|month|quarter|year؛ date_from و date_to (YYYY-MM-DD، افتراضياً من أول السنة
+    حتى اليوم)؛ group_by: branch_code,category,payment_status؛ ومرشحات بنفس الأسماء.
+    """
+    try:
+        doc_types = [t for t in request.args.get('types', ','.join(ROLLUP_DOC_TYPES)).split(',') if t]
+        grain = request.args.get('grain', 'month')
+        group_by = tuple(name for name in request.args.get('group_by', '').split(',') if name)
+        if not doc_types or any(t not in ROLLUP_DOC_TYPES for t in doc_types):
+            return jsonify({'success': False, 'message': 'نوع المستند غير صحيح'})
+        if grain not in ROLLUP_GRAINS:
+            return jsonify({'success': False, 'message': f'الفترة يجب أن تكون واحدة من {", ".join(ROLLUP_GRAINS)}'})
+        if any(name not in ROLLUP_DIMENSIONS for name in group_by):
+            return jsonify({'success': False, 'message': f'التجميع متاح حسب {", ".join(ROLLUP_DIMENSIONS)}'})
+
+        today = datetime.utcnow().date()
+        date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d').date() if request.args.get('date_to') else today
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date() if request.args.get('date_from') \
+            else date_to.replace(month=1, day=1)
+        if date_from > date_to:
+            return jsonify({'success': False, 'message': 'تاريخ البداية بعد تاريخ النهاية'})
+        filters = {name: request.args[name] for name in ROLLUP_DIMENSIONS if request.args.get(name)}
+
+        rows = rollup_report(doc_types, grain, date_from, date_to, group_by, filters)
+
+        return jsonify({
+            'success': True,
+            'grain': grain,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'periods': rows,
+            'totals': rollup_report_totals(doc_types, rows)
+        })
+
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في تقرير الفترات: {str(e)}'})
+
+# نوع تقرير المعاينة -> نوع المستند في جداول التجميع
+PREVIEW_REPORT_TYPES = {
+    'sales_summary': ('sales', 'ملخص المبيعات'),
+    'purchases_summary': ('purchases', 'ملخص المشتريات'),
+    'expenses_summary': ('expenses', 'ملخص المصروفات'),
+    'payroll_summary': ('payroll', 'ملخص الرواتب'),
+}
+
+@app.route('/api/reports/preview', methods=['POST'])
+@login_required
+@query_budget(1)
+def reports_preview_report():
+    """معاينة تقرير ملخص لفترة: report_type و date_from و date_to و grain (يومي افتراضياً)
+
+    المجاميع من جداول التجميع وليس من تحميل كل فاتورة في الفترة.
+    """
+    try:
+        data = request.get_json() or {}
+        report_type = data.get('report_type', 'sales_summary')
+        if report_type not in PREVIEW_REPORT_TYPES:
+            return jsonify({'success': False, 'message': 'نوع التقرير غير مدعوم'})
+        grain = data.get('grain', 'day')
+        if grain not in ROLLUP_GRAINS:
+            return jsonify({'success': False, 'message': f'الفترة يجب أن تكون واحدة من {", ".join(ROLLUP_GRAINS)}'})
+
+        doc_type, title = PREVIEW_REPORT_TYPES[report_type]
+        today = datetime.utcnow().date()
+        date_to = datetime.strptime(data['date_to'], '%Y-%m-%d').date() if data.get('date_to') else today
+        date_from = datetime.strptime(data['date_from'], '%Y-%m-%d').date() if data.get('date_from') \
+            else date_to.replace(day=1)
+
+        rows = rollup_report([doc_type], grain, date_from, date_to)
+        totals = rollup_report_totals([doc_type], rows)[doc_type]
+
+        return jsonify({'success': True, 'report_data': {
+            'title': title,
+            'date_range': f'{date_from.isoformat()} - {date_to.isoformat()}',
+            'total_count': totals['count'],
+            'total_amount': totals['amount'],
+            'total_discount': totals['discount'],
+            'total_tax': totals['tax_amount'],
+            'total_paid': totals['paid_amount'],
+            'periods': rows
+        }})
+
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في معاينة التقرير: {str(e)}'})
+
+# دفتر الأستاذ العام
+@app.route('/api/ledger/accounts', methods=['GET'])
+@login_required
+@query_budget(1)
+def api_ledger_accounts():
+    """دليل الحسابات"""
+    try:
+        accounts = Account.query.order_by(Account.code).all()
+        return jsonify({'success': True, 'accounts': [{
+            'code': account.code,
+            'key': account.key,
+            'name_ar': account.name_ar,
+            'name_en': account.name_en,
+            'account_type': account.account_type,
+            'is_active': account.is_active
+        } for account in accounts]})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في تحميل دليل الحسابات: {str(e)}'})
+
+@app.route('/api/ledger/trial-balance', methods=['GET'])
+@login_required
+@query_budget(2)
+def api_trial_balance():
+    """ميزان المراجعة: date_from و date_to (YYYY-MM-DD، افتراضياً من أول السنة حتى اليوم)
+
+    الأرصدة من account_balance الشهري وسطور الأيام في طرفي الفترة فقط.
+    """
+    try:
+        today = datetime.utcnow().date()
+        date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d').date() if request.args.get('date_to') else today
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date() if request.args.get('date_from') \
+            else date_to.replace(month=1, day=1)
+        if date_from > date_to:
+            return jsonify({'success': False, 'message': 'تاريخ البداية بعد تاريخ النهاية'})
+
+        accounts = trial_balance(date_from, date_to)
+        totals = {name: sum(row[name] for row in accounts)
+                  for name in ('debit', 'credit', 'closing_debit', 'closing_credit')}
+
+        return jsonify({
+            'success': True,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'accounts': accounts,
+            'totals': totals,
+            'balanced': round(totals['closing_debit'] - totals['closing_credit'], 2) == 0
+        })
+
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في ميزان المراجعة: {str(e)}'})
+
+@app.route('/api/ledger/entries', methods=['GET'])
+@login_required
+@query_budget(2)
+def api_journal_entries():
+    """قيود اليومية بسطورها: قيود مستند (doc_type و doc_id) أو قيود حساب (account_code)
+    في فترة (date_from و date_to)، بحد limit (الافتراضي 200، الأقصى 1000)"""
+    try:
+        limit = min(int(request.args.get('limit', 200)), 1000)
+        query = JournalEntry.query
+        if request.args.get('doc_type'):
+            query = query.filter(JournalEntry.doc_type == request.args['doc_type'])
+        if request.args.get('doc_id'):
+            query = query.filter(JournalEntry.doc_id == int(request.args['doc_id']))
+        if request.args.get('date_from'):
+            query = query.filter(JournalEntry.date >= datetime.strptime(request.args['date_from'], '%Y-%m-%d'))
+        if request.args.get('date_to'):
+            query = query.filter(
+                JournalEntry.date < datetime.strptime(request.args['date_to'], '%Y-%m-%d') + timedelta(days=1)
+            )
+        if request.args.get('account_code'):
+            query = query.filter(JournalEntry.id.in_(
+                db.select(JournalLine.entry_id).where(JournalLine.account_code == request.args['account_code'])
+            ))
+        entries = query.order_by(JournalEntry.date, JournalEntry.id).limit(limit).all()
+
+        lines = {}
+        if entries:
+            for line in JournalLine.query.filter(JournalLine.entry_id.in_([entry.id for entry in entries])) \
+                    .order_by(JournalLine.id):
+                lines.setdefault(line.entry_id, []).append({
+                    'account_code': line.account_code, 'debit': line.debit, 'credit': line.credit
+                })
+
+        return jsonify({'success': True, 'entries': [{
+            'id': entry.id,
+            'date': entry.date.isoformat(),
+            'doc_type': entry.doc_type,
+            'doc_id': entry.doc_id,
+            'entry_type': entry.entry_type,
+            'description': entry.description,
+            'lines': lines.get(entry.id, [])
+        } for entry in entries]})
+
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ أو المعرف غير صحيحة'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في تحميل القيود: {str(e)}'})
+
+@app.route('/api/ledger/entries', methods=['POST'])
+@login_required
+def create_journal_entry():
+    """قيد يدوي (رأس المال، شراء أصل، تسوية): date و description و lines
+    [{account_code, debit, credit}] - سطران على الأقل والقيد متوازن"""
+    try:
+        data = request.get_json() or {}
+        raw_lines = data.get('lines') or []
+        if len(raw_lines) < 2:
+            return jsonify({'success': False, 'message': 'القيد يحتاج سطرين على الأقل'})
+
+        codes = {row.code for row in db.session.query(Account.code).filter(
+            Account.code.in_([line.get('account_code') for line in raw_lines]), Account.is_active.isnot(False)
+        )}
+        amounts = []
+        for line in raw_lines:
+            if line.get('account_code') not in codes:
+                return jsonify({'success': False, 'message': f"الحساب {line.get('account_code')} غير موجود"})
+            debit, credit = float(line.get('debit') or 0), float(line.get('credit') or 0)
+            if debit < 0 or credit < 0 or (debit and credit):
+                return jsonify({'success': False, 'message': 'كل سطر مدين أو دائن بمبلغ موجب'})
+            amounts.append((line['account_code'], debit - credit))
+
+        entry_ids = post_journal_entries(db.session, [{
+            'date': datetime.strptime(data['date'], '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
+            'entry_type': 'manual',
+            'description': data.get('description', ''),
+            'lines': signed_lines(amounts)
+        }])
+        if not entry_ids:
+            return jsonify({'success': False, 'message': 'القيد بلا مبالغ'})
+        db.session.commit()
+        return jsonify({'success': True, 'entry_id': entry_ids[0], 'message': 'تم حفظ القيد'})
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'خطأ في حفظ القيد: {str(e)}'})
+
 # الشاشات المفقودة
 @app.route('/reports')
 @login_required
@@ -641,28 +3115,67 @@ def change_language():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+# ============================================================================
+# STREAMED PRINT REPORTS
+# ============================================================================
+
+PRINT_REPORT_CHUNK_SIZE = 500
+
+PRINT_STATUS_ICONS = {
+    'paid': '✅',
+    'partial': '🟡',
+    'unpaid': '❌',
+    'overdue': '⏰'
+}
+
+def print_report_rows(invoice_type):
+    """صفوف التقرير من استعلام واحد يضم اسم الطرف المقابل - بدون تحميل كسول لكل صف"""
+    model = LEDGER_SOURCES[invoice_type][0]
+    return list_projection(invoice_type).order_by(model.date.desc(), model.id.desc()) \
+        .yield_per(PRINT_REPORT_CHUNK_SIZE)
+
+def print_report_totals(invoice_type):
+    """إجماليات التقرير من استعلام تجميعي واحد قبل بث الصفوف"""
+    model, amount_attr, _, _ = LEDGER_SOURCES[invoice_type]
+    amount = getattr(model, amount_attr)
+    has_discount = invoice_type in ('sales', 'purchases')
+
+    row = db.session.query(
+        db.func.count(model.id).label('count'),
+        db.func.coalesce(db.func.sum(model.subtotal if has_discount else amount), 0).label('subtotal_amount'),
+        db.func.coalesce(db.func.sum(model.discount), 0).label('total_discount') if has_discount else db.literal(0).label('total_discount'),
+        db.func.coalesce(db.func.sum(amount), 0).label('total_amount'),
+    ).one()
+    return row
+
+def stream_print_template(template_name, **context):
+    """بث قالب Jinja على دفعات حتى يبدأ المتصفح بالعرض قبل اكتمال الاستعلام"""
+    context.setdefault('snapshot_at', g.get('reporting_snapshot_at'))
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(PRINT_REPORT_CHUNK_SIZE)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
 @app.route('/print_all_invoices/<invoice_type>')
 @login_required
+@reporting_snapshot
+@query_budget(3)
 def print_all_invoices(invoice_type):
     """طباعة جميع الفواتير لنوع معين"""
     try:
         if invoice_type == 'sales':
-            invoices = Sale.query.order_by(Sale.date.desc()).all()
             title = 'جميع فواتير المبيعات'
             headers = ['رقم الفاتورة', 'التاريخ', 'العميل', 'المبلغ الفرعي', 'الخصم', 'المجموع', 'ملاحظات']
 
         elif invoice_type == 'purchases':
-            invoices = Purchase.query.order_by(Purchase.date.desc()).all()
             title = 'جميع فواتير المشتريات'
             headers = ['رقم الفاتورة', 'التاريخ', 'المورد', 'المبلغ الفرعي', 'الخصم', 'المجموع', 'ملاحظات']
 
         elif invoice_type == 'expenses':
-            invoices = Expense.query.order_by(Expense.date.desc()).all()
             title = 'جميع فواتير المصروفات'
             headers = ['رقم المصروف', 'التاريخ', 'الوصف', 'الفئة', 'المبلغ', 'ملاحظات']
 
         elif invoice_type == 'payroll':
-            invoices = Payroll.query.order_by(Payroll.date.desc()).all()
             title = 'جميع كشوف الرواتب'
             headers = ['رقم الكشف', 'التاريخ', 'الموظف', 'المنصب', 'المبلغ', 'ملاحظات']
 
@@ -670,30 +3183,25 @@ def print_all_invoices(invoice_type):
             return "نوع فاتورة غير صحيح", 400
 
         # حساب الإجماليات
-        if invoice_type in ['sales', 'purchases']:
-            total_amount = sum(inv.total for inv in invoices)
-            total_discount = sum(inv.discount for inv in invoices)
-            subtotal_amount = sum(inv.subtotal for inv in invoices)
-        elif invoice_type in ['expenses', 'payroll']:
-            total_amount = sum(inv.amount for inv in invoices)
-            total_discount = 0
-            subtotal_amount = total_amount
-
-        return render_template('print_all_invoices.html',
-                             invoices=invoices,
-                             invoice_type=invoice_type,
-                             title=title,
-                             headers=headers,
-                             total_amount=total_amount,
-                             total_discount=total_discount,
-                             subtotal_amount=subtotal_amount,
-                             count=len(invoices))
+        totals = print_report_totals(invoice_type)
+
+        return stream_print_template('print_all_invoices.html',
+                                     invoices=print_report_rows(invoice_type),
+                                     invoice_type=invoice_type,
+                                     title=title,
+                                     headers=headers,
+                                     total_amount=totals.total_amount,
+                                     total_discount=totals.total_discount,
+                                     subtotal_amount=totals.subtotal_amount,
+                                     count=totals.count)
 
     except Exception as e:
         return f"خطأ في طباعة الفواتير: {str(e)}", 500
 
 @app.route('/print_invoices/<invoice_type>')
 @login_required
+@reporting_snapshot
+@query_budget(3)
 def print_invoices(invoice_type):
     """طباعة الفواتير مع خانات الخصم"""
     try:
@@ -701,269 +3209,65 @@ def print_invoices(invoice_type):
 
         # تحديد البيانات حسب نوع الفاتورة
         if invoice_type == 'sales':
-            data = Sale.query.order_by(Sale.date.desc()).all()
             title = 'تقرير فواتير المبيعات مع الخصم'
             color = '#007bff'
         elif invoice_type == 'purchases':
-            data = Purchase.query.order_by(Purchase.date.desc()).all()
             title = 'تقرير فواتير المشتريات مع الخصم'
             color = '#28a745'
         elif invoice_type == 'expenses':
-            data = Expense.query.order_by(Expense.date.desc()).all()
             title = 'تقرير فواتير المصروفات'
             color = '#ffc107'
         elif invoice_type == 'payroll':
-            data = Payroll.query.order_by(Payroll.date.desc()).all()
             title = 'تقرير كشف الرواتب'
             color = '#17a2b8'
         else:
             flash('نوع الفاتورة غير صحيح', 'error')
             return redirect(url_for('payments_dues'))
 
-        current_date = datetime.now().strftime('%Y-%m-%d %H:%M')
-
-        # حساب المجاميع
-        if invoice_type in ['sales', 'purchases']:
-            subtotal_amount = sum(item.subtotal for item in data)
-            total_discount = sum(item.discount for item in data)
-            total_amount = sum(item.total for item in data)
-            has_discount = True
-        else:
-            subtotal_amount = sum(item.amount for item in data)
-            total_discount = 0
-            total_amount = subtotal_amount
-            has_discount = False
-
-        # إنشاء HTML للطباعة
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="ar" dir="rtl">
-        <head>
-            <meta charset="UTF-8">
-            <title>{title}</title>
-            <style>
-                body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; direction: rtl; margin: 20px; background: white; line-height: 1.5; }}
-                .header {{ text-align: center; margin-bottom: 25px; border-bottom: 2px solid {color}; padding-bottom: 15px; }}
-                .company-name {{ font-size: 24px; font-weight: bold; color: {color}; margin-bottom: 8px; }}
-                .report-title {{ font-size: 18px; color: #333; margin-bottom: 5px; }}
-                .print-date {{ color: #666; font-size: 13px; }}
-                .summary {{ background: {color}10; border: 1px solid {color}; border-radius: 6px; padding: 12px; margin: 15px 0; }}
-                table {{ width: 100%; border-collapse: collapse; margin: 15px 0; border-radius: 6px; overflow: hidden; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-                th, td {{ border: 1px solid #e0e0e0; padding: 10px 6px; text-align: center; font-size: 13px; }}
-                th {{ background: {color}; color: white; font-weight: bold; font-size: 14px; }}
-                tr:nth-child(even) {{ background-color: #fafafa; }}
-                .total-row {{ background: #2c3e50 !important; color: white !important; font-weight: bold; font-size: 15px; }}
-                .print-btn {{ position: fixed; top: 10px; right: 10px; background: {color}; color: white; border: none; padding: 8px 16px; border-radius: 4px; cursor: pointer; font-size: 13px; }}
-                @media print {{ .no-print {{ display: none !important; }} body {{ margin: 5px; }} }}
-            </style>
-        </head>
-        <body>
-            <button class="print-btn no-print" onclick="window.print()">🖨️ طباعة</button>
-
-            <div class="header">
-                <div class="company-name">نظام المحاسبة المتكامل</div>
-                <div class="report-title">{title}</div>
-                <div class="print-date">تاريخ الطباعة: {current_date}</div>
-            </div>
-        """
-
-        # حساب إحصائيات الدفع
-        paid_count = 0
-        unpaid_count = 0
-        paid_amount = 0
-        unpaid_amount = 0
-
-        for item in data:
-            payment_status = getattr(item, 'payment_status', 'unpaid')
-            item_amount = item.total if hasattr(item, 'total') else item.amount
-
-            if payment_status == 'paid':
-                paid_count += 1
-                paid_amount += item_amount
-            else:
-                unpaid_count += 1
-                unpaid_amount += item_amount
-
-        # ملخص مبسط ومركز
-        html_content += f"""
-        <div class="summary">
-            <h3 style="color: {color}; margin-bottom: 20px;">📊 ملخص {title}</h3>
-            <div style="display: grid; grid-template-columns: repeat(3, 1fr); gap: 15px; margin: 15px 0;">
-                <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center; border: 2px solid {color};">
-                    <h4 style="color: {color}; margin: 0 0 10px 0;">📋 العدد الكلي</h4>
-                    <p style="font-size: 28px; font-weight: bold; margin: 0; color: #333;">{len(data)}</p>
-                </div>
-                <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center; border: 2px solid {color};">
-                    <h4 style="color: {color}; margin: 0 0 10px 0;">💰 المبلغ الكلي</h4>
-                    <p style="font-size: 24px; font-weight: bold; margin: 0; color: #333;">{total_amount:.0f} ريال</p>
-                </div>
-                <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center; border: 2px solid {color};">
-                    <h4 style="color: {color}; margin: 0 0 10px 0;">📅 التاريخ</h4>
-                    <p style="font-size: 16px; font-weight: bold; margin: 0; color: #333;">{current_date.split()[0]}</p>
-                </div>
-            </div>
-        </div>
-        """
-
-        # جدول مبسط ومركز على المعلومات المهمة فقط
-        if has_discount:
-            html_content += """
-            <table>
-                <thead>
-                    <tr>
-                        <th style="width: 15%;">الرقم</th>
-                        <th style="width: 35%;">التفاصيل</th>
-                        <th style="width: 20%;">التاريخ</th>
-                        <th style="width: 20%;">المبلغ النهائي</th>
-                        <th style="width: 10%;">الحالة</th>
-                    </tr>
-                </thead>
-                <tbody>
-            """
-
-            for item in data:
-                if invoice_type == 'sales':
-                    details = item.customer.name if item.customer else 'عميل نقدي'
-                else:  # purchases
-                    details = item.supplier.name if item.supplier else 'مورد نقدي'
-
-                # تحديد حالة الدفع مع رموز بصرية
-                payment_status = getattr(item, 'payment_status', 'unpaid')
-                status_info = {
-                    'paid': ('✅', 'مدفوع', '#28a745'),
-                    'partial': ('🟡', 'جزئي', '#ffc107'),
-                    'unpaid': ('❌', 'غير مدفوع', '#dc3545'),
-                    'overdue': ('⏰', 'متأخر', '#6c757d')
-                }.get(payment_status, ('❓', 'غير محدد', '#6c757d'))
-
-                icon, status_text, status_color = status_info
-
-                # تنسيق التاريخ
-                date_formatted = item.date.strftime('%d/%m/%Y') if item.date else 'غير محدد'
-
-                html_content += f"""
-                    <tr>
-                        <td><strong>#{item.id:04d}</strong></td>
-                        <td style="text-align: right; padding-right: 15px; font-weight: 500;">{details}</td>
-                        <td style="font-weight: 500;">{date_formatted}</td>
-                        <td><strong style="color: #2c3e50; font-size: 16px;">{item.total:.0f} ريال</strong></td>
-                        <td style="font-size: 18px;">{icon}</td>
-                    </tr>
-                """
-
-            html_content += f"""
-                    <tr class="total-row">
-                        <td colspan="3"><strong>🧮 المجموع الإجمالي</strong></td>
-                        <td><strong>{total_amount:.0f} ريال</strong></td>
-                        <td><strong>{len(data)}</strong></td>
-                    </tr>
-                </tbody>
-            </table>
-            """
-        else:
-            # جدول مبسط للمصروفات والرواتب - المعلومات الأساسية فقط
-            if invoice_type == 'expenses':
-                html_content += """
-                <table>
-                    <thead>
-                        <tr>
-                            <th style="width: 12%;">الرقم</th>
-                            <th style="width: 45%;">وصف المصروف</th>
-                            <th style="width: 18%;">التاريخ</th>
-                            <th style="width: 20%;">المبلغ</th>
-                            <th style="width: 5%;">الحالة</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                """
-            else:  # payroll
-                html_content += """
-                <table>
-                    <thead>
-                        <tr>
-                            <th style="width: 12%;">الرقم</th>
-                            <th style="width: 40%;">اسم الموظف</th>
-                            <th style="width: 18%;">الشهر</th>
-                            <th style="width: 20%;">المبلغ</th>
-                            <th style="width: 10%;">الحالة</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                """
-
-            for item in data:
-                # تحديد حالة الدفع مع رموز واضحة
-                payment_status = getattr(item, 'payment_status', 'unpaid')
-                status_info = {
-                    'paid': '✅',
-                    'partial': '🟡',
-                    'unpaid': '❌',
-                    'overdue': '⏰'
-                }.get(payment_status, '❓')
-
-                # تنسيق التاريخ
-                date_formatted = item.date.strftime('%d/%m/%Y') if item.date else 'غير محدد'
-
-                if invoice_type == 'expenses':
-                    html_content += f"""
-                        <tr>
-                            <td><strong>#{item.id:04d}</strong></td>
-                            <td style="text-align: right; padding-right: 15px; font-weight: 500;">{item.description}</td>
-                            <td style="font-weight: 500;">{date_formatted}</td>
-                            <td><strong style="color: #2c3e50; font-size: 16px;">{item.amount:.0f} ريال</strong></td>
-                            <td style="font-size: 18px;">{status_info}</td>
-                        </tr>
-                    """
-                else:  # payroll
-                    employee_name = item.employee.name if item.employee else 'موظف غير محدد'
-                    month = getattr(item, 'month', 'غير محدد')
-                    html_content += f"""
-                        <tr>
-                            <td><strong>#{item.id:04d}</strong></td>
-                            <td style="text-align: right; padding-right: 15px; font-weight: 500;">{employee_name}</td>
-                            <td style="font-weight: 500;">{month}</td>
-                            <td><strong style="color: #2c3e50; font-size: 16px;">{item.amount:.0f} ريال</strong></td>
-                            <td style="font-size: 18px;">{status_info}</td>
-                        </tr>
-                    """
-
-            html_content += f"""
-                    <tr class="total-row">
-                        <td colspan="3"><strong>🧮 المجموع الإجمالي</strong></td>
-                        <td><strong>{total_amount:.0f} ريال</strong></td>
-                        <td><strong>{len(data)}</strong></td>
-                    </tr>
-                </tbody>
-            </table>
-            """
-
-        # خاتمة مختصرة ومهنية
-        html_content += f"""
-            <div style="text-align: center; margin-top: 30px; padding: 15px; border-top: 2px solid {color};">
-                <p style="color: #666; margin: 0; font-size: 14px;">
-                    <strong>نظام المحاسبة المتكامل</strong> |
-                    {len(data)} عنصر |
-                    {total_amount:.0f} ريال |
-                    {current_date.split()[0]}
-                </p>
-            </div>
-
-            <script>
-                window.onload = function() {{
-                    setTimeout(function() {{ window.print(); }}, 300);
-                }};
-            </script>
-        </body>
-        </html>
-        """
-
-        return html_content
+        return stream_print_template('print_invoices_report.html',
+                                     rows=print_report_rows(invoice_type),
+                                     totals=print_report_totals(invoice_type),
+                                     invoice_type=invoice_type,
+                                     title=title,
+                                     color=color,
+                                     status_icons=PRINT_STATUS_ICONS,
+                                     current_date=datetime.now().strftime('%Y-%m-%d %H:%M'))
 
     except Exception as e:
         logger.error(f"❌ خطأ في طباعة الفواتير: {e}")
         flash('حدث خطأ في الطباعة', 'error')
         return redirect(url_for('payments_dues'))
 
+@app.route('/api/sequences/reserve', methods=['POST'])
+@login_required
+def reserve_sequence_block():
+    """حجز كتلة أرقام لجهاز نقطة بيع ليستخدمها بدون اتصال
+
+    المدخلات: doc_type (sales/purchases/expenses/payroll)، branch_code، count، date اختياري.
+    الأرقام المحجوزة ترسل لاحقاً في invoice_number / expense_number عند الإنشاء.
+    """
+    try:
+        data = request.get_json() or {}
+        doc_type = data.get('doc_type', 'sales')
+        if doc_type not in LEDGER_SOURCES:
+            return jsonify({'success': False, 'message': 'نوع المستند غير صحيح'})
+
+        count = int(data.get('count', 50))
+        day = datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else None
+        numbers = reserve_document_numbers(doc_type, data.get('branch_code', ''), day, count)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'numbers': numbers,
+            'count': len(numbers),
+            'max_block': MAX_RESERVATION_BLOCK
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'خطأ في حجز الأرقام: {str(e)}'})
+
 @app.route('/api/sales/create', methods=['POST'])
 @login_required
 def create_sale():
@@ -975,82 +3279,290 @@ def create_sale():
         if not data.get('subtotal') or not data.get('total'):
             return jsonify({'success': False, 'message': 'البيانات المطلوبة مفقودة'})
 
-        # Generate unique invoice number
-        last_sale = Sale.query.order_by(Sale.id.desc()).first()
-        next_number = (last_sale.id + 1) if last_sale else 1
-        invoice_number = f"INV-{next_number:06d}"
-
-        # إنشاء مبيعة جديدة
-        new_sale = Sale(
-            invoice_number=invoice_number,
-            customer_id=data.get('customer_id') if data.get('customer_id') else None,
-            subtotal=float(data.get('subtotal', 0)),
-            discount=float(data.get('discount', 0)),
-            tax_rate=float(data.get('tax_rate', 15.0)),
-            tax_amount=float(data.get('tax_amount', 0)),
-            total=float(data.get('total', 0)),
-            date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
-            notes=data.get('notes', '')
-        )
+        sale_date = datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow()
+
+        def save():
+            # رقم محجوز مسبقاً من كتلة الجهاز، أو رقم جديد من عداد الفرع/اليوم
+            invoice_number = data.get('invoice_number') or next_document_number('sales', data.get('branch_code', ''), sale_date)
+
+            # إنشاء مبيعة جديدة
+            new_sale = Sale(
+                invoice_number=invoice_number,
+                customer_id=data.get('customer_id') if data.get('customer_id') else None,
+                subtotal=float(data.get('subtotal', 0)),
+                discount=float(data.get('discount', 0)),
+                tax_rate=float(data.get('tax_rate', 15.0)),
+                tax_amount=float(data.get('tax_amount', 0)),
+                total=float(data.get('total', 0)),
+                date=sale_date,
+                notes=data.get('notes', ''),
+                branch_code=data.get('branch_code', '')
+            )
 
-        db.session.add(new_sale)
-        db.session.flush()  # Get the sale ID
+            db.session.add(new_sale)
+            db.session.flush()  # Get the sale ID
 
-        # Handle sale items if provided
-        items_data = data.get('items', [])
-        total_calculated = 0
+            # Handle sale items if provided
+            items_data = data.get('items', [])
+            require_products(item.get('product_id') for item in items_data)
+            total_calculated = 0
+            stock_lines = []
 
-        for item_data in items_data:
-            if not item_data.get('product_name') or not item_data.get('quantity'):
-                continue
+            for item_data in items_data:
+                if not item_data.get('product_name') or not item_data.get('quantity'):
+                    continue
 
-            quantity = float(item_data.get('quantity', 1))
-            unit_price = float(item_data.get('unit_price', 0))
-            item_discount = float(item_data.get('discount', 0))
-            total_price = (quantity * unit_price) - item_discount
-
-            sale_item = SaleItem(
-                sale_id=new_sale.id,
-                product_id=item_data.get('product_id'),
-                product_name=item_data.get('product_name'),
-                quantity=quantity,
-                unit_price=unit_price,
-                total_price=total_price,
-                discount=item_discount,
-                notes=item_data.get('notes', '')
-            )
+                quantity = float(item_data.get('quantity', 1))
+                unit_price = float(item_data.get('unit_price', 0))
+                item_discount = float(item_data.get('discount', 0))
+                total_price = (quantity * unit_price) - item_discount
 
-            db.session.add(sale_item)
-            total_calculated += total_price
+                sale_item = SaleItem(
+                    sale_id=new_sale.id,
+                    product_id=item_data.get('product_id'),
+                    product_name=item_data.get('product_name'),
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    total_price=total_price,
+                    discount=item_discount,
+                    notes=item_data.get('notes', '')
+                )
+
+                db.session.add(sale_item)
+                total_calculated += total_price
+                stock_lines.append({'product_id': item_data.get('product_id'), 'quantity': quantity})
 
-            # Update product stock if product_id is provided
-            if item_data.get('product_id'):
-                product = Product.query.get(item_data.get('product_id'))
-                if product:
-                    product.stock_quantity = max(0, product.stock_quantity - quantity)
+            # صرف المخزون: جملة UPDATE واحدة لكل منتج + حركات في سجل المخزون
+            post_stock_movements(sale_stock_movements(new_sale.id, stock_lines, data.get('branch_code')))
 
-        # If items were provided, update the sale total
-        if items_data:
-            new_sale.subtotal = total_calculated + new_sale.discount
-            new_sale.total = total_calculated
+            # If items were provided, update the sale total
+            if items_data:
+                new_sale.subtotal = total_calculated + new_sale.discount
+                new_sale.total = total_calculated
 
-        db.session.commit()
+            return {'sale_id': new_sale.id, 'invoice_number': new_sale.invoice_number}
+
+        saved = commit_write(save)
 
         return jsonify({
             'success': True,
             'message': 'تم حفظ المبيعة بنجاح',
-            'sale_id': new_sale.id,
-            'invoice_number': new_sale.invoice_number
+            **saved
         })
 
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'خطأ في حفظ المبيعة: {str(e)}'})
 
+# ============================================================================
+# BULK SALES INGESTION (POS terminals)
+# ============================================================================
+
+BULK_SALES_MAX = 5000
+
+def parse_bulk_invoice(data, products):
+    """التحقق من فاتورة واحدة وتحويلها إلى (صف فاتورة، صفوف أصناف) - ValueError عند الخطأ"""
+    items = []
+    total_calculated = 0
+    raw_items = data.get('items') or []
+    if not isinstance(raw_items, list) or not all(isinstance(item, dict) for item in raw_items):
+        raise ValueError('الأصناف يجب أن تكون قائمة كائنات')
+
+    for item_data in raw_items:
+        product_id = item_data.get('product_id')
+        product = None
+        if product_id:
+            product = products.get(int(product_id))
+            if product is None:
+                raise ValueError(f'المنتج {product_id} غير موجود')
+
+        product_name = item_data.get('product_name') or (product.name if product else None)
+        if not product_name or not item_data.get('quantity'):
+            continue
+
+        quantity = float(item_data.get('quantity', 1))
+        unit_price = float(item_data.get('unit_price', product.price if product else 0))
+        item_discount = float(item_data.get('discount', 0))
+        total_price = (quantity * unit_price) - item_discount
+
+        items.append({
+            'product_id': product.id if product else None,
+            'product_name': product_name,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total_price': total_price,
+            'discount': item_discount,
+            'notes': item_data.get('notes', '')
+        })
+        total_calculated += total_price
+
+    if not items and (not data.get('subtotal') or not data.get('total')):
+        raise ValueError('البيانات المطلوبة مفقودة')
+
+    discount = float(data.get('discount', 0))
+    sale = {
+        'invoice_number': data.get('invoice_number'),
+        'customer_id': data.get('customer_id') or None,
+        'subtotal': total_calculated + discount if items else float(data.get('subtotal', 0)),
+        'discount': discount,
+        'tax_rate': float(data.get('tax_rate', 15.0)),
+        'tax_amount': float(data.get('tax_amount', 0)),
+        'total': total_calculated if items else float(data.get('total', 0)),
+        'date': datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
+        'notes': data.get('notes', ''),
+        'payment_method': data.get('payment_method'),
+        'branch_code': data.get('branch_code', '')
+    }
+    return sale, items
+
+@app.route('/api/sales/bulk', methods=['POST'])
+@login_required
+def create_sales_bulk():
+    """إدراج مجموعة فواتير مبيعات بأصنافها في معاملة واحدة
+
+    المدخلات: {"invoices": [...]} بنفس حقول /api/sales/create لكل فاتورة
+    (مع invoice_number محجوز مسبقاً و branch_code اختياريين). الفواتير غير الصالحة
+    ترجع برسالتها في results ولا تمنع حفظ البقية.
+    """
+    try:
+        data = request.get_json()
+        invoices = data.get('invoices') if isinstance(data, dict) else data
+        if not isinstance(invoices, list) or not invoices:
+            return jsonify({'success': False, 'message': 'لا توجد فواتير'})
+        if len(invoices) > BULK_SALES_MAX:
+            return jsonify({'success': False, 'message': f'الحد الأقصى {BULK_SALES_MAX} فاتورة في الطلب'})
+
+        results = [None] * len(invoices)
+        # عنصر ليس كائناً يرفض وحده؛ الفحص المسبق أدناه يقرأ الفواتير الصالحة فقط
+        valid = []
+        for index, invoice in enumerate(invoices):
+            if isinstance(invoice, dict):
+                valid.append((index, invoice))
+            else:
+                results[index] = {'index': index, 'success': False, 'message': 'الفاتورة يجب أن تكون كائن JSON'}
+
+        # كل المنتجات والعملاء والأرقام المرسلة باستعلام IN واحد لكل منها
+        product_ids = {int(item['product_id']) for _, invoice in valid
+                       for item in (invoice.get('items') if isinstance(invoice.get('items'), list) else [])
+                       if isinstance(item, dict) and str(item.get('product_id') or '').isdigit()}
+        products = {row.id: row for row in db.session.query(Product.id, Product.name, Product.price, Product.quantity)
+                    .filter(Product.id.in_(product_ids))} if product_ids else {}
+        # الرصيد المتاح يتناقص مع كل فاتورة مقبولة في الدفعة
+        available = {product_id: product.quantity or 0 for product_id, product in products.items()}
+        strict_stock = not app.config.get('ALLOW_NEGATIVE_STOCK', True)
+
+        customer_ids = {int(invoice['customer_id']) for _, invoice in valid
+                        if str(invoice.get('customer_id') or '').isdigit()}
+        known_customers = {row.id for row in db.session.query(Customer.id).filter(Customer.id.in_(customer_ids))} \
+            if customer_ids else set()
+
+        supplied_numbers = [invoice['invoice_number'] for _, invoice in valid
+                            if isinstance(invoice.get('invoice_number'), str) and invoice['invoice_number']]
+        used_numbers = {row.invoice_number for row in db.session.query(Sale.invoice_number)
+                        .filter(Sale.invoice_number.in_(supplied_numbers))} if supplied_numbers else set()
+
+        accepted = []  # (index, sale, items, branch_code)
+
+        for index, invoice in valid:
+            try:
+                sale, items = parse_bulk_invoice(invoice, products)
+                if sale['invoice_number'] is not None and not isinstance(sale['invoice_number'], str):
+                    raise ValueError('رقم الفاتورة يجب أن يكون نصاً')
+                if sale['customer_id'] and int(sale['customer_id']) not in known_customers:
+                    raise ValueError(f"العميل {sale['customer_id']} غير موجود")
+                if sale['invoice_number'] and sale['invoice_number'] in used_numbers:
+                    raise ValueError(f"رقم الفاتورة {sale['invoice_number']} مستخدم")
+                if strict_stock:
+                    demand = {}
+                    for item in items:
+                        if item['product_id']:
+                            demand[item['product_id']] = demand.get(item['product_id'], 0) + item['quantity']
+                    for product_id, quantity in demand.items():
+                        if available[product_id] < quantity:
+                            raise ValueError(f'الكمية المتوفرة من المنتج {product_id} غير كافية')
+                    for product_id, quantity in demand.items():
+                        available[product_id] -= quantity
+                if sale['invoice_number']:
+                    used_numbers.add(sale['invoice_number'])
+                accepted.append((index, sale, items, invoice.get('branch_code', '')))
+            except (ValueError, TypeError, AttributeError) as e:
+                results[index] = {'index': index, 'success': False, 'message': str(e)}
+
+        if accepted:
+            # حجز الأرقام الناقصة بكتل متتالية لكل (فرع، يوم)
+            pending_numbers = {}
+            for index, sale, items, branch_code in accepted:
+                if not sale['invoice_number']:
+                    pending_numbers.setdefault((branch_code, day_period(sale['date'])), []).append(sale)
+            for (branch_code, _), sales in pending_numbers.items():
+                for start in range(0, len(sales), MAX_RESERVATION_BLOCK):
+                    block = sales[start:start + MAX_RESERVATION_BLOCK]
+                    numbers = reserve_document_numbers('sales', branch_code, block[0]['date'], len(block))
+                    for sale, number in zip(block, numbers):
+                        sale['invoice_number'] = number
+
+            sale_ids = db.session.execute(
+                db.insert(Sale).returning(Sale.id, sort_by_parameter_order=True),
+                [sale for _, sale, _, _ in accepted]
+            ).scalars().all()
+
+            item_rows = []
+            stock_movements = []
+            for sale_id, (_, _, items, branch_code) in zip(sale_ids, accepted):
+                for item in items:
+                    item['sale_id'] = sale_id
+                    item_rows.append(item)
+                stock_movements += sale_stock_movements(sale_id, items, branch_code or None)
+            if item_rows:
+                db.session.execute(db.insert(SaleItem), item_rows)
+            # صافي الدفعة لكل منتج في جملة UPDATE واحدة
+            post_stock_movements(stock_movements)
+
+            # الإدراج المجمع لا يمر بأحداث الجلسة - تحديث الملخص والقيود وسجل التغييرات يدوياً
+            apply_dashboard_stats_deltas(db.session, {
+                'sales_count': len(sale_ids),
+                'total_sales': sum(sale['total'] or 0 for _, sale, _, _ in accepted),
+                'total_discount_sales': sum(sale['discount'] or 0 for _, sale, _, _ in accepted)
+            })
+            apply_rollup_deltas(db.session, rollup_row_deltas(Sale, [sale for _, sale, _, _ in accepted]))
+            post_journal_entries(db.session, document_row_entries(Sale, sale_ids, [sale for _, sale, _, _ in accepted]))
+            now = datetime.utcnow()
+            log_change_feed(db.session, [
+                {'entity': 'sales', 'entity_id': sale_id, 'action': 'insert', 'created_at': now}
+                for sale_id in sale_ids
+            ])
+
+            db.session.commit()
+
+            for sale_id, (index, sale, _, _) in zip(sale_ids, accepted):
+                results[index] = {
+                    'index': index,
+                    'success': True,
+                    'sale_id': sale_id,
+                    'invoice_number': sale['invoice_number']
+                }
+
+        return jsonify({
+            'success': True,
+            'message': f'تم حفظ {len(accepted)} من {len(invoices)} فاتورة',
+            'created': len(accepted),
+            'failed': len(invoices) - len(accepted),
+            'results': results
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'خطأ في الحفظ المجمع للمبيعات: {str(e)}'})
+
 @app.route('/api/purchases/create', methods=['POST'])
 @login_required
 def create_purchase():
-    """إنشاء مشتريات جديدة"""
+    """إنشاء مشتريات جديدة
+
+    أصناف المشتريات المرتبطة بمنتجات تسجل كحركات استلام في سجل المخزون مرتبطة برقم
+    المشتريات (reference_type='purchases', reference_id) - هي سطور المشتريات، وتعكس
+    بنفس المرجع عند حذفها.
+    """
     try:
         data = request.get_json()
 
@@ -1058,20 +3570,46 @@ def create_purchase():
         if not data.get('subtotal') or not data.get('total'):
             return jsonify({'success': False, 'message': 'البيانات المطلوبة مفقودة'})
 
-        # إنشاء مشتريات جديدة
-        new_purchase = Purchase(
-            supplier_id=data.get('supplier_id') if data.get('supplier_id') else None,
-            subtotal=float(data.get('subtotal', 0)),
-            discount=float(data.get('discount', 0)),
-            total=float(data.get('total', 0)),
-            date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
-            notes=data.get('notes', '')
-        )
+        # الأصناف تقرأ قبل الحفظ: رقم منتج غير موجود يرفض الطلب بدلاً من تجاهل استلامه
+        try:
+            items = data.get('items') or []
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                raise ValueError('الأصناف يجب أن تكون قائمة كائنات')
+            received = [(int(item['product_id']), float(item.get('quantity') or 0))
+                        for item in items if item.get('product_id')]
+            require_products(product_id for product_id, _ in received)
+        except (ValueError, TypeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        def save():
+            # إنشاء مشتريات جديدة
+            new_purchase = Purchase(
+                supplier_id=data.get('supplier_id') if data.get('supplier_id') else None,
+                subtotal=float(data.get('subtotal', 0)),
+                discount=float(data.get('discount', 0)),
+                total=float(data.get('total', 0)),
+                date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
+                notes=data.get('notes', '')
+            )
 
-        db.session.add(new_purchase)
-        db.session.commit()
+            db.session.add(new_purchase)
+            db.session.flush()
+
+            # استلام الأصناف المرتبطة بمنتجات في المخزون
+            posted = post_stock_movements([{
+                'product_id': product_id,
+                'movement_type': 'purchase',
+                'quantity': quantity,
+                'reference_type': 'purchases',
+                'reference_id': new_purchase.id
+            } for product_id, quantity in received])
+
+            return new_purchase.id, posted
 
-        return jsonify({'success': True, 'message': 'تم حفظ المشتريات بنجاح', 'purchase_id': new_purchase.id})
+        purchase_id, posted = commit_write(save)
+
+        return jsonify({'success': True, 'message': 'تم حفظ المشتريات بنجاح', 'purchase_id': purchase_id,
+                        'stock_movements': posted})
 
     except Exception as e:
         db.session.rollback()
@@ -1088,29 +3626,33 @@ def create_expense():
         if not data.get('amount') or not data.get('description'):
             return jsonify({'success': False, 'message': 'البيانات المطلوبة مفقودة'})
 
-        # Generate unique expense number
-        last_expense = Expense.query.order_by(Expense.id.desc()).first()
-        next_number = (last_expense.id + 1) if last_expense else 1
-        expense_number = f"EXP-{next_number:06d}"
-
-        # إنشاء مصروف جديد
-        new_expense = Expense(
-            expense_number=expense_number,
-            description=data.get('description'),
-            amount=float(data.get('amount', 0)),
-            expense_type=data.get('expense_type', 'general'),
-            category=data.get('category', 'general'),
-            date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
-            reference=data.get('reference', ''),
-            vendor=data.get('vendor', ''),
-            payment_method=data.get('payment_method', 'cash'),
-            notes=data.get('notes', '')
-        )
+        expense_date = datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow()
+
+        def save():
+            expense_number = data.get('expense_number') or next_document_number('expenses', data.get('branch_code', ''), expense_date)
+
+            # إنشاء مصروف جديد
+            new_expense = Expense(
+                expense_number=expense_number,
+                description=data.get('description'),
+                amount=float(data.get('amount', 0)),
+                expense_type=data.get('expense_type', 'general'),
+                category=data.get('category', 'general'),
+                date=expense_date,
+                reference=data.get('reference', ''),
+                vendor=data.get('vendor', ''),
+                payment_method=data.get('payment_method', 'cash'),
+                notes=data.get('notes', ''),
+                branch_code=data.get('branch_code', '')
+            )
 
-        db.session.add(new_expense)
-        db.session.commit()
+            db.session.add(new_expense)
+            db.session.flush()
+            return new_expense.id
+
+        expense_id = commit_write(save)
 
-        return jsonify({'success': True, 'message': 'تم حفظ المصروف بنجاح', 'expense_id': new_expense.id})
+        return jsonify({'success': True, 'message': 'تم حفظ المصروف بنجاح', 'expense_id': expense_id})
 
     except Exception as e:
         db.session.rollback()
@@ -1230,53 +3772,139 @@ def update_expense(expense_id):
             'message': f'خطأ في تحديث المصروف: {str(e)}'
         })
 
-@app.route('/api/expenses/search', methods=['GET'])
+def apply_expense_search_filters(query):
+    """مرشحات بحث المصروفات المشتركة بين البحث والتصدير"""
+    search_term = request.args.get('search', '').strip()
+    expense_type = request.args.get('expense_type', '')
+    payment_method = request.args.get('payment_method', '')
+    min_amount = request.args.get('min_amount', '')
+    max_amount = request.args.get('max_amount', '')
+
+    # Apply search term filter (فهرس FTS5 بمطابقة البادئة بدلاً من LIKE '%x%'، وفي
+    # PostgreSQL مفاتيح البحث بفهارس pg_trgm)
+    if db.engine.dialect.name == 'sqlite':
+        match_query = build_match_query(search_term, normalize_arabic)
+        if match_query:
+            query = query.filter(Expense.id.in_(
+                db.text(matching_ids_sql('expenses')).bindparams(query=match_query)
+            ))
+    else:
+        condition = search_key_contains(Expense, search_term)
+        if condition is not None:
+            query = query.filter(condition)
+
+    # Apply expense type filter
+    if expense_type:
+        query = query.filter(Expense.expense_type == expense_type)
+
+    # Apply payment method filter
+    if payment_method:
+        query = query.filter(Expense.payment_method == payment_method)
+
+    # Apply amount range filter
+    if min_amount:
+        query = query.filter(Expense.amount >= float(min_amount))
+    if max_amount:
+        query = query.filter(Expense.amount <= float(max_amount))
+
+    return query
+
+SEARCH_RESULT_LIMIT = 20
+SEARCH_RESULT_MAX = 100
+
+# أنواع البحث الموحد على القواعد بدون FTS5: النوع -> (النموذج، عمود العنوان)
+SEARCH_KEY_SOURCES = {
+    'expenses': (Expense, Expense.expense_number),
+    'products': (Product, Product.name),
+    'customers': (Customer, Customer.name),
+    'suppliers': (Supplier, Supplier.name),
+}
+
+def search_key_query(text, limit, types=None):
+    """البحث الموحد على مفاتيح البحث (PostgreSQL) - نفس أعمدة نتيجة search_sql
+
+    None إذا لم يبق نوع قابل للبحث أو كان النص فارغاً.
+    """
+    selects = []
+    for entity, (model, title) in SEARCH_KEY_SOURCES.items():
+        condition = search_key_contains(model, text)
+        if condition is None or (types and entity not in types):
+            continue
+        matches = db.select(
+            db.literal(entity).label('entity'), model.id.label('entity_id'), title.label('title'),
+            db.literal('').label('snippet'), db.literal(0.0).label('rank')
+        ).where(condition).limit(limit).subquery()
+        selects.append(db.select(matches))
+    if not selects:
+        return None
+    results = db.union_all(*selects).subquery()
+    return db.select(results).order_by(results.c.title).limit(limit)
+
+@app.route('/api/search', methods=['GET'])
 @login_required
-def search_expenses():
-    """البحث والتصفية في المصروفات"""
+@query_budget(1)
+def omnibox_search():
+    """بحث موحد أثناء الكتابة في المصروفات والمنتجات والعملاء والموردين والفواتير
+
+    q: نص البحث (كل كلمة مطابقة بادئة)، types: أنواع مفصولة بفواصل (اختياري)، limit.
+    """
     try:
-        # Get search parameters
-        search_term = request.args.get('search', '').strip()
-        expense_type = request.args.get('expense_type', '')
-        payment_method = request.args.get('payment_method', '')
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-        min_amount = request.args.get('min_amount', '')
-        max_amount = request.args.get('max_amount', '')
+        match_query = build_match_query(request.args.get('q', ''), normalize_arabic)
+        if not match_query:
+            return jsonify({'success': True, 'results': [], 'count': 0})
 
-        # Start with base query
-        query = Expense.query
+        known_types = {source.entity for source in SEARCH_SOURCES}
+        types = [t for t in request.args.get('types', '').split(',') if t in known_types]
+        limit = min(max(request.args.get('limit', SEARCH_RESULT_LIMIT, type=int), 1), SEARCH_RESULT_MAX)
 
-        # Apply search term filter
-        if search_term:
-            query = query.filter(
-                db.or_(
-                    Expense.description.contains(search_term),
-                    Expense.expense_number.contains(search_term),
-                    Expense.vendor.contains(search_term),
-                    Expense.reference.contains(search_term)
-                )
-            )
+        if db.engine.dialect.name == 'sqlite':
+            rows = db.session.execute(db.text(search_sql(types)), search_params(match_query, limit, types)).fetchall()
+        else:
+            statement = search_key_query(request.args.get('q', ''), limit, types)
+            rows = db.session.execute(statement).fetchall() if statement is not None else []
+        results = [{
+            'type': row.entity,
+            'id': row.entity_id,
+            'title': row.title,
+            'snippet': row.snippet,
+            'rank': row.rank
+        } for row in rows]
+
+        return jsonify({'success': True, 'results': results, 'count': len(results)})
 
-        # Apply expense type filter
-        if expense_type:
-            query = query.filter(Expense.expense_type == expense_type)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في البحث: {str(e)}'})
 
-        # Apply payment method filter
-        if payment_method:
-            query = query.filter(Expense.payment_method == payment_method)
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX = 50
 
-        # Apply date range filter
-        if date_from:
-            query = query.filter(Expense.date >= datetime.strptime(date_from, '%Y-%m-%d'))
-        if date_to:
-            query = query.filter(Expense.date <= datetime.strptime(date_to, '%Y-%m-%d'))
+@app.route('/api/autocomplete/<entity>', methods=['GET'])
+@login_required
+@query_budget(2)
+def autocomplete(entity):
+    """إكمال تلقائي للمنتجات والعملاء والموردين من الفهرس في الذاكرة
 
-        # Apply amount range filter
-        if min_amount:
-            query = query.filter(Expense.amount >= float(min_amount))
-        if max_amount:
-            query = query.filter(Expense.amount <= float(max_amount))
+    prefix: بداية أي كلمة في الاسم (أو الهاتف)، والفارغ يعيد أول الأسماء أبجدياً؛ limit.
+    """
+    try:
+        if entity not in AUTOCOMPLETE_SOURCES:
+            return jsonify({'success': False, 'message': 'نوع غير مدعوم للإكمال التلقائي'}), 404
+
+        limit = min(max(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 1), AUTOCOMPLETE_MAX)
+        results = get_autocomplete_index(entity).search(request.args.get('prefix', ''), limit)
+
+        return jsonify({'success': True, 'results': results, 'count': len(results)})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في الإكمال التلقائي: {str(e)}'})
+
+@app.route('/api/expenses/search', methods=['GET'])
+@login_required
+def search_expenses():
+    """البحث والتصفية في المصروفات"""
+    try:
+        # الفترة وحالة الدفع والمورد ثم مرشحات البحث
+        query = apply_expense_search_filters(filter_list_query(Expense, Expense.vendor, 'vendor'))
 
         # Execute query
         expenses = query.order_by(Expense.date.desc()).all()
@@ -1312,67 +3940,11 @@ def search_expenses():
 
 @app.route('/api/expenses/export')
 @login_required
+@reporting_snapshot
 def export_expenses():
-    """تصدير المصروفات إلى Excel"""
+    """تصدير المصروفات إلى CSV أو Excel (format=xlsx) بنفس مرشحات البحث"""
     try:
-        # Get filter parameters
-        expense_type = request.args.get('expense_type', '')
-        payment_method = request.args.get('payment_method', '')
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-
-        # Build query with filters
-        query = Expense.query
-
-        if expense_type:
-            query = query.filter(Expense.expense_type == expense_type)
-        if payment_method:
-            query = query.filter(Expense.payment_method == payment_method)
-        if date_from:
-            query = query.filter(Expense.date >= datetime.strptime(date_from, '%Y-%m-%d'))
-        if date_to:
-            query = query.filter(Expense.date <= datetime.strptime(date_to, '%Y-%m-%d'))
-
-        expenses = query.order_by(Expense.date.desc()).all()
-
-        # Create CSV content
-        import io
-        import csv
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow([
-            'رقم المصروف', 'التاريخ', 'نوع المصروف', 'الوصف',
-            'المبلغ', 'طريقة الدفع', 'المورد', 'رقم المرجع',
-            'حالة الدفع', 'ملاحظات'
-        ])
-
-        # Write data
-        for expense in expenses:
-            writer.writerow([
-                expense.expense_number or f"EXP-{expense.id:06d}",
-                expense.date.strftime('%Y-%m-%d') if expense.date else '',
-                expense.expense_type or expense.category or '',
-                expense.description or '',
-                expense.amount or 0,
-                expense.payment_method or '',
-                expense.vendor or '',
-                expense.reference or '',
-                'مدفوع' if expense.payment_status == 'paid' else 'غير مدفوع',
-                expense.notes or ''
-            ])
-
-        # Prepare response
-        output.seek(0)
-
-        from flask import make_response
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-        response.headers['Content-Disposition'] = f'attachment; filename=expenses_{datetime.now().strftime("%Y%m%d")}.csv'
-
-        return response
+        return stream_export('expenses')
 
     except Exception as e:
         return jsonify({
@@ -1391,22 +3963,27 @@ def save_expense():
         if not data.get('amount') or not data.get('description'):
             return jsonify({'success': False, 'message': 'البيانات المطلوبة مفقودة'})
 
-        # إنشاء مصروف جديد
-        new_expense = Expense(
-            description=data.get('description'),
-            amount=float(data.get('amount', 0)),
-            date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
-            category=data.get('expense_type', 'general'),
-            notes=data.get('reference', '')
-        )
+        def save():
+            # إنشاء مصروف جديد
+            new_expense = Expense(
+                description=data.get('description'),
+                amount=float(data.get('amount', 0)),
+                date=datetime.strptime(data.get('date'), '%Y-%m-%d') if data.get('date') else datetime.utcnow(),
+                category=data.get('expense_type', 'general'),
+                notes=data.get('reference', ''),
+                branch_code=data.get('branch_code', '')
+            )
 
-        db.session.add(new_expense)
-        db.session.commit()
+            db.session.add(new_expense)
+            db.session.flush()
+            return new_expense.id
+
+        expense_id = commit_write(save)
 
         return jsonify({
             'success': True,
             'message': 'تم حفظ المصروف بنجاح',
-            'expense_id': new_expense.id
+            'expense_id': expense_id
         })
 
     except Exception as e:
@@ -1424,20 +4001,24 @@ def create_employee():
         if not data.get('name') or not data.get('salary'):
             return jsonify({'success': False, 'message': 'البيانات المطلوبة مفقودة'})
 
-        # إنشاء موظف جديد
-        new_employee = Employee(
-            name=data.get('name'),
-            position=data.get('position', ''),
-            salary=float(data.get('salary', 0)),
-            hire_date=datetime.strptime(data.get('hire_date'), '%Y-%m-%d') if data.get('hire_date') else datetime.utcnow(),
-            phone=data.get('phone', ''),
-            email=data.get('email', '')
-        )
+        def save():
+            # إنشاء موظف جديد
+            new_employee = Employee(
+                name=data.get('name'),
+                position=data.get('position', ''),
+                salary=float(data.get('salary', 0)),
+                hire_date=datetime.strptime(data.get('hire_date'), '%Y-%m-%d') if data.get('hire_date') else datetime.utcnow(),
+                phone=data.get('phone', ''),
+                email=data.get('email', '')
+            )
 
-        db.session.add(new_employee)
-        db.session.commit()
+            db.session.add(new_employee)
+            db.session.flush()
+            return new_employee.id
+
+        employee_id = commit_write(save)
 
-        return jsonify({'success': True, 'message': 'تم حفظ الموظف بنجاح', 'employee_id': new_employee.id})
+        return jsonify({'success': True, 'message': 'تم حفظ الموظف بنجاح', 'employee_id': employee_id})
 
     except Exception as e:
         db.session.rollback()
@@ -1449,6 +4030,7 @@ def delete_sale(sale_id):
     """حذف مبيعة"""
     try:
         sale = Sale.query.get_or_404(sale_id)
+        reverse_stock_movements('sales', [sale.id], 'sale')
         db.session.delete(sale)
         db.session.commit()
         return jsonify({'success': True, 'message': 'تم حذف المبيعة بنجاح'})
@@ -1462,6 +4044,7 @@ def delete_purchase(purchase_id):
     """حذف مشتريات"""
     try:
         purchase = Purchase.query.get_or_404(purchase_id)
+        reverse_stock_movements('purchases', [purchase.id], 'purchase')
         db.session.delete(purchase)
         db.session.commit()
         return jsonify({'success': True, 'message': 'تم حذف فاتورة المشتريات بنجاح'})
@@ -1475,115 +4058,275 @@ def delete_purchase(purchase_id):
 # ADVANCED AUTO-SAVE SYSTEM API ENDPOINTS
 # ============================================================================
 
+def parse_batch_date(value, default=None):
+    return datetime.strptime(value, '%Y-%m-%d') if value else (default or datetime.utcnow())
+
+def build_batch_sale(data):
+    return {
+        'customer_id': data.get('customer_id') or None,
+        'subtotal': float(data.get('subtotal', 0)),
+        'discount': float(data.get('discount', 0)),
+        'total': float(data.get('total', 0)),
+        'date': parse_batch_date(data.get('date')),
+        'notes': data.get('notes', ''),
+        'branch_code': data.get('branch_code', '')
+    }
+
+def build_batch_purchase(data):
+    return {
+        'supplier_id': data.get('supplier_id') or None,
+        'subtotal': float(data.get('subtotal', 0)),
+        'discount': float(data.get('discount', 0)),
+        'total': float(data.get('total', 0)),
+        'date': parse_batch_date(data.get('date')),
+        'notes': data.get('notes', '')
+    }
+
+def build_batch_expense(data):
+    if not data.get('description'):
+        raise ValueError('الوصف مطلوب')
+    return {
+        'description': data.get('description'),
+        'amount': float(data.get('amount', 0)),
+        'date': parse_batch_date(data.get('date')),
+        'category': data.get('type', 'general'),
+        'notes': data.get('notes', ''),
+        'branch_code': data.get('branch_code', '')
+    }
+
+def build_batch_employee(data):
+    if not data.get('name'):
+        raise ValueError('اسم الموظف مطلوب')
+    return {
+        'name': data.get('name'),
+        'position': data.get('position', ''),
+        'salary': float(data.get('salary', 0)),
+        'hire_date': parse_batch_date(data.get('hire_date')).date(),
+        'phone': data.get('phone', ''),
+        'email': data.get('email', '')
+    }
+
+# الكيان -> (النموذج، دالة بناء الصف، عمود الرقم المتسلسل، نوع عداد الأرقام)
+BATCH_ENTITIES = {
+    'sales': (Sale, build_batch_sale, 'invoice_number', 'sales'),
+    'purchases': (Purchase, build_batch_purchase, None, None),
+    'expenses': (Expense, build_batch_expense, 'expense_number', 'expenses'),
+    'employees': (Employee, build_batch_employee, None, None),
+}
+
+def batch_insert(model, rows, number_column=None, sequence_type=None):
+    """إدراج مجموعة صفوف لنوع واحد بجملة واحدة وإرجاع المعرفات بنفس الترتيب"""
+    if number_column:
+        # حجز الأرقام الناقصة بكتل متتالية لكل (فرع، يوم المستند) كما في إنشاء المبيعات
+        pending = {}
+        for row in rows:
+            if not row.get(number_column):
+                pending.setdefault((row.get('branch_code', ''), day_period(row['date'])), []).append(row)
+        for (branch_code, _), group in pending.items():
+            for start in range(0, len(group), MAX_RESERVATION_BLOCK):
+                block = group[start:start + MAX_RESERVATION_BLOCK]
+                numbers = reserve_document_numbers(sequence_type, branch_code, block[0]['date'], len(block))
+                for row, number in zip(block, numbers):
+                    row[number_column] = number
+
+    # الإدراج المجمع لا يمر بأحداث الجلسة: مفاتيح البحث والملخص والقيود وسجل التغييرات تضاف هنا
+    for row in rows:
+        row.update(search_key_values(model, row))
+
+    ids = db.session.execute(db.insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars().all()
+
+    deltas = {}
+    for column, attr in DASHBOARD_STATS_SOURCES.get(model, {}).items():
+        deltas[column] = len(rows) if attr is None else sum(row.get(attr) or 0 for row in rows)
+    apply_dashboard_stats_deltas(db.session, deltas)
+    if model in ROLLUP_SOURCES:
+        apply_rollup_deltas(db.session, rollup_row_deltas(model, rows))
+    if model in POSTING_SOURCES:
+        post_journal_entries(db.session, document_row_entries(model, ids, rows))
+
+    entity = CHANGE_FEED_ENTITIES.get(model)
+    if entity:
+        now = datetime.utcnow()
+        log_change_feed(db.session, [
+            {'entity': entity, 'entity_id': row_id, 'action': 'insert', 'created_at': now} for row_id in ids
+        ])
+    return ids
+
+def batch_delete(model, ids):
+    """حذف مجموعة صفوف لنوع واحد بـ DELETE ... WHERE id IN وإرجاع المعرفات التي وجدت فعلاً"""
+    sources = DASHBOARD_STATS_SOURCES.get(model, {})
+    stat_attrs = {attr for attr in sources.values() if attr}
+    if model in ROLLUP_SOURCES:
+        stat_attrs.update(rollup_attributes(model))
+    rows = db.session.query(model.id, *[getattr(model, attr) for attr in sorted(stat_attrs)]) \
+        .filter(model.id.in_(ids)).all()
+    found = [row.id for row in rows]
+    if not found:
+        return found
+
+    if model is Sale:
+        reverse_stock_movements('sales', found, 'sale')
+        db.session.execute(SaleItem.__table__.delete().where(SaleItem.sale_id.in_(found)))
+    elif model is Purchase:
+        reverse_stock_movements('purchases', found, 'purchase')
+
+    db.session.execute(model.__table__.delete().where(model.id.in_(found)))
+
+    deltas = {}
+    for column, attr in sources.items():
+        deltas[column] = -len(found) if attr is None else -sum(getattr(row, attr) or 0 for row in rows)
+    apply_dashboard_stats_deltas(db.session, deltas)
+    if model in ROLLUP_SOURCES:
+        apply_rollup_deltas(db.session, rollup_row_deltas(model, rows, -1))
+    if model in POSTING_SOURCES:
+        post_journal_entries(db.session, reversal_entries(db.session, model, found))
+
+    entity = CHANGE_FEED_ENTITIES.get(model)
+    if entity:
+        now = datetime.utcnow()
+        log_change_feed(db.session, [
+            {'entity': entity, 'entity_id': row_id, 'action': 'delete', 'created_at': now} for row_id in found
+        ])
+    return found
+
+def dependent_rows(model, ids):
+    """المعرفات التي لها صفوف تابعة تمنع حذفها: {المعرف: رسالة الرفض}
+
+    رواتب الموظف قيود مالية مرحلة، فلا تحذف معه ولا تترك معلقة بلا موظف.
+    """
+    if model is not Employee:
+        return {}
+    counts = db.session.query(Payroll.employee_id, db.func.count(Payroll.id)) \
+        .filter(Payroll.employee_id.in_(ids)).group_by(Payroll.employee_id)
+    return {employee_id: f'لا يمكن حذف الموظف {employee_id}: له {count} راتب مسجل'
+            for employee_id, count in counts}
+
+def begin_batch_transaction():
+    """بدء المعاملة صراحة على SQLite قبل أول SAVEPOINT
+
+    pysqlite لا يرسل BEGIN إلا قبل جمل التعديل، فيصبح أول SAVEPOINT هو المعاملة
+    نفسها ويعتمد RELEASE الخاص به كل ما سبقه. بدء المعاملة أولاً يبقي الدفعة
+    كلها في معاملة واحدة. IMMEDIATE يأخذ قفل الكتابة من البداية، فينتظر الكاتب
+    الآخر busy_timeout بدلاً من فشل ترقية القفل في منتصف الدفعة.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
 @app.route('/api/batch/process', methods=['POST'])
 @login_required
 def process_batch_operations():
-    """معالجة العمليات المجمعة"""
+    """معالجة العمليات المجمعة
+
+    كل عملية تحدد نوعها صراحة: {"id", "type": "save"|"delete", "entity": "sales"|"purchases"|
+    "expenses"|"employees", "data", "targetId"}. العمليات تجمع حسب (النوع، الكيان) وتنفذ كل
+    مجموعة بجملة واحدة داخل SAVEPOINT؛ إذا فشلت المجموعة تعاد عملياتها كل واحدة في SAVEPOINT
+    خاص حتى لا تسقط العمليات السليمة. النتائج بنفس ترتيب الطلب مع failed_ids لإعادة
+    محاولة الفاشل فقط.
+    """
     try:
         data = request.get_json()
         operations = data.get('operations', [])
 
         if not operations:
             return jsonify({'success': False, 'message': 'لا توجد عمليات للمعالجة'})
+        if not isinstance(operations, list):
+            return jsonify({'success': False, 'message': 'العمليات يجب أن تكون قائمة'}), 400
 
-        results = []
+        results = [None] * len(operations)
 
-        for operation in operations:
-            try:
-                result = None
-                op_type = operation.get('type')
-                op_data = operation.get('data', {})
-                target_id = operation.get('targetId')
+        def operation_id(index):
+            return operations[index].get('id') if isinstance(operations[index], dict) else None
 
-                if op_type == 'save':
-                    # تحديد نوع البيانات وحفظها
-                    if 'customer_id' in op_data or 'subtotal' in op_data:
-                        # مبيعة
-                        sale = Sale(
-                            customer_id=op_data.get('customer_id'),
-                            subtotal=float(op_data.get('subtotal', 0)),
-                            discount=float(op_data.get('discount', 0)),
-                            total=float(op_data.get('total', 0)),
-                            date=datetime.strptime(op_data.get('date'), '%Y-%m-%d') if op_data.get('date') else datetime.utcnow(),
-                            notes=op_data.get('notes', '')
-                        )
-                        db.session.add(sale)
-                        db.session.flush()
-                        result = {'id': sale.id, 'type': 'sale'}
-
-                    elif 'supplier_id' in op_data:
-                        # مشتريات
-                        purchase = Purchase(
-                            supplier_id=op_data.get('supplier_id'),
-                            subtotal=float(op_data.get('subtotal', 0)),
-                            discount=float(op_data.get('discount', 0)),
-                            total=float(op_data.get('total', 0)),
-                            date=datetime.strptime(op_data.get('date'), '%Y-%m-%d') if op_data.get('date') else datetime.utcnow(),
-                            notes=op_data.get('notes', '')
-                        )
-                        db.session.add(purchase)
-                        db.session.flush()
-                        result = {'id': purchase.id, 'type': 'purchase'}
-
-                    elif 'description' in op_data and 'amount' in op_data:
-                        # مصروف
-                        expense = Expense(
-                            description=op_data.get('description'),
-                            amount=float(op_data.get('amount', 0)),
-                            date=datetime.strptime(op_data.get('date'), '%Y-%m-%d') if op_data.get('date') else datetime.utcnow(),
-                            category=op_data.get('type', 'general'),
-                            notes=op_data.get('notes', '')
-                        )
-                        db.session.add(expense)
-                        db.session.flush()
-                        result = {'id': expense.id, 'type': 'expense'}
-
-                    elif 'name' in op_data and 'salary' in op_data:
-                        # موظف
-                        employee = Employee(
-                            name=op_data.get('name'),
-                            position=op_data.get('position', ''),
-                            salary=float(op_data.get('salary', 0)),
-                            hire_date=datetime.strptime(op_data.get('hire_date'), '%Y-%m-%d') if op_data.get('hire_date') else datetime.utcnow(),
-                            phone=op_data.get('phone', ''),
-                            email=op_data.get('email', '')
-                        )
-                        db.session.add(employee)
-                        db.session.flush()
-                        result = {'id': employee.id, 'type': 'employee'}
+        def fail(index, message, retryable=False):
+            results[index] = {
+                'success': False,
+                'operation_id': operation_id(index),
+                'error': message,
+                'retryable': retryable
+            }
+
+        def fail_with(index, error):
+            # أخطاء القفل والاتصال مؤقتة وتستحق إعادة المحاولة، أما أخطاء القيود فلا
+            fail(index, str(getattr(error, 'orig', None) or error), retryable=isinstance(error, OperationalError))
 
+        # التحقق وتجميع العمليات: (type, entity) -> [(index, payload)]
+        groups = {}
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                fail(index, 'العملية يجب أن تكون كائن JSON')
+                continue
+            op_type = operation.get('type')
+            entity = operation.get('entity')
+            if not isinstance(entity, str) or entity not in BATCH_ENTITIES:
+                fail(index, f'نوع الكيان غير معروف: {entity}')
+                continue
+            try:
+                if op_type == 'save':
+                    if not isinstance(operation.get('data') or {}, dict):
+                        raise ValueError('بيانات العملية يجب أن تكون كائن JSON')
+                    payload = BATCH_ENTITIES[entity][1](operation.get('data') or {})
                 elif op_type == 'delete':
-                    # حذف حسب النوع
-                    if target_id:
-                        # محاولة حذف من جميع الجداول
-                        deleted = False
-                        for model in [Sale, Purchase, Expense, Employee]:
-                            try:
-                                item = model.query.get(target_id)
-                                if item:
-                                    db.session.delete(item)
-                                    deleted = True
-                                    break
-                            except:
-                                continue
-
-                        if not deleted:
-                            raise Exception(f'لم يتم العثور على العنصر {target_id}')
-
-                        result = {'deleted_id': target_id}
-
-                results.append({
-                    'success': True,
-                    'operation_id': operation.get('id'),
-                    'result': result
-                })
+                    payload = int(operation.get('targetId'))
+                else:
+                    fail(index, f'نوع عملية غير مدعوم: {op_type}')
+                    continue
+            except (ValueError, TypeError) as e:
+                fail(index, str(e))
+                continue
+            groups.setdefault((op_type, entity), []).append((index, payload))
 
-            except Exception as op_error:
-                results.append({
-                    'success': False,
-                    'operation_id': operation.get('id'),
-                    'error': str(op_error)
-                })
+        def run_group(op_type, entity, members):
+            pending = deferred_session_work()
+            try:
+                run_group_savepoint(op_type, entity, members)
+            except Exception:
+                restore_deferred_session_work(pending)
+                raise
+
+        def run_group_savepoint(op_type, entity, members):
+            model, _, number_column, sequence_type = BATCH_ENTITIES[entity]
+            with db.session.begin_nested():
+                if op_type == 'save':
+                    # نسخ الصفوف حتى لا تبقى أرقام محجوزة في SAVEPOINT تم التراجع عنه
+                    rows = [dict(payload) for _, payload in members]
+                    ids = batch_insert(model, rows, number_column, sequence_type)
+                    for (index, _), row, row_id in zip(members, rows, ids):
+                        result = {'id': row_id, 'entity': entity}
+                        if number_column:
+                            result[number_column] = row[number_column]
+                        results[index] = {'success': True, 'operation_id': operation_id(index), 'result': result}
+                else:
+                    # صفوف تابعة (رواتب الموظف) تمنع الحذف: ترفض العملية ولا تحذف
+                    blocked = dependent_rows(model, [payload for _, payload in members])
+                    for index, payload in members:
+                        if payload in blocked:
+                            fail(index, blocked[payload])
+                    members = [(index, payload) for index, payload in members if payload not in blocked]
+                    found = set(batch_delete(model, [payload for _, payload in members])) if members else set()
+                    for index, payload in members:
+                        if payload in found:
+                            results[index] = {'success': True, 'operation_id': operation_id(index),
+                                              'result': {'deleted_id': payload, 'entity': entity}}
+                        else:
+                            fail(index, f'لم يتم العثور على العنصر {payload}')
+
+        if groups:
+            begin_batch_transaction()
+
+        for (op_type, entity), members in groups.items():
+            try:
+                run_group(op_type, entity, members)
+            except Exception as group_error:
+                if len(members) == 1:
+                    fail_with(members[0][0], group_error)
+                    continue
+                # عزل العملية الفاشلة: كل عملية في SAVEPOINT مستقل
+                for member in members:
+                    try:
+                        run_group(op_type, entity, [member])
+                    except Exception as op_error:
+                        fail_with(member[0], op_error)
 
         # حفظ جميع التغييرات
         db.session.commit()
@@ -1595,6 +4338,7 @@ def process_batch_operations():
             'success': True,
             'message': f'تم معالجة {successful_ops}/{total_ops} عملية بنجاح',
             'results': results,
+            'failed_ids': [r['operation_id'] for r in results if not r['success']],
             'summary': {
                 'total': total_ops,
                 'successful': successful_ops,
@@ -1612,11 +4356,12 @@ def get_auto_save_status():
     """الحصول على حالة نظام الحفظ التلقائي"""
     try:
         # إحصائيات النظام
+        dashboard_stats = get_dashboard_stats()
         stats = {
-            'sales_count': Sale.query.count(),
-            'purchases_count': Purchase.query.count(),
-            'expenses_count': Expense.query.count(),
-            'employees_count': Employee.query.count(),
+            'sales_count': dashboard_stats.sales_count,
+            'purchases_count': dashboard_stats.purchases_count,
+            'expenses_count': dashboard_stats.expenses_count,
+            'employees_count': dashboard_stats.employees_count,
             'last_activity': datetime.utcnow().isoformat(),
             'system_status': 'active'
         }
@@ -1671,33 +4416,145 @@ def notify_payment_system():
     except Exception as e:
         return jsonify({'success': False, 'message': f'خطأ في معالجة الإشعار: {str(e)}'})
 
+CHANGE_FEED_PAGE_SIZE = 500
+
+def current_change_version():
+    """رقم آخر إصدار في سجل التغييرات"""
+    return db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+
+def collect_changes(since, limit=CHANGE_FEED_PAGE_SIZE):
+    """آخر حالة لكل صف تغير بعد الإصدار since
+
+    يعيد (التحديثات، الإصدار الجديد، هل توجد تغييرات أخرى). الصفوف المحذوفة
+    تعاد كعلامات حذف (tombstones) بمعرفها فقط.
+    """
+    changes = ChangeLog.query.filter(ChangeLog.id > since) \
+        .order_by(ChangeLog.id).limit(limit + 1).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # آخر إجراء لكل صف يكفي - التعديلات المتتالية تدمج في تحديث واحد
+    latest = {}
+    for change in changes:
+        latest[(change.entity, change.entity_id)] = change
+
+    changed_ids = {}
+    for (entity, entity_id), change in latest.items():
+        if change.action != 'delete':
+            changed_ids.setdefault(entity, []).append(entity_id)
+
+    rows = {}
+    entity_models = {name: model for model, name in CHANGE_FEED_ENTITIES.items()}
+    for entity, ids in changed_ids.items():
+        model = entity_models[entity]
+        for row in list_projection(entity).filter(model.id.in_(ids)).all():
+            rows[(entity, row.id)] = LIST_SERIALIZERS[entity](row)
+
+    updates = []
+    for (entity, entity_id), change in sorted(latest.items(), key=lambda item: item[1].id):
+        data = rows.get((entity, entity_id))
+        action = change.action if data is not None else 'delete'
+        updates.append({
+            'version': change.id,
+            'type': entity,
+            'action': action,
+            'id': entity_id,
+            'data': data if action != 'delete' else {'id': entity_id}
+        })
+
+    version = changes[-1].id if changes else since
+    return updates, version, has_more
+
 @app.route('/api/payments/check-updates', methods=['GET'])
 @login_required
 def check_payment_updates():
-    """فحص التحديثات في نظام المدفوعات"""
-    try:
-        last_update = request.headers.get('X-Last-Update', '0')
-        current_time = int(time.time())
+    """فحص التحديثات في نظام المدفوعات منذ رقم إصدار معين
 
-        # فحص التحديثات منذ آخر مرة
-        # هنا يمكن إضافة منطق فحص التغييرات في قاعدة البيانات
-
-        # مثال على التحديثات
-        updates = []
-        has_updates = False
+    since=<version> (أو ترويسة X-Last-Update) - يعيد آخر حالة لكل صف تغير
+    بعده، والصفوف المحذوفة كعلامات حذف (tombstones)، ورقم الإصدار الجديد
+    الذي يرسله العميل في الطلب التالي.
+    """
+    try:
+        since = request.args.get('since', request.headers.get('X-Last-Update', ''))
 
-        # يمكن إضافة منطق فحص التغييرات الفعلية هنا
+        # عميل جديد بدون إصدار: يأخذ الإصدار الحالي فقط لأنه حمل الصفحة للتو
+        if not str(since).isdigit():
+            updates, version, has_more = [], current_change_version(), False
+        else:
+            updates, version, has_more = collect_changes(int(since))
 
         return jsonify({
             'success': True,
-            'hasUpdates': has_updates,
+            'hasUpdates': bool(updates),
             'updates': updates,
-            'timestamp': str(current_time)
+            'version': version,
+            'hasMore': has_more,
+            'timestamp': str(version)
         })
 
     except Exception as e:
         return jsonify({'success': False, 'message': f'خطأ في فحص التحديثات: {str(e)}'})
 
+# مدة انتظار الإشعار قبل إعادة فحص السجل - تلتقط تغييرات العمليات الأخرى
+EVENT_STREAM_POLL_SECONDS = 10
+# يغلق البث دورياً ليعيد العميل الاتصال بـ Last-Event-ID ويتحرر العامل
+EVENT_STREAM_MAX_SECONDS = 300
+
+# القنوات المفتوحة في هذا العامل - تحرر عند إغلاق الاستجابة
+event_stream_slots = threading.BoundedSemaphore(app.config['EVENT_STREAM_MAX_CLIENTS'])
+
+@app.route('/api/events', methods=['GET'])
+@login_required
+def event_stream():
+    """بث التغييرات (Server-Sent Events) بديلاً عن الفحص الدوري كل 30 ثانية
+
+    كل حدث يحمل رقم الإصدار في id، فيستأنف المتصفح تلقائياً من ترويسة
+    Last-Event-ID عند إعادة الاتصال. كل قناة تحجز خيط gthread طوال مدتها، لذلك
+    عددها محدود بـ EVENT_STREAM_MAX_CLIENTS: بعده يرد 503 فيغلق المتصفح EventSource
+    نهائياً ويرجع payment-integration.js إلى الفحص الدوري (انظر gunicorn.conf.py).
+    """
+    if not event_stream_slots.acquire(blocking=False):
+        response = jsonify({'success': False, 'message': 'عدد قنوات البث المفتوحة بلغ الحد - استخدم الفحص الدوري'})
+        response.status_code = 503
+        return response
+
+    try:
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+        since = int(last_event_id) if last_event_id.isdigit() else current_change_version()
+        # إنهاء معاملة القراءة حتى لا يبقى الاتصال ممسكاً بلقطة قديمة من القاعدة
+        db.session.rollback()
+    except Exception:
+        event_stream_slots.release()
+        raise
+
+    def generate(since):
+        started = time.time()
+        yield f"retry: 5000\nid: {since}\nevent: ready\ndata: {{}}\n\n"
+
+        while time.time() - started < EVENT_STREAM_MAX_SECONDS:
+            # يسجل الجيل قبل القراءة حتى لا يضيع إشعار يصل أثناءها
+            seen_generation = change_feed_generation[0]
+            has_more = True
+            while has_more:
+                updates, since, has_more = collect_changes(since)
+                db.session.rollback()
+                for update in updates:
+                    payload = json.dumps(update, ensure_ascii=False, default=str)
+                    yield f"id: {update['version']}\nevent: change\ndata: {payload}\n\n"
+
+            with change_feed_condition:
+                notified = change_feed_condition.wait_for(
+                    lambda: change_feed_generation[0] != seen_generation, EVENT_STREAM_POLL_SECONDS)
+            if not notified:
+                # تعليق فارغ يبقي الاتصال حياً عبر الوكلاء
+                yield ": keep-alive\n\n"
+
+    response = Response(stream_with_context(generate(since)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(event_stream_slots.release)
+    return response
+
 @app.route('/api/<string:module>/update-payment-status', methods=['POST'])
 @login_required
 def update_payment_status(module):
@@ -1747,45 +4604,46 @@ def update_payment_status(module):
 @app.route('/api/<string:module>/summary', methods=['GET'])
 @login_required
 def get_module_summary(module):
-    """الحصول على ملخص الوحدة مع حالات الدفع"""
-    try:
-        model_map = {
-            'sales': Sale,
-            'purchases': Purchase,
-            'expenses': Expense
-        }
+    """الحصول على ملخص الوحدة مع حالات الدفع
 
-        model = model_map.get(module)
-        if not model:
+    module = payments يعطي الملخص المجمع لكل الوحدات من نفس الاستعلام.
+    """
+    try:
+        if module == 'payments':
+            doc_types = list(LEDGER_SOURCES)
+        elif module in LEDGER_SOURCES:
+            doc_types = [module]
+        else:
             return jsonify({'success': False, 'message': 'نوع الوحدة غير صحيح'})
 
-        # حساب الإحصائيات حسب نوع النموذج
-        if module == 'expenses':
-            # للمصروفات نستخدم حقل amount بدلاً من total
-            total_amount = db.session.query(db.func.sum(model.amount)).scalar() or 0
-            if hasattr(model, 'payment_status'):
-                paid_items = model.query.filter_by(payment_status='paid').all()
-                paid_amount = sum(item.amount for item in paid_items)
-            else:
-                paid_amount = 0
-        else:
-            # للمبيعات والمشتريات نستخدم حقل total
-            total_amount = db.session.query(db.func.sum(model.total)).scalar() or 0
-            if hasattr(model, 'payment_status'):
-                paid_items = model.query.filter_by(payment_status='paid').all()
-                paid_amount = sum(item.total for item in paid_items)
-            else:
-                paid_amount = 0
+        date_from = request.args.get('date_from', '')
+        date_to = request.args.get('date_to', '')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+
+        by_status = {status: {'count': 0, 'total': 0, 'paid_amount': 0} for status in PAYMENT_STATUSES}
+        by_module = {doc_type: {'count': 0, 'total': 0, 'paid_amount': 0} for doc_type in doc_types}
+
+        for row in payment_status_breakdown(doc_types, date_from, date_to):
+            for bucket in (by_status.setdefault(row.payment_status, {'count': 0, 'total': 0, 'paid_amount': 0}),
+                           by_module[row.doc_type]):
+                bucket['count'] += row.count
+                bucket['total'] += row.amount or 0
+                bucket['paid_amount'] += row.paid_amount or 0
 
-        total_count = model.query.count()
-        pending_amount = total_amount - paid_amount
+        total_amount = sum(bucket['total'] for bucket in by_module.values())
+        paid_amount = sum(bucket['paid_amount'] for bucket in by_module.values())
+        total_count = sum(bucket['count'] for bucket in by_module.values())
 
         summary = {
             f'total-{module}': total_amount,
             f'paid-{module}': paid_amount,
-            f'pending-{module}': pending_amount,
-            'count': total_count
+            f'pending-{module}': total_amount - paid_amount,
+            'count': total_count,
+            'by_status': by_status
         }
+        if module == 'payments':
+            summary['by_module'] = by_module
 
         return jsonify({
             'success': True,
@@ -1795,32 +4653,219 @@ def get_module_summary(module):
     except Exception as e:
         return jsonify({'success': False, 'message': f'خطأ في جلب الملخص: {str(e)}'})
 
+# ============================================================================
+# KEYSET PAGINATION FOR LIST APIs
+# ============================================================================
+
+LIST_PAGE_SIZE = 50
+LIST_PAGE_MAX = 500
+
+def encode_list_cursor(row_date, row_id):
+    """ترميز مؤشر الصفحة التالية من (التاريخ، المعرف) لآخر صف"""
+    raw = f"{row_date.isoformat() if row_date else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_list_cursor(cursor):
+    """فك ترميز المؤشر إلى (التاريخ، المعرف) - التاريخ قد يكون None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        date_part, id_part = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(date_part) if date_part else None), int(id_part)
+    except (ValueError, UnicodeError):
+        raise ValueError('مؤشر الصفحة غير صالح')
+
+def filter_list_query(model, counterparty_column=None, counterparty_param=None, query=None):
+    """تطبيق مرشحات الفترة وحالة الدفع والطرف المقابل من معاملات الطلب
+
+    query اختياري (مثل list_projection) - الافتراضي model.query.
+    """
+    if query is None:
+        query = model.query
+
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    payment_status = request.args.get('payment_status', '')
+    record_id = request.args.get('id', type=int)
+
+    # ?id= لجلب مستند واحد (مثل شاشة التعديل) بنفس تمثيل القائمة مهما كان قديماً
+    if record_id is not None:
+        query = query.filter(model.id == record_id)
+
+    # فترة نصف مفتوحة [date_from, date_to + 1 يوم) على العمود نفسه
+    if date_from:
+        query = query.filter(model.date >= datetime.strptime(date_from, '%Y-%m-%d'))
+    if date_to:
+        query = query.filter(model.date < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+    if payment_status:
+        query = query.filter(model.payment_status == payment_status)
+    if counterparty_column is not None and request.args.get(counterparty_param, ''):
+        query = query.filter(counterparty_column == request.args.get(counterparty_param))
+
+    return query
+
+def keyset_page(query, model):
+    """جلب صفحة واحدة مرتبة تنازلياً على (date, id) بعد المؤشر المرسل
+
+    تكلفة كل صفحة ثابتة مهما كبر الجدول وعمق الصفحة: المؤشر شرط نطاق على القيمة
+    المركبة (date, id) يبدأ منه البحث في فهرس (date, id) مباشرة بدلاً من OFFSET أو
+    شرط OR الذي يمسح الفهرس من أوله. الصفوف ذات التاريخ الفارغ تأتي في آخر الترتيب
+    باستعلام ثانٍ لا يجرى إلا عندما تنتهي الصفوف المؤرخة قبل امتلاء الصفحة.
+    """
+    limit = min(max(request.args.get('limit', LIST_PAGE_SIZE, type=int), 1), LIST_PAGE_MAX)
+    cursor = request.args.get('cursor', '')
+    cursor_date, cursor_id = decode_list_cursor(cursor) if cursor else (None, None)
+
+    rows = []
+    if not cursor or cursor_date is not None:
+        dated = query.filter(model.date.isnot(None))
+        if cursor:
+            dated = dated.filter(db.tuple_(model.date, model.id) < (cursor_date, cursor_id))
+        rows = dated.order_by(model.date.desc(), model.id.desc()).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        undated = query.filter(model.date.is_(None))
+        if cursor_id is not None and cursor_date is None:
+            undated = undated.filter(model.id < cursor_id)
+        rows += undated.order_by(model.id.desc()).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_list_cursor(rows[-1].date, rows[-1].id)
+
+    return rows, next_cursor
+
+# (النموذج، عمود الطرف المقابل، اسم معامل الطلب) لكل وحدة قائمة
+LIST_FILTERS = {
+    'sales': (Sale, Sale.customer_id, 'customer_id'),
+    'purchases': (Purchase, Purchase.supplier_id, 'supplier_id'),
+    'expenses': (Expense, Expense.vendor, 'vendor'),
+    'payroll': (Payroll, Payroll.employee_id, 'employee_id'),
+}
+
+def list_page(module):
+    """صفحة واحدة من list_projection بعد تطبيق مرشحات الطلب والمؤشر"""
+    model, counterparty_column, counterparty_param = LIST_FILTERS[module]
+    query = filter_list_query(model, counterparty_column, counterparty_param, list_projection(module))
+    return keyset_page(query, model)
+
+def list_summary(module):
+    """بطاقات الملخص لصفحة القائمة من استعلام تجميعي واحد بنفس مرشحات الطلب
+
+    لا تعتمد على الصفحة المعروضة - الإجماليات تغطي كل الصفوف المطابقة.
+    """
+    model, counterparty_column, counterparty_param = LIST_FILTERS[module]
+    amount = db.func.coalesce(getattr(model, LEDGER_SOURCES[module][1]), 0)
+    # نفس منطق دفتر المدفوعات: الفاتورة المعلمة كمدفوعة تحسب بكامل مبلغها
+    settled = db.case((model.payment_status == 'paid', amount), else_=db.func.coalesce(model.paid_amount, 0))
+    discount = db.func.coalesce(model.discount, 0) if hasattr(model, 'discount') else db.literal(0)
+
+    row = filter_list_query(model, counterparty_column, counterparty_param).with_entities(
+        db.func.count(model.id).label('count'),
+        db.func.coalesce(db.func.sum(amount), 0).label('total'),
+        db.func.coalesce(db.func.sum(settled), 0).label('paid'),
+        db.func.coalesce(db.func.sum(discount), 0).label('discount')
+    ).one()
+
+    return {
+        'count': row.count,
+        'total': row.total,
+        'paid': row.paid,
+        'pending': row.total - row.paid,
+        'discount': row.discount,
+        'average': row.total / row.count if row.count else 0
+    }
+
+@app.template_global()
+def list_page_url(cursor=None):
+    """رابط نفس الصفحة مع المرشحات الحالية ومؤشر آخر (None = الصفحة الأولى)"""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    if cursor:
+        args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def serialize_sale_row(sale):
+    """تمثيل فاتورة مبيعات في قوائم API - يستقبل صفاً من list_projection('sales')"""
+    customer_name = sale.counterparty or 'عميل غير محدد'
+    return {
+        'id': sale.id,
+        'date': sale.date.isoformat() if sale.date else None,
+        'customer': {'id': sale.customer_id, 'name': customer_name},
+        'subtotal': sale.subtotal,
+        'discount': sale.discount,
+        'tax_rate': sale.tax_rate,
+        'tax_amount': sale.tax_amount,
+        'total': sale.total,
+        'notes': sale.notes,
+        'payment_status': sale.payment_status or 'unpaid',
+        'paid_amount': sale.paid_amount or 0,
+        'payment_method': sale.payment_method
+    }
+
+def serialize_purchase_row(purchase):
+    """تمثيل فاتورة مشتريات في قوائم API"""
+    supplier_name = purchase.counterparty or 'مورد غير محدد'
+    return {
+        'id': purchase.id,
+        'date': purchase.date.isoformat() if purchase.date else None,
+        'supplier': {'name': supplier_name},
+        'subtotal': purchase.subtotal,
+        'discount': purchase.discount,
+        'total': purchase.total,
+        'payment_status': purchase.payment_status or 'unpaid',
+        'paid_amount': purchase.paid_amount or 0,
+        'payment_method': purchase.payment_method
+    }
+
+def serialize_expense_row(expense):
+    """تمثيل مصروف في قوائم API"""
+    return {
+        'id': expense.id,
+        'date': expense.date.isoformat() if expense.date else None,
+        'description': expense.description,
+        'category': expense.category,
+        'amount': expense.amount,
+        'payment_status': expense.payment_status or 'unpaid',
+        'paid_amount': expense.paid_amount or 0,
+        'payment_method': expense.payment_method
+    }
+
+def serialize_payroll_row(payroll):
+    """تمثيل كشف راتب في قوائم API"""
+    employee_name = payroll.counterparty or 'موظف غير محدد'
+    return {
+        'id': payroll.id,
+        'date': payroll.date.isoformat() if payroll.date else None,
+        'employee': {'name': employee_name},
+        'month': payroll.month,
+        'amount': payroll.amount,
+        'payment_status': payroll.payment_status or 'unpaid',
+        'paid_amount': payroll.paid_amount or 0,
+        'payment_method': payroll.payment_method
+    }
+
+LIST_SERIALIZERS = {
+    'sales': serialize_sale_row,
+    'purchases': serialize_purchase_row,
+    'expenses': serialize_expense_row,
+    'payroll': serialize_payroll_row,
+}
+
 @app.route('/api/sales/list', methods=['GET'])
 @login_required
+@query_budget(4)
 def get_sales_list():
-    """جلب قائمة المبيعات للطباعة"""
+    """جلب قائمة المبيعات للطباعة (مرقمة بالمؤشر)"""
     try:
-        sales = Sale.query.all()
-        sales_data = []
-
-        for sale in sales:
-            customer_name = sale.customer.name if sale.customer else 'عميل غير محدد'
-            sales_data.append({
-                'id': sale.id,
-                'date': sale.date.isoformat() if sale.date else None,
-                'customer': {'name': customer_name},
-                'subtotal': sale.subtotal,
-                'discount': sale.discount,
-                'total': sale.total,
-                'payment_status': getattr(sale, 'payment_status', 'unpaid'),
-                'paid_amount': getattr(sale, 'paid_amount', 0),
-                'payment_method': getattr(sale, 'payment_method', None)
-            })
+        sales, next_cursor = list_page('sales')
+        sales_data = [serialize_sale_row(sale) for sale in sales]
 
         return jsonify({
             'success': True,
             'sales': sales_data,
-            'count': len(sales_data)
+            'count': len(sales_data),
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -1831,7 +4876,7 @@ def get_sales_list():
 def print_sale(sale_id):
     """طباعة فاتورة مبيعات"""
     try:
-        sale = Sale.query.get_or_404(sale_id)
+        sale = load_for_view(Sale, 'sale_detail').filter(Sale.id == sale_id).first_or_404()
 
         # Generate invoice number if not exists
         if not hasattr(sale, 'invoice_number') or not sale.invoice_number:
@@ -1894,12 +4939,15 @@ def update_sale(sale_id):
 
         # Handle sale items update if provided
         if 'items' in data:
-            # Delete existing items
+            # Delete existing items and return their stock
             SaleItem.query.filter_by(sale_id=sale.id).delete()
+            reverse_stock_movements('sales', [sale.id], 'sale')
 
             # Add new items
             items_data = data.get('items', [])
+            require_products(item.get('product_id') for item in items_data)
             total_calculated = 0
+            stock_lines = []
 
             for item_data in items_data:
                 if not item_data.get('product_name') or not item_data.get('quantity'):
@@ -1923,6 +4971,9 @@ def update_sale(sale_id):
 
                 db.session.add(sale_item)
                 total_calculated += total_price
+                stock_lines.append({'product_id': item_data.get('product_id'), 'quantity': quantity})
+
+            post_stock_movements(sale_stock_movements(sale.id, stock_lines, sale.branch_code or None))
 
             # Update sale total if items were provided
             if items_data:
@@ -1943,6 +4994,81 @@ def update_sale(sale_id):
             'message': f'خطأ في تحديث الفاتورة: {str(e)}'
         })
 
+@app.route('/api/stock/movements', methods=['POST'])
+@login_required
+def create_stock_movements():
+    """تسجيل حركات مخزون يدوية (تسوية أو تحويل)
+
+    المدخلات: {"movements": [{"product_id", "quantity" (موجب/سالب), "movement_type", "branch_code", "notes"}]}
+    """
+    try:
+        data = request.get_json() or {}
+        movements = []
+        for movement in data.get('movements') or []:
+            movement_type = movement.get('movement_type', 'adjustment')
+            if movement_type not in ('adjustment', 'transfer'):
+                return jsonify({'success': False, 'message': 'نوع حركة المخزون غير صحيح'})
+            movements.append({
+                'product_id': int(movement['product_id']),
+                'movement_type': movement_type,
+                'quantity': float(movement['quantity']),
+                'branch_code': movement.get('branch_code'),
+                'notes': movement.get('notes', '')
+            })
+
+        if not movements:
+            return jsonify({'success': False, 'message': 'لا توجد حركات'})
+
+        try:
+            require_products(movement['product_id'] for movement in movements)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        # الحركات بكمية صفر لا تسجل - العدد المعاد هو المسجل فعلاً
+        posted = post_stock_movements(movements)
+        db.session.commit()
+
+        return jsonify({'success': True, 'message': f'تم تسجيل {posted} حركة مخزون', 'posted': posted})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'خطأ في حركة المخزون: {str(e)}'})
+
+@app.route('/api/stock/<int:product_id>', methods=['GET'])
+@login_required
+def get_product_stock(product_id):
+    """الرصيد الحالي من Product.quantity مع آخر حركات المنتج (مرقمة بالمؤشر على id)"""
+    try:
+        product = db.session.query(Product.id, Product.name, Product.quantity) \
+            .filter(Product.id == product_id).first()
+        if not product:
+            return jsonify({'success': False, 'message': 'المنتج غير موجود'})
+
+        limit = min(max(request.args.get('limit', LIST_PAGE_SIZE, type=int), 1), LIST_PAGE_MAX)
+        query = StockMovement.query.filter(StockMovement.product_id == product_id)
+        before_id = request.args.get('before_id', type=int)
+        if before_id:
+            query = query.filter(StockMovement.id < before_id)
+        movements = query.order_by(StockMovement.id.desc()).limit(limit).all()
+
+        return jsonify({
+            'success': True,
+            'product': {'id': product.id, 'name': product.name, 'on_hand': product.quantity or 0},
+            'movements': [{
+                'id': movement.id,
+                'movement_type': movement.movement_type,
+                'quantity': movement.quantity,
+                'reference_type': movement.reference_type,
+                'reference_id': movement.reference_id,
+                'branch_code': movement.branch_code,
+                'notes': movement.notes,
+                'created_at': movement.created_at.isoformat() if movement.created_at else None
+            } for movement in movements]
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'خطأ في جلب المخزون: {str(e)}'})
+
 @app.route('/api/products/list', methods=['GET'])
 @login_required
 def get_products_list():
@@ -1973,30 +5099,18 @@ def get_products_list():
 
 @app.route('/api/purchases/list', methods=['GET'])
 @login_required
+@query_budget(4)
 def get_purchases_list():
-    """جلب قائمة المشتريات للطباعة"""
+    """جلب قائمة المشتريات للطباعة (مرقمة بالمؤشر)"""
     try:
-        purchases = Purchase.query.all()
-        purchases_data = []
-
-        for purchase in purchases:
-            supplier_name = purchase.supplier.name if purchase.supplier else 'مورد غير محدد'
-            purchases_data.append({
-                'id': purchase.id,
-                'date': purchase.date.isoformat() if purchase.date else None,
-                'supplier': {'name': supplier_name},
-                'subtotal': purchase.subtotal,
-                'discount': purchase.discount,
-                'total': purchase.total,
-                'payment_status': getattr(purchase, 'payment_status', 'unpaid'),
-                'paid_amount': getattr(purchase, 'paid_amount', 0),
-                'payment_method': getattr(purchase, 'payment_method', None)
-            })
+        purchases, next_cursor = list_page('purchases')
+        purchases_data = [serialize_purchase_row(purchase) for purchase in purchases]
 
         return jsonify({
             'success': True,
             'purchases': purchases_data,
-            'count': len(purchases_data)
+            'count': len(purchases_data),
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -2004,28 +5118,18 @@ def get_purchases_list():
 
 @app.route('/api/expenses/list', methods=['GET'])
 @login_required
+@query_budget(4)
 def get_expenses_list():
-    """جلب قائمة المصروفات للطباعة"""
+    """جلب قائمة المصروفات للطباعة (مرقمة بالمؤشر)"""
     try:
-        expenses = Expense.query.all()
-        expenses_data = []
-
-        for expense in expenses:
-            expenses_data.append({
-                'id': expense.id,
-                'date': expense.date.isoformat() if expense.date else None,
-                'description': expense.description,
-                'category': expense.category,
-                'amount': expense.amount,
-                'payment_status': getattr(expense, 'payment_status', 'unpaid'),
-                'paid_amount': getattr(expense, 'paid_amount', 0),
-                'payment_method': getattr(expense, 'payment_method', None)
-            })
+        expenses, next_cursor = list_page('expenses')
+        expenses_data = [serialize_expense_row(expense) for expense in expenses]
 
         return jsonify({
             'success': True,
             'expenses': expenses_data,
-            'count': len(expenses_data)
+            'count': len(expenses_data),
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -2033,29 +5137,18 @@ def get_expenses_list():
 
 @app.route('/api/payroll/list', methods=['GET'])
 @login_required
+@query_budget(4)
 def get_payroll_list():
-    """جلب قائمة الرواتب للطباعة"""
+    """جلب قائمة الرواتب للطباعة (مرقمة بالمؤشر)"""
     try:
-        payrolls = Payroll.query.all()
-        payrolls_data = []
-
-        for payroll in payrolls:
-            employee_name = payroll.employee.name if payroll.employee else 'موظف غير محدد'
-            payrolls_data.append({
-                'id': payroll.id,
-                'date': payroll.date.isoformat() if payroll.date else None,
-                'employee': {'name': employee_name},
-                'month': payroll.month,
-                'amount': payroll.amount,
-                'payment_status': getattr(payroll, 'payment_status', 'unpaid'),
-                'paid_amount': getattr(payroll, 'paid_amount', 0),
-                'payment_method': getattr(payroll, 'payment_method', None)
-            })
+        payrolls, next_cursor = list_page('payroll')
+        payrolls_data = [serialize_payroll_row(payroll) for payroll in payrolls]
 
         return jsonify({
             'success': True,
             'payrolls': payrolls_data,
-            'count': len(payrolls_data)
+            'count': len(payrolls_data),
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -2069,4 +5162,7 @@ if __name__ == '__main__':
     print("💰 النظام يدعم الحفظ التلقائي والربط المباشر")
     print("=" * 60)
 
+    with app.app_context():
+        init_database()
+
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس أعمدة اليوم والشهر المولدة
+Generated Period Columns Benchmark
+
+يملأ جدول المبيعات في قاعدة SQLite مؤقتة بفواتير موزعة على سنتين، ثم يقيس كل
+استعلام بصيغته قبل الأعمدة المولدة وبعدها على نفس البيانات:
+
+    تجميع يومي / شهري  - GROUP BY strftime(date) مقابل period_totals_query (day/month المفهرس)
+    مبيعات اليوم       - DATE(date) = ? مقابل date >= ? AND date < ?
+    مبيعات الشهر       - strftime('%Y-%m', date) = ? مقابل month = ?
+
+ويطبع الوسيط بالملي ثانية لكل صيغة ونسبة التحسن.
+
+    python benchmark_period_columns.py [عدد الفواتير] [مرات التكرار]
+"""
+
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+def median_ms(run, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    path = os.path.join(tempfile.mkdtemp(prefix='accounting_periods_'), 'accounting.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    logging.disable(logging.WARNING)
+    from app import app, db, init_database, period_totals_query, Sale
+
+    with app.app_context():
+        init_database()
+
+    print(f"🗄️ إضافة {invoices} فاتورة على سنتين...")
+    start = datetime(2024, 1, 1, 8)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO sale (subtotal, discount, tax_rate, tax_amount, total, date, payment_status, paid_amount, branch_code) '
+        "VALUES (?, 0, 15, 0, ?, ?, 'unpaid', 0, '')",
+        ((10 + i % 90, 10 + i % 90, (start + timedelta(minutes=i * 730 * 24 * 60 // invoices)).isoformat(' '))
+         for i in range(invoices))
+    )
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+
+    day = datetime(2025, 6, 15)
+    month_start = day.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+
+    def by_expression(expression):
+        return db.session.query(
+            expression.label('period'),
+            db.func.count().label('count'),
+            db.func.coalesce(db.func.sum(Sale.total), 0).label('amount')
+        ).group_by(expression).order_by(expression)
+
+    def total(*conditions):
+        return db.session.query(db.func.coalesce(db.func.sum(Sale.total), 0)).filter(*conditions)
+
+    # (الاسم، الصيغة قبل، الصيغة بعد) - الصيغة قبل كما كانت قبل إضافة الأعمدة المولدة
+    cases = [
+        ('تجميع يومي',
+         lambda: by_expression(db.func.strftime('%Y-%m-%d', Sale.date)).all(),
+         lambda: period_totals_query('sales', 'day').all()),
+        ('تجميع شهري',
+         lambda: by_expression(db.func.strftime('%Y-%m', Sale.date)).all(),
+         lambda: period_totals_query('sales', 'month').all()),
+        ('مبيعات اليوم',
+         lambda: total(db.func.date(Sale.date) == day.strftime('%Y-%m-%d')).scalar(),
+         lambda: total(Sale.date >= day, Sale.date < day + timedelta(days=1)).scalar()),
+        ('مبيعات الشهر',
+         lambda: total(db.func.strftime('%Y-%m', Sale.date) == month_start.strftime('%Y-%m')).scalar(),
+         lambda: total(Sale.month == month_start.strftime('%Y-%m')).scalar()),
+        ('مبيعات الشهر (نطاق)',
+         lambda: total(db.func.strftime('%Y-%m', Sale.date) == month_start.strftime('%Y-%m')).scalar(),
+         lambda: total(Sale.date >= month_start, Sale.date < next_month).scalar()),
+    ]
+
+    print(f"⏱️ الوسيط من {repeats} مرات")
+    print(f"{'الاستعلام':<20} {'قبل ms':>10} {'بعد ms':>10} {'التحسن':>8}")
+    with app.app_context():
+        for name, before, after in cases:
+            assert before() == after(), name
+            before_ms = median_ms(before, repeats)
+            after_ms = median_ms(after, repeats)
+            print(f"{name:<20} {before_ms:>10.1f} {after_ms:>10.1f} {before_ms / after_ms:>7.1f}x", flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس أثر التقارير الثقيلة على حفظ نقاط البيع
+Report Isolation Benchmark
+
+يشغل خيوط تطبع /print_all_invoices/sales كاملاً بشكل متواصل، وفي نفس الوقت خيوط
+حفظ /api/sales/create، ويطبع معدل الحفظ وزمنه p50/p95 مع نسخة التقارير وبدونها:
+
+    live      - التقارير تقرأ من قاعدة الكتابة (REPORTING_SNAPSHOT=0)
+    snapshot  - التقارير تقرأ من نسخة SQLite (REPORTING_SNAPSHOT=1)
+
+ويكرر القياس مع SQLITE_JOURNAL_MODE=DELETE حيث يمنع القارئ الطويل الكتابة تماماً.
+كل إعداد في عملية مستقلة على قاعدة مؤقتة لأن app.py يقرأ البيئة عند الاستيراد.
+
+مع --gunicorn يرسل العملاء الطلبات عبر HTTP إلى gunicorn بإعدادات gunicorn.conf.py
+(عامل واحد مع SQLite) بدلاً من خيوط داخل العملية، بعاملي gthread و gevent: في gevent
+لا تتخلى sqlite3 عن الحلقة فيقف الحفظ خلف مسح التقرير.
+
+    python benchmark_report_isolation.py [--gunicorn] [عدد فواتير البيانات] [الثواني]
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REPORT_CLIENTS = 2
+WRITE_CLIENTS = 4
+
+PROFILES = {
+    'live (WAL)': {'REPORTING_SNAPSHOT': '0'},
+    'snapshot (WAL)': {'REPORTING_SNAPSHOT': '1'},
+    'live (DELETE)': {'REPORTING_SNAPSHOT': '0', 'SQLITE_JOURNAL_MODE': 'DELETE'},
+    'snapshot (DELETE)': {'REPORTING_SNAPSHOT': '1', 'SQLITE_JOURNAL_MODE': 'DELETE'},
+}
+
+# --gunicorn: الإعداد المشحون (gunicorn.conf.py) بنوعي العامل - عامل واحد مع SQLite
+GUNICORN_PROFILES = {
+    'gthread live': {'GUNICORN_WORKER_CLASS': 'gthread', 'REPORTING_SNAPSHOT': '0'},
+    'gthread snapshot': {'GUNICORN_WORKER_CLASS': 'gthread', 'REPORTING_SNAPSHOT': '1'},
+    'gevent live': {'GUNICORN_WORKER_CLASS': 'gevent', 'REPORTING_SNAPSHOT': '0'},
+    'gevent snapshot': {'GUNICORN_WORKER_CLASS': 'gevent', 'REPORTING_SNAPSHOT': '1'},
+}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+def seed_database(client, invoices):
+    for start in range(0, invoices, 5000):
+        client.post('/api/sales/bulk', json={'invoices': [
+            {'subtotal': 10 + i % 90, 'total': 10 + i % 90} for i in range(start, min(invoices, start + 5000))
+        ]})
+
+def run_clients(login, seconds):
+    """خيوط الطباعة والحفظ لمدة ثابتة ثم طباعة سطر واحد
+
+    login() تعيد (get, post) لعميل مسجل الدخول: get(path) تقرأ الاستجابة كاملة،
+    و post(path, body) تعيد True إذا نجح الحفظ.
+    """
+    stop = threading.Event()
+    reports = {'count': 0}
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def report_worker(get, post):
+        while not stop.is_set():
+            get('/print_all_invoices/sales')
+            with lock:
+                reports['count'] += 1
+
+    def write_worker(get, post):
+        while not stop.is_set():
+            started = time.perf_counter()
+            saved = post('/api/sales/create', {'subtotal': 10, 'total': 10})
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                (latencies if saved else failures).append(elapsed)
+
+    threads = [threading.Thread(target=report_worker, args=login()) for _ in range(REPORT_CLIENTS)]
+    threads += [threading.Thread(target=write_worker, args=login()) for _ in range(WRITE_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"{len(latencies) / seconds:>12.0f} {percentile(latencies, 0.5):>8.1f} "
+          f"{percentile(latencies, 0.95):>8.1f} {len(failures):>6} {reports['count']:>8}", flush=True)
+
+def app_client():
+    import logging
+    logging.disable(logging.WARNING)
+    from app import app, init_database
+
+    with app.app_context():
+        init_database()
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin112233'})
+    return app, client
+
+def run_profile(invoices, seconds):
+    """قياس الإعداد الحالي (داخل العملية الفرعية) وطباعة سطر واحد"""
+    app, seed = app_client()
+    seed_database(seed, invoices)
+
+    def login():
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin112233'})
+        return (lambda path: client.get(path).get_data(),
+                lambda path, body: bool((client.post(path, json=body).get_json(silent=True) or {}).get('success')))
+
+    run_clients(login, seconds)
+
+def run_gunicorn_profile(invoices, seconds, env, port):
+    """نفس القياس عبر HTTP على gunicorn بإعدادات gunicorn.conf.py (عامل واحد مع SQLite)"""
+    import requests
+    from benchmark_workers import start_server
+
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--seed', str(invoices)],
+                   cwd=BASE_DIR, env=env, check=True)
+    server = start_server(int(env.get('GUNICORN_WORKERS', '1')), port, env)
+    base_url = f'http://127.0.0.1:{port}'
+
+    def login():
+        session = requests.Session()
+        session.post(f'{base_url}/login', data={'username': 'admin', 'password': 'admin112233'})
+
+        def post(path, body):
+            response = session.post(base_url + path, json=body, timeout=120)
+            return response.ok and bool(response.json().get('success'))
+        return (lambda path: session.get(base_url + path, timeout=120).content, post)
+
+    try:
+        run_clients(login, seconds)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+def main():
+    if '--profile' in sys.argv:
+        run_profile(int(sys.argv[2]), float(sys.argv[3]))
+        return
+    if '--seed' in sys.argv:
+        seed_database(app_client()[1], int(sys.argv[2]))
+        return
+
+    use_gunicorn = '--gunicorn' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--gunicorn']
+    invoices = int(args[0]) if args else 20000
+    seconds = float(args[1]) if len(args) > 1 else 10
+    print(f"⏱️ {WRITE_CLIENTS} عملاء حفظ و {REPORT_CLIENTS} عملاء طباعة - {invoices} فاتورة - {seconds:g} ثانية"
+          + (" - gunicorn" if use_gunicorn else ""))
+    print(f"{'الإعداد':<18} {'حفظ/ثانية':>12} {'p50 ms':>8} {'p95 ms':>8} {'فشل':>6} {'تقارير':>8}")
+    for name, overrides in (GUNICORN_PROFILES if use_gunicorn else PROFILES).items():
+        workdir = tempfile.mkdtemp(prefix='accounting_reports_')
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'accounting.db')}", **overrides)
+        print(f"{name:<18}", end=' ', flush=True)
+        if use_gunicorn:
+            run_gunicorn_profile(invoices, seconds, env, 5056)
+        else:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--profile', str(invoices), str(seconds)],
+                           cwd=BASE_DIR, env=env)
+
+if __name__ == '__main__':
+    main()
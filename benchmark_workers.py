@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس توسع gunicorn بعدد العمال على نفس الخادم
+Gunicorn Worker Scaling Benchmark
+
+يهيئ قاعدة مؤقتة ببيانات تجريبية (init-db مرة واحدة)، ثم يشغل gunicorn بعدد
+عمال 1، 2، 4 ... حتى عدد المعالجات، ولكل عدد يرسل عملاء متزامنون (عمليات مستقلة
+بجلسات مسجلة الدخول) طلبات قراءة من الشاشات الساخنة لمدة ثابتة، ويطبع عدد الطلبات
+في الثانية وزمن الاستجابة p50/p95.
+
+    python benchmark_workers.py [--clients 16] [--seconds 15] [--max-workers 8]
+
+إعدادات العامل من gunicorn.conf.py (GUNICORN_WORKER_CLASS و GUNICORN_THREADS)،
+و DATABASE_URL إذا حدد يستخدم بدلاً من SQLite المؤقت.
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# مزيج طلبات القراءة في الشاشات الساخنة
+REQUEST_MIX = [
+    '/api/sales/list',
+    '/api/expenses/list',
+    '/api/sales/summary',
+    '/api/reports/periods?type=sales&grain=day',
+    '/api/autocomplete/products?prefix=م',
+]
+
+def seed_database(env):
+    """init-db ثم بيانات تجريبية عبر الواجهة البرمجية نفسها (في عملية مستقلة)"""
+    script = '''
+from app import app, init_database
+with app.app_context():
+    init_database()
+client = app.test_client()
+client.post('/login', data={'username': 'admin', 'password': 'admin112233'})
+client.post('/api/sales/bulk', json={'invoices': [
+    {'subtotal': 10 + i % 90, 'total': 10 + i % 90, 'date': f'2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}'}
+    for i in range(2000)
+]})
+for i in range(200):
+    client.post('/api/expenses/create', json={'description': f'مصروف {i}', 'amount': 5 + i})
+'''
+    subprocess.run([sys.executable, '-c', script], cwd=BASE_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def start_server(workers, port, env):
+    env = dict(env, GUNICORN_WORKERS=str(workers), PORT=str(port))
+    process = subprocess.Popen(
+        ['gunicorn', 'app:create_app()', '-c', 'gunicorn.conf.py'],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('لم يبدأ الخادم خلال 30 ثانية')
+
+def client_loop(args):
+    """عميل واحد: تسجيل الدخول ثم طلبات متتالية حتى انتهاء المدة - يعيد الأزمنة بالملي ثانية"""
+    base_url, seconds, offset = args
+    session = requests.Session()
+    session.post(f'{base_url}/login', data={'username': 'admin', 'password': 'admin112233'})
+    latencies, errors, index = [], 0, offset
+    stop_at = time.perf_counter() + seconds
+    while time.perf_counter() < stop_at:
+        path = REQUEST_MIX[index % len(REQUEST_MIX)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=30)
+            if response.status_code != 200:
+                errors += 1
+        except requests.RequestException:
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, errors
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس توسع gunicorn بعدد العمال')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=int, default=15)
+    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if 'DATABASE_URL' not in env:
+        env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='accounting_workers_'), 'accounting.db')}"
+    print("🗄️ تهيئة القاعدة وإضافة البيانات التجريبية...")
+    seed_database(env)
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(f"⏱️ {args.clients} عميل × {args.seconds} ثانية لكل عدد عمال "
+          f"({env.get('GUNICORN_WORKER_CLASS', 'gevent' if env['DATABASE_URL'].startswith('postgres') else 'gthread')})")
+    print(f"{'العمال':>6} {'طلب/ثانية':>10} {'p50 ms':>8} {'p95 ms':>8} {'أخطاء':>6}")
+
+    for workers in worker_counts:
+        server = start_server(workers, args.port, env)
+        try:
+            base_url = f'http://127.0.0.1:{args.port}'
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(client_loop, [(base_url, args.seconds, n) for n in range(args.clients)])
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+        latencies = [value for result in results for value in result[0]]
+        errors = sum(result[1] for result in results)
+        print(f"{workers:>6} {len(latencies) / args.seconds:>10.0f} {percentile(latencies, 0.5):>8.1f} "
+              f"{percentile(latencies, 0.95):>8.1f} {errors:>6}", flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس معدل الكتابة مع عملاء متزامنين
+Write Throughput Benchmark
+
+يرسل كل عميل (خيط بجلسة مستقلة) طلبات /api/expenses/create متتالية، ويقيس عدد
+الكتابات الناجحة في الثانية والطلبات الفاشلة ("database is locked" مثلاً) لكل
+عدد عملاء من 1 إلى 32، في ثلاثة إعدادات:
+
+    default  - إعدادات SQLite الافتراضية (journal_mode=DELETE و synchronous=FULL)
+    wal      - ملف التخزين في app.py (WAL و NORMAL و mmap و busy_timeout)
+    group    - ملف التخزين مع كاتب الاعتماد الجماعي (GROUP_COMMIT=1)
+
+كل إعداد يعمل في عملية مستقلة على قاعدة مؤقتة لأن app.py يقرأ البيئة عند الاستيراد.
+
+    python benchmark_write_throughput.py [عدد الطلبات لكل عميل]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CLIENT_COUNTS = [1, 2, 4, 8, 16, 32]
+
+PROFILES = {
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'GROUP_COMMIT': '0'},
+    'wal': {'GROUP_COMMIT': '0'},
+    'group': {'GROUP_COMMIT': '1'},
+}
+
+def run_profile(requests_per_client):
+    """قياس الإعداد الحالي (داخل العملية الفرعية) وطباعة سطر لكل عدد عملاء"""
+    import logging
+    logging.disable(logging.WARNING)
+    from app import app, init_database
+
+    with app.app_context():
+        init_database()
+
+    for clients in CLIENT_COUNTS:
+        sessions = []
+        for _ in range(clients):
+            client = app.test_client()
+            client.post('/login', data={'username': 'admin', 'password': 'admin112233'})
+            sessions.append(client)
+
+        counts = {'ok': 0, 'failed': 0}
+        counts_lock = threading.Lock()
+        start_barrier = threading.Barrier(clients + 1)
+
+        def worker(client, number):
+            start_barrier.wait()
+            for index in range(requests_per_client):
+                response = client.post('/api/expenses/create', json={
+                    'description': f'مصروف قياس {number}-{index}', 'amount': 10
+                })
+                ok = response.status_code == 200 and response.get_json().get('success')
+                with counts_lock:
+                    counts['ok' if ok else 'failed'] += 1
+
+        threads = [threading.Thread(target=worker, args=(client, number)) for number, client in enumerate(sessions)]
+        for thread in threads:
+            thread.start()
+        start_barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        print(f"{clients:>8} {counts['ok'] / elapsed:>12.0f} {counts['failed']:>8}", flush=True)
+
+def main():
+    requests_per_client = int(sys.argv[2] if '--profile' in sys.argv else (sys.argv[1] if len(sys.argv) > 1 else 25))
+    if '--profile' in sys.argv:
+        run_profile(requests_per_client)
+        return
+
+    print("⏱️ قياس معدل الكتابة - /api/expenses/create")
+    print(f"   {requests_per_client} طلب لكل عميل")
+    for name, overrides in PROFILES.items():
+        workdir = tempfile.mkdtemp(prefix='accounting_bench_')
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'accounting.db')}", **overrides)
+        print(f"\n{'=' * 40}\n📊 {name}\n{'=' * 40}")
+        print(f"{'العملاء':>8} {'كتابة/ثانية':>12} {'فشل':>8}", flush=True)
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--profile', str(requests_per_client)],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+فحص ترقيم القوائم بالمؤشر
+Keyset Pagination Check
+
+يملأ جدول المبيعات في قاعدة مؤقتة بفواتير تتكرر تواريخها (عدة فواتير في نفس
+اللحظة) مع ذيل بلا تاريخ، ثم يمر على /api/sales/list صفحة بعد صفحة ويتحقق من:
+
+    - ظهور كل فاتورة مرة واحدة بالترتيب (date, id) تنازلياً والصفوف بلا تاريخ آخراً
+    - أن زمن الصفحة العميقة لا يكبر مع عمقها (لا يزيد عن DEPTH_TOLERANCE × الأولى)
+
+ويفشل (رمز خروج 1) إذا لم يتحقق أي منهما.
+
+    python check_keyset_paging.py [عدد الفواتير]
+"""
+
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PAGE_SIZE = 500
+# فواتير في نفس اللحظة - تختبر ترتيب المعرف داخل التاريخ الواحد
+SAME_DATE_ROWS = 7
+UNDATED_ROWS = 1200
+# الصفحة العميقة قد تكون أبطأ قليلاً (ذاكرة التخزين المؤقت) لكن لا تكبر مع العمق
+DEPTH_TOLERANCE = 3
+REPEATS = 5
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    if 'DATABASE_URL' not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(prefix='accounting_paging_'), 'accounting.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['REPORTING_SNAPSHOT'] = '0'
+    logging.disable(logging.WARNING)
+    from app import app, db, init_database, list_page, Sale
+
+    with app.app_context():
+        init_database()
+        print(f"🗄️ إضافة {invoices} فاتورة و {UNDATED_ROWS} بلا تاريخ...")
+        start = datetime(2024, 1, 1, 8)
+        for offset in range(0, invoices, 50000):
+            db.session.execute(Sale.__table__.insert(), [
+                {'subtotal': 10, 'discount': 0, 'total': 10, 'payment_status': 'unpaid', 'paid_amount': 0,
+                 'branch_code': '', 'date': start + timedelta(minutes=i // SAME_DATE_ROWS)}
+                for i in range(offset, min(invoices, offset + 50000))
+            ])
+        db.session.execute(Sale.__table__.insert(), [
+            {'subtotal': 10, 'discount': 0, 'total': 10, 'payment_status': 'unpaid', 'paid_amount': 0,
+             'branch_code': '', 'date': None}
+            for _ in range(UNDATED_ROWS)
+        ])
+        db.session.commit()
+        expected = [row.id for row in db.session.query(Sale.id).filter(Sale.date.isnot(None))
+                    .order_by(Sale.date.desc(), Sale.id.desc())]
+        expected += [row.id for row in db.session.query(Sale.id).filter(Sale.date.is_(None)).order_by(Sale.id.desc())]
+
+    def page(cursor):
+        query = f'/?limit={PAGE_SIZE}' + (f'&cursor={cursor}' if cursor else '')
+        with app.test_request_context(query):
+            rows, next_cursor = list_page('sales')
+            db.session.remove()
+        return [row.id for row in rows], next_cursor
+
+    def page_ms(cursor):
+        timings = []
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            page(cursor)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    seen, cursors, cursor = [], [None], None
+    while True:
+        ids, cursor = page(cursor)
+        seen += ids
+        if not cursor:
+            break
+        cursors.append(cursor)
+
+    failures = []
+    if seen != expected:
+        failures.append(f'الترتيب أو التكرار: {len(seen)} صف مقابل {len(expected)} متوقع')
+    print(f"{'✅' if seen == expected else '❌'} {len(cursors)} صفحة - كل فاتورة مرة واحدة بالترتيب")
+
+    # آخر صفحة مؤرخة قبل ذيل الصفوف بلا تاريخ
+    deep_index = (invoices - 1) // PAGE_SIZE
+    depths = {'الأولى': cursors[0], 'الوسطى': cursors[deep_index // 2], 'العميقة': cursors[deep_index],
+              'بلا تاريخ': cursors[-1]}
+    timings = {name: page_ms(cursor) for name, cursor in depths.items()}
+    for name, elapsed in timings.items():
+        print(f"   الصفحة {name:<10} {elapsed:>8.1f} ms")
+    if timings['العميقة'] > DEPTH_TOLERANCE * timings['الأولى']:
+        failures.append('زمن الصفحة العميقة يكبر مع العمق')
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ زمن الصفحة ثابت مع العمق")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+فحص خطط تنفيذ الاستعلامات الساخنة
+Query Plan Regression Check
+
+يشغل EXPLAIN QUERY PLAN على كل استعلام متكرر في التطبيق ويفشل (رمز خروج 1)
+إذا رجع أي منها إلى مسح كامل للجدول بدلاً من استخدام فهرس، أو إلى فرز مؤقت
+لتجميع الفترات بدلاً من قراءة فهرس day/month مرتباً، أو إذا لم تبدأ صفحة ما بعد
+المؤشر البحث من المؤشر في الفهرس.
+"""
+
+import re
+import sys
+from datetime import datetime
+
+from app import (
+    app, db, init_database, period_totals_query, Sale, SaleItem, Purchase, Expense, Payroll, JournalEntry, JournalLine
+)
+
+# سطر خطة بصيغة "SCAN <table>" بدون USING INDEX يعني مسحاً كاملاً للجدول
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (\w+)$')
+# فرز مؤقت للتجميع يعني أن GROUP BY لا يقرأ فهرساً مرتباً
+TEMP_GROUP_BY_PATTERN = re.compile(r'USE TEMP B-TREE FOR GROUP BY')
+# صفحة بعد المؤشر يجب أن تبدأ البحث من المؤشر (SEARCH)، لا أن تمسح الفهرس من أوله
+SEEK_QUERY_SUFFIX = ': page after cursor'
+SEEK_PATTERN = re.compile(r'^SEARCH \w+ USING (COVERING )?INDEX')
+
+def hot_queries():
+    """الاستعلامات المتكررة في المسارات الساخنة - تبنى من النماذج نفسها"""
+    since = datetime(2025, 1, 1)
+    cursor_date = datetime(2025, 6, 1)
+    queries = {}
+
+    for model, counterparty in [
+        (Sale, Sale.customer_id),
+        (Purchase, Purchase.supplier_id),
+        (Expense, Expense.vendor),
+        (Payroll, Payroll.employee_id),
+    ]:
+        name = model.__tablename__
+        # نفس استعلامات keyset_page: الصفوف المؤرخة ثم ذيل الصفوف بلا تاريخ
+        dated = model.query.filter(model.date.isnot(None))
+        newest_first = (model.date.desc(), model.id.desc())
+
+        queries[f'{name}: latest page'] = dated.order_by(*newest_first).limit(50)
+        queries[f'{name}: page after cursor'] = dated.filter(
+            db.tuple_(model.date, model.id) < (cursor_date, 100)
+        ).order_by(*newest_first).limit(50)
+        queries[f'{name}: undated tail'] = model.query.filter(
+            model.date.is_(None), model.id < 100
+        ).order_by(model.id.desc()).limit(50)
+        queries[f'{name}: date range'] = dated.filter(
+            model.date >= since, model.date < cursor_date
+        ).order_by(*newest_first).limit(50)
+        queries[f'{name}: by payment status'] = dated.filter(
+            model.payment_status == 'unpaid'
+        ).order_by(*newest_first).limit(50)
+        queries[f'{name}: by counterparty'] = dated.filter(
+            counterparty == 1
+        ).order_by(*newest_first).limit(50)
+
+    for doc_type in ('sales', 'purchases', 'expenses', 'payroll'):
+        queries[f'{doc_type}: daily totals'] = period_totals_query(doc_type, 'day', since, cursor_date)
+        queries[f'{doc_type}: monthly totals'] = period_totals_query(doc_type, 'month')
+
+    queries['sale_item: by sale'] = SaleItem.query.filter(SaleItem.sale_id == 1)
+    queries['sale_item: by product'] = SaleItem.query.filter(SaleItem.product_id == 1)
+
+    # عكس قيود مستند عند تعديله أو حذفه، وكشف حساب لفترة
+    queries['journal_entry: by document'] = JournalEntry.query.filter(
+        JournalEntry.doc_type == 'sales', JournalEntry.doc_id == 1
+    )
+    queries['journal_line: by entry'] = JournalLine.query.filter(JournalLine.entry_id == 1)
+    queries['journal_line: account statement'] = JournalLine.query.filter(
+        JournalLine.account_code == '1110', JournalLine.date >= since, JournalLine.date < cursor_date
+    ).order_by(JournalLine.date)
+
+    return queries
+
+def explain(query):
+    """إرجاع أسطر خطة التنفيذ لاستعلام SQLAlchemy"""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[key] for key in (compiled.positiontup or []))
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', params).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans():
+    """فحص جميع الاستعلامات الساخنة وإرجاع قائمة الاستعلامات التي تمسح الجدول أو تفرز مؤقتاً"""
+    failures = []
+
+    for name, query in hot_queries().items():
+        plan = explain(query)
+        scans = [line for line in plan
+                 if FULL_SCAN_PATTERN.match(line.strip()) or TEMP_GROUP_BY_PATTERN.search(line)]
+        if name.endswith(SEEK_QUERY_SUFFIX) and not any(SEEK_PATTERN.match(line.strip()) for line in plan):
+            scans += plan
+
+        if scans:
+            failures.append(name)
+            print(f"❌ {name}")
+        else:
+            print(f"✅ {name}")
+        for line in plan:
+            print(f"      {line}")
+
+    return failures
+
+if __name__ == "__main__":
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            print("⚠️ هذا الفحص مخصص لقاعدة بيانات SQLite")
+            sys.exit(0)
+
+        init_database()
+
+        print("🔍 فحص خطط تنفيذ الاستعلامات الساخنة")
+        print("=" * 50)
+        failures = check_query_plans()
+        print("=" * 50)
+
+        if failures:
+            print(f"❌ {len(failures)} استعلام يمسح الجدول كاملاً أو يفرز مؤقتاً")
+            sys.exit(1)
+
+        print("✅ جميع الاستعلامات تستخدم الفهارس")
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+إعدادات Gunicorn
+Gunicorn configuration
+
+بث التغييرات /api/events يبقي اتصالاً مفتوحاً لكل تبويب، لذلك نستخدم مع
+PostgreSQL عامل gevent الذي يتحمل آلاف الاتصالات الخاملة في عملية واحدة
+(psycogreen يجعل انتظار الاستعلام يتخلى عن الحلقة). مع SQLite الافتراضي gthread:
+وحدة sqlite3 لا تتخلى عن حلقة gevent، فنسخة التقارير ومسح التقرير الطويل يوقفان
+كل الطلبات في العامل الوحيد بما فيها حفظ نقاط البيع، بينما الخيوط تتناوب عليها.
+يمكن اختيار أي منهما عبر GUNICORN_WORKER_CLASS.
+
+في gthread كل قناة بث مفتوحة تحجز خيطاً حتى 300 ثانية، لذلك خيوط العامل:
+
+    GUNICORN_THREADS = EVENT_STREAM_MAX_CLIENTS (40) + GUNICORN_REQUEST_THREADS (8)
+
+القنوات لا تتجاوز EVENT_STREAM_MAX_CLIENTS في العامل (ما بعدها يرد 503 ويرجع
+التبويب إلى الفحص الدوري)، فتبقى GUNICORN_REQUEST_THREADS خيوطاً حرة لحفظ نقاط
+البيع وبقية الطلبات مهما كثرت التبويبات. ارفع EVENT_STREAM_MAX_CLIENTS إلى عدد
+التبويبات المتوقع في العامل.
+
+مع PostgreSQL (DATABASE_URL) يبدأ عدد العمال من عدد المعالجات، ولكل عامل مجمع
+اتصالات خاص (DB_POOL_SIZE + DB_MAX_OVERFLOW في app.py). مع SQLite عامل واحد
+افتراضياً لأن الكتابة من كاتب واحد؛ يمكن رفعه بـ GUNICORN_WORKERS (WAL يسمح
+بالقراءة المتوازية).
+
+التطبيق يحمل مرة واحدة في العملية الرئيسية (preload_app) ثم ينسخ للعمال، لأن
+استيراد app.py لا ينشئ جداول ولا يفتح اتصالات - الجداول من أمر init-db قبل
+التشغيل:
+
+    flask --app app init-db && gunicorn "app:create_app()" -c gunicorn.conf.py
+"""
+
+import multiprocessing
+import os
+
+uses_postgres = os.environ.get('DATABASE_URL', '').startswith('postgres')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent' if uses_postgres else 'gthread')
+
+# gevent يجب أن يرقع threading و socket قبل تحميل التطبيق مسبقاً، وإلا بقيت أقفال
+# app.py (بث التغييرات، فهرس الإكمال) أقفال نظام توقف العامل كله عند الانتظار
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# gevent: عامل لكل معالج؛ gthread/sync: القاعدة المعتادة 2 × المعالجات + 1
+cpus = multiprocessing.cpu_count()
+default_workers = cpus if worker_class == 'gevent' else cpus * 2 + 1
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', default_workers if uses_postgres else 1))
+# عدد الاتصالات المتزامنة لكل عامل gevent
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+# عدد الخيوط لكل عامل gthread: قنوات البث + خيوط الطلبات العادية
+stream_threads = int(os.environ.get('EVENT_STREAM_MAX_CLIENTS', '40'))
+request_threads = int(os.environ.get('GUNICORN_REQUEST_THREADS', '8'))
+threads = int(os.environ.get('GUNICORN_THREADS', stream_threads + request_threads))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def post_fork(server, worker):
+    """لكل عامل اتصالاته الخاصة: لا يرث اتصالات مجمع العملية الرئيسية"""
+    if worker_class == 'gevent' and uses_postgres:
+        # psycopg2 ينتظر الشبكة داخل libpq فيوقف كل عامل gevent؛ psycogreen يجعله يتخلى عن الحلقة
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    if preload_app:
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
@@ -1,5 +1,5 @@
-from app import app, db
+from app import app, init_database
 
 with app.app_context():
-    db.create_all()
+    init_database()
     print('Database created successfully')
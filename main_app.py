@@ -12,6 +12,15 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import json
 
+from src.database.sequences import (
+    day_period, ensure_sequence_table, format_document_number, peek_number, reserve_numbers, seed_sequence
+)
+from src.database.search_index import (
+    SearchSource, build_match_query, ensure_search_index, ensure_search_key_column, matching_ids_sql
+)
+from src.utils.arabic_normalization import normalize_arabic
+from src.utils.autocomplete import PrefixIndex, word_keys
+
 # إنشاء التطبيق
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -28,6 +37,39 @@ def inject_user():
 # إعداد قاعدة البيانات
 DATABASE = 'accounting.db'
 
+# مصادر فهرس البحث النصي في هذه القاعدة
+SEARCH_SOURCES = [
+    SearchSource(0, 'products', 'products', "{product_code} || ' ' || {product_name}",
+                 ['category', 'description', 'name_search_key']),
+    SearchSource(1, 'raw_materials', 'raw_materials', "{material_code} || ' ' || {material_name}",
+                 ['supplier_name', 'description', 'name_search_key']),
+]
+
+# أعمدة الاسم بعد التطبيع العربي: الجدول -> عمود المصدر
+SEARCH_KEY_SOURCES = {
+    'products': 'product_name',
+    'raw_materials': 'material_name',
+}
+
+# تعديل المخزون وحده لا يغير الفهرس، لذلك محفز التعديل على أعمدته فقط
+PRODUCTS_VERSION_SQL = '''
+    CREATE TABLE IF NOT EXISTS table_version (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO table_version (table_name, version) VALUES ('products', 0);
+    CREATE TRIGGER IF NOT EXISTS products_version_ai AFTER INSERT ON products BEGIN
+        UPDATE table_version SET version = version + 1 WHERE table_name = 'products';
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_version_au
+    AFTER UPDATE OF product_code, product_name, selling_price, is_active ON products BEGIN
+        UPDATE table_version SET version = version + 1 WHERE table_name = 'products';
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_version_ad AFTER DELETE ON products BEGIN
+        UPDATE table_version SET version = version + 1 WHERE table_name = 'products';
+    END;
+'''
+
 def get_db_connection():
     """الحصول على اتصال قاعدة البيانات"""
     conn = sqlite3.connect(DATABASE)
@@ -82,6 +124,7 @@ def init_database():
             min_stock_level INTEGER DEFAULT 0,
             current_stock INTEGER DEFAULT 0,
             is_active BOOLEAN DEFAULT 1,
+            name_search_key TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -140,6 +183,7 @@ def init_database():
             last_purchase_price REAL DEFAULT 0.0,
             last_purchase_date DATE,
             is_active BOOLEAN DEFAULT 1,
+            name_search_key TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -182,6 +226,15 @@ def init_database():
         )
     ''')
     
+    # فهرس تاريخ الفاتورة لمرشحات الفترات (اليوم/الشهر)
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_sales_invoice_date ON sales (invoice_date)')
+    
+    # جدول عدادات أرقام الفواتير (فرع/يوم)
+    ensure_sequence_table(conn)
+    
+    # إصدار جدول المنتجات لفهرس الإكمال - يزيد مع أي كتابة تغير الفهرس من أي عملية
+    conn.executescript(PRODUCTS_VERSION_SQL)
+    
     # إنشاء المستخدم الافتراضي
     admin_exists = conn.execute('SELECT id FROM users WHERE username = ?', ('admin',)).fetchone()
     if not admin_exists:
@@ -297,6 +350,11 @@ def init_database():
                             VALUES (?, ?, ?, ?, ?, ?, ?)
                         ''', (product_id, material_id, quantity, unit, cost_per_unit, total_cost, notes))
     
+    # مفاتيح البحث المطبعة للصفوف الجديدة والقديمة، ثم فهرس البحث النصي
+    for table, source_column in SEARCH_KEY_SOURCES.items():
+        ensure_search_key_column(conn, table, 'name_search_key', [source_column])
+    ensure_search_index(conn, SEARCH_SOURCES)
+    
     conn.commit()
     conn.close()
 
@@ -453,10 +511,10 @@ def dashboard():
     # إحصائيات سريعة
     today = datetime.now().date()
     
-    # مبيعات اليوم
+    # مبيعات اليوم - فترة نصف مفتوحة [اليوم، الغد) على العمود نفسه حتى يستخدم الفهرس
     daily_sales = conn.execute(
-        'SELECT COALESCE(SUM(final_amount), 0) as total FROM sales WHERE DATE(invoice_date) = ?',
-        (today,)
+        'SELECT COALESCE(SUM(final_amount), 0) as total FROM sales WHERE invoice_date >= ? AND invoice_date < ?',
+        (today, today + timedelta(days=1))
     ).fetchone()['total']
     
     # مبيعات الشهر
@@ -502,12 +560,13 @@ def products():
 
     conn = get_db_connection()
 
-    if search:
-        products = conn.execute('''
+    match_query = build_match_query(search, normalize_arabic)
+    if match_query:
+        products = conn.execute(f'''
             SELECT * FROM products
-            WHERE (product_name LIKE ? OR product_code LIKE ? OR category LIKE ?)
+            WHERE id IN ({matching_ids_sql('products')})
             ORDER BY product_name
-        ''', (f'%{search}%', f'%{search}%', f'%{search}%')).fetchall()
+        ''', {'query': match_query}).fetchall()
     else:
         products = conn.execute('SELECT * FROM products ORDER BY product_name').fetchall()
 
@@ -523,12 +582,13 @@ def raw_materials():
 
     conn = get_db_connection()
 
-    if search:
-        materials = conn.execute('''
+    match_query = build_match_query(search, normalize_arabic)
+    if match_query:
+        materials = conn.execute(f'''
             SELECT * FROM raw_materials
-            WHERE (material_name LIKE ? OR material_code LIKE ? OR supplier_name LIKE ?)
+            WHERE id IN ({matching_ids_sql('raw_materials')})
             ORDER BY material_name
-        ''', (f'%{search}%', f'%{search}%', f'%{search}%')).fetchall()
+        ''', {'query': match_query}).fetchall()
     else:
         materials = conn.execute('SELECT * FROM raw_materials ORDER BY material_name').fetchall()
 
@@ -605,10 +665,10 @@ def new_sale():
     """صفحة فاتورة مبيعات جديدة"""
     conn = get_db_connection()
     branches = conn.execute('SELECT * FROM branches WHERE is_active = 1').fetchall()
-    products = conn.execute('SELECT * FROM products WHERE is_active = 1').fetchall()
     conn.close()
     
-    return render_template('new_sale.html', branches=branches, products=products)
+    # المنتجات تأتي من /api/autocomplete/products أثناء الكتابة
+    return render_template('new_sale.html', branches=branches)
 
 # API endpoints
 @app.route('/api/products')
@@ -627,57 +687,104 @@ def api_products():
         'stock': p['current_stock']
     } for p in products])
 
+# فهرس بادئات المنتجات (اسم + رمز) يبنى عند أول طلب. المنتجات تعدل من عمليات أخرى
+# (واجهة سطح المكتب، تطبيق الويب)، فمحفزات الجدول تزيد إصداره في table_version داخل
+# معاملة الكتابة نفسها، وكل طلب يقرأ هذا الصف بالمفتاح ويعيد البناء إذا تغير
+product_autocomplete = None
+product_autocomplete_version = None
+
+def products_version(conn):
+    """إصدار جدول المنتجات - قراءة صف واحد بالمفتاح الأساسي"""
+    row = conn.execute("SELECT version FROM table_version WHERE table_name = 'products'").fetchone()
+    return row['version'] if row else 0
+
+def get_product_autocomplete():
+    conn = get_db_connection()
+    version = products_version(conn)
+    conn.close()
+    if product_autocomplete is None or version != product_autocomplete_version:
+        product_autocomplete_refresh()
+    return product_autocomplete
+
+def product_autocomplete_refresh():
+    global product_autocomplete, product_autocomplete_version
+    index = PrefixIndex(lambda product: word_keys(product['name'], product['code']))
+    conn = get_db_connection()
+    # الإصدار والصفوف من نفس لقطة القراءة
+    conn.execute('BEGIN')
+    version = products_version(conn)
+    products = conn.execute('''
+        SELECT id, product_code, product_name, selling_price FROM products WHERE is_active = 1
+    ''').fetchall()
+    conn.close()
+    index.load({
+        'id': p['id'],
+        'code': p['product_code'],
+        'name': p['product_name'],
+        'price': p['selling_price']
+    } for p in products)
+    product_autocomplete = index
+    product_autocomplete_version = version
+
+@app.route('/api/autocomplete/products')
+@login_required
+def api_autocomplete_products():
+    """API للإكمال التلقائي للمنتجات - prefix و limit"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify(get_product_autocomplete().search(request.args.get('prefix', ''), limit))
+
 @app.route('/api/generate_invoice_number')
 @login_required
 def api_generate_invoice_number():
-    """API لتوليد رقم فاتورة جديد"""
+    """API لعرض رقم الفاتورة التالي (معاينة لا تحجز الرقم)"""
     branch_id = request.args.get('branch_id', 1)
-    today = datetime.now()
+    period = day_period()
     
     conn = get_db_connection()
+    branch_code = sale_branch_code(conn, branch_id)
     
-    # البحث عن آخر رقم فاتورة لهذا اليوم والفرع
-    last_sale = conn.execute('''
-        SELECT invoice_number FROM sales 
-        WHERE branch_id = ? AND DATE(invoice_date) = DATE(?)
-        ORDER BY id DESC LIMIT 1
-    ''', (branch_id, today.strftime('%Y-%m-%d'))).fetchone()
-    
-    sequence = 1
-    if last_sale:
-        try:
-            last_sequence = int(last_sale['invoice_number'].split('-')[-1])
-            sequence = last_sequence + 1
-        except:
-            sequence = 1
-    
-    # الحصول على رمز الفرع
-    branch = conn.execute('SELECT branch_code FROM branches WHERE id = ?', (branch_id,)).fetchone()
-    branch_code = branch['branch_code'] if branch else 'XX'
-    
+    # قراءة العداد فقط: الرقم يحجز عند الحفظ، فلا تترك الفواتير غير المحفوظة فجوات
+    sequence = peek_number(conn, 'sales', 'sales', 'invoice_number', '', branch_code, period)
     conn.close()
     
     # تنسيق رقم الفاتورة: BRANCH-YYYYMMDD-XXXX
-    invoice_number = f"{branch_code}-{today.strftime('%Y%m%d')}-{sequence:04d}"
+    invoice_number = format_document_number('', sequence, branch_code, period)
     
     return jsonify({'invoice_number': invoice_number})
 
+def sale_branch_code(conn, branch_id):
+    """رمز الفرع في رقم الفاتورة"""
+    branch = conn.execute('SELECT branch_code FROM branches WHERE id = ?', (branch_id,)).fetchone()
+    return branch['branch_code'] if branch else 'XX'
+
+def allocate_invoice_number(conn, branch_id):
+    """حجز رقم الفاتورة من عداد الفرع/اليوم داخل معاملة الحفظ - يلغى معها إذا فشلت"""
+    period = day_period()
+    branch_code = sale_branch_code(conn, branch_id)
+    seed_sequence(conn, 'sales', 'sales', 'invoice_number', '', branch_code, period)
+    sequence = reserve_numbers(conn, 'sales', branch_code, period)[0]
+    return format_document_number('', sequence, branch_code, period)
+
 @app.route('/api/save_sale', methods=['POST'])
 @login_required
 def api_save_sale():
     """API لحفظ فاتورة مبيعات"""
+    conn = None
     try:
         data = request.get_json()
         
         conn = get_db_connection()
         
+        # الرقم يحجز هنا في نفس المعاملة؛ رقم المعاينة من النموذج لا يعتمد
+        invoice_number = allocate_invoice_number(conn, data['branch_id'])
+        
         # إنشاء فاتورة جديدة
         cursor = conn.execute('''
             INSERT INTO sales (invoice_number, branch_id, customer_name, invoice_date,
                              total_amount, tax_amount, final_amount, payment_method, created_by)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            data['invoice_number'],
+            invoice_number,
             data['branch_id'],
             data.get('customer_name'),
             data['invoice_date'],
@@ -713,10 +820,15 @@ def api_save_sale():
         return jsonify({
             'status': 'success',
             'message': 'تم حفظ الفاتورة بنجاح',
-            'sale_id': sale_id
+            'sale_id': sale_id,
+            'invoice_number': invoice_number
         })
         
     except Exception as e:
+        # التراجع يلغي الرقم المحجوز مع الفاتورة فلا تبقى فجوة
+        if conn:
+            conn.rollback()
+            conn.close()
         return jsonify({
             'status': 'error',
             'message': f'خطأ في حفظ الفاتورة: {str(e)}'
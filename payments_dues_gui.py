@@ -19,6 +19,10 @@ import pandas as pd
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.pdfgen import canvas
 
+from src.database.sequences import (
+    day_period, ensure_sequence_table, format_document_number, reserve_numbers, seed_sequence
+)
+
 class PaymentsDuesGUI:
     def __init__(self, root):
         self.root = root
@@ -120,6 +124,9 @@ class PaymentsDuesGUI:
             )
         ''')
         
+        # جدول عدادات أرقام الدفعات (يومي)
+        ensure_sequence_table(self.conn)
+        
         self.conn.commit()
         
     def insert_sample_data(self):
@@ -719,24 +726,13 @@ class PaymentsDuesGUI:
             messagebox.showerror("خطأ / Error", f"حدث خطأ أثناء حفظ الدفعة / Error saving payment: {str(e)}")
 
     def generate_payment_number(self):
-        """توليد رقم دفعة تلقائي"""
-        today = datetime.date.today()
-        prefix = f"PAY-{today.strftime('%Y%m%d')}"
+        """توليد رقم دفعة تلقائي - يحجز من العداد اليومي داخل معاملة حفظ الدفعة"""
+        period = day_period()
+        # أول دفعة في اليوم تبدأ بعد أرقام PAY-YYYYMMDD-NNN الموجودة
+        seed_sequence(self.conn, 'payments', 'payments', 'payment_number', 'PAY', period=period)
+        new_number = reserve_numbers(self.conn, 'payments', period=period)[0]
 
-        self.cursor.execute('''
-            SELECT payment_number FROM payments
-            WHERE payment_number LIKE ?
-            ORDER BY payment_number DESC LIMIT 1
-        ''', (f"{prefix}%",))
-
-        result = self.cursor.fetchone()
-        if result:
-            last_number = int(result[0].split('-')[-1])
-            new_number = last_number + 1
-        else:
-            new_number = 1
-
-        return f"{prefix}-{new_number:03d}"
+        return format_document_number('PAY', new_number, period=period, width=3)
 
     def update_transaction_payment(self, source_table, transaction_id, payment_amount):
         """تحديث المعاملة بالدفعة الجديدة"""
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+تشغيل اختبارات الواجهة البرمجية على كل قاعدة بيانات
+Database Backend Test Runner
+
+يشغل نفس مجموعة الاختبارات على SQLite (ملف مؤقت) وعلى PostgreSQL إذا حدد
+TEST_POSTGRES_URL. كل قاعدة تختبر في عملية مستقلة لأن app.py يقرأ DATABASE_URL
+عند الاستيراد. إلى جانب المسارات الأساسية تختبر: مولد أرقام المستندات، الرفض الجزئي في
+الإدراج المجمع والعمليات المجمعة، الترقيم بالمؤشر، تحديث الإكمال التلقائي، توجيه التقارير
+إلى النسخة، وثبات عدد الاستعلامات مع عدد الصفوف. قاعدة PostgreSQL يجب أن تكون فارغة
+ومخصصة للاختبار:
+
+    createdb accounting_test
+    TEST_POSTGRES_URL=postgresql://localhost/accounting_test python run_backend_tests.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+def run_suite():
+    """مجموعة الاختبارات على القاعدة المحددة في DATABASE_URL (داخل العملية الفرعية)"""
+    from app import app, db, init_database
+
+    app.config['TESTING'] = True
+    app.config['QUERY_BUDGET_STRICT'] = True
+    client = app.test_client()
+    month = datetime.now().strftime('%Y-%m')
+    failures = []
+
+    def check(name, response, condition=lambda data: True):
+        data = response.get_json(silent=True) or {}
+        ok = response.status_code == 200 and data.get('success', True) and condition(data)
+        print(f"{'✅' if ok else '❌'} {name}")
+        if not ok:
+            failures.append(name)
+            print(f"   {response.status_code} {data or response.data[:200]}")
+        return data
+
+    def expect(name, ok):
+        print(f"{'✅' if ok else '❌'} {name}")
+        if not ok:
+            failures.append(name)
+
+    with app.app_context():
+        init_database()
+        print(f"🗄️ القاعدة: {db.engine.dialect.name}")
+
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin112233'})
+    if response.status_code not in (200, 302):
+        failures.append('تسجيل الدخول')
+
+    check('إنشاء مصروف', client.post('/api/expenses/create', json={
+        'description': 'فاتورة كهرباء المستشفى', 'vendor': 'شركة الكهرباء', 'amount': 250
+    }))
+    check('إنشاء مبيعة', client.post('/api/sales/create', json={'subtotal': 100, 'total': 115}),
+          lambda data: data.get('invoice_number'))
+    check('إدراج مبيعات مجمع', client.post('/api/sales/bulk', json={'invoices': [
+        {'subtotal': 10, 'total': 10}, {'subtotal': 20, 'total': 20}
+    ]}))
+    check('عمليات مجمعة', client.post('/api/batch/process', json={'operations': [
+        {'id': 'op-1', 'type': 'save', 'entity': 'sales', 'data': {'subtotal': 5, 'total': 5}}
+    ]}), lambda data: data['summary']['successful'] == 1)
+    check('حجز أرقام', client.post('/api/sequences/reserve', json={'doc_type': 'sales', 'count': 5}),
+          lambda data: data['count'] == 5)
+
+    check('قائمة المبيعات', client.get('/api/sales/list'))
+    check('ملخص المبيعات', client.get('/api/sales/summary'))
+    check('مجاميع الفترات', client.get('/api/reports/periods?type=sales&grain=month'),
+          lambda data: any(row['period'] == month and row['count'] == 4 for row in data['periods']))
+    check('تقرير التجميع', client.get('/api/reports/rollup?types=sales,expenses&grain=month'),
+          lambda data: data['totals']['sales']['count'] == 4 and data['totals']['expenses']['amount'] == 250)
+    check('ميزان المراجعة', client.get('/api/ledger/trial-balance'),
+          lambda data: data['balanced'] and data['totals']['debit'] > 0)
+    check('بحث المصروفات بعد التطبيع', client.get('/api/expenses/search?search=الكهربا'),
+          lambda data: data['count'] == 1)
+    check('البحث الموحد', client.get('/api/search?q=كهرباء'),
+          lambda data: any(row['type'] == 'expenses' for row in data['results']))
+    check('سجل التغييرات', client.get('/api/payments/check-updates?since=0'),
+          lambda data: data['hasUpdates'])
+    check('تصدير المبيعات', client.get('/api/sales/export?format=csv'))
+
+    check_document_numbers(client, check)
+    check_bulk_partial_failure(app, db, client, check, expect)
+    check_batch_operations(app, db, client, check, expect)
+    check_keyset_paging(app, db, client, expect)
+    check_autocomplete_invalidation(app, db, client, expect)
+    check_snapshot_routing(app, db, client, expect)
+    check_query_budgets(app, db, client, expect)
+
+    print(f"📊 فشل {len(failures)} اختبار" if failures else "🎉 نجحت كل الاختبارات")
+    return not failures
+
+def check_document_numbers(client, check):
+    """الأرقام المحجوزة لا تتكرر، والفاتورة المرفوضة في الإدراج المجمع لا تستهلك رقماً"""
+    numbers = (lambda count: [f'INV-T1-20250301-{number:04d}' for number in range(1, count + 1)])
+    check('مولد الأرقام: حجز كتلة', client.post('/api/sequences/reserve', json={
+        'doc_type': 'sales', 'branch_code': 'T1', 'date': '2025-03-01', 'count': 3
+    }), lambda data: data['numbers'] == numbers(3))
+    invoice = {'subtotal': 5, 'total': 5, 'branch_code': 'T1', 'date': '2025-03-01'}
+    check('مولد الأرقام: الإدراج المجمع بعد الكتلة', client.post('/api/sales/bulk', json={'invoices': [
+        invoice, dict(invoice, items=[{'product_id': 999999, 'product_name': 'x', 'quantity': 1}]), invoice
+    ]}), lambda data: [row.get('invoice_number') for row in data['results']] == [numbers(5)[3], None, numbers(5)[4]])
+    check('مولد الأرقام: لا فجوة بعد الفاتورة المرفوضة', client.post('/api/sales/create', json=invoice),
+          lambda data: data['invoice_number'] == numbers(6)[5])
+
+def check_bulk_partial_failure(app, db, client, check, expect):
+    """كل فاتورة غير صالحة ترفض برقمها في results وتحفظ البقية"""
+    from app import Sale
+
+    with app.app_context():
+        before = Sale.query.count()
+    data = check('إدراج مجمع جزئي', client.post('/api/sales/bulk', json={'invoices': [
+        {'subtotal': 7, 'total': 7}, 'ليست فاتورة', {'subtotal': 1, 'total': 1, 'items': 'x'},
+        {'subtotal': 1, 'total': 1, 'invoice_number': ['a']}, {'subtotal': 8, 'total': 8}
+    ]}), lambda data: [row['success'] for row in data['results']] == [True, False, False, False, True])
+    with app.app_context():
+        saved = Sale.query.count() - before
+    expect('إدراج مجمع جزئي: المحفوظ فقط الصالح',
+           saved == 2 and [row['index'] for row in data.get('results', [])] == [0, 1, 2, 3, 4])
+
+def check_batch_operations(app, db, client, check, expect):
+    """العملية غير الصالحة تفشل وحدها، وحذف موظف له رواتب يرفض دون حذف"""
+    from app import Employee, Payroll
+
+    with app.app_context():
+        paid, unpaid = Employee(name='موظف برواتب', salary=100), Employee(name='موظف بلا رواتب', salary=100)
+        db.session.add_all([paid, unpaid])
+        db.session.flush()
+        db.session.add(Payroll(employee_id=paid.id, amount=100, month='2025-03'))
+        db.session.commit()
+        paid_id, unpaid_id = paid.id, unpaid.id
+
+    check('عمليات مجمعة: نتيجة لكل عملية', client.post('/api/batch/process', json={'operations': [
+        'ليست عملية',
+        {'id': 'bad-data', 'type': 'save', 'entity': 'expenses', 'data': ['x']},
+        {'id': 'paid', 'type': 'delete', 'entity': 'employees', 'targetId': paid_id},
+        {'id': 'unpaid', 'type': 'delete', 'entity': 'employees', 'targetId': unpaid_id},
+        {'id': 'save', 'type': 'save', 'entity': 'expenses', 'data': {'description': 'صيانة', 'amount': 30}},
+    ]}), lambda data: [row['success'] for row in data['results']] == [False, False, False, True, True])
+    with app.app_context():
+        kept = db.session.get(Employee, paid_id) is not None and db.session.get(Employee, unpaid_id) is None
+    expect('عمليات مجمعة: الموظف صاحب الرواتب باق', kept)
+
+def check_keyset_paging(app, db, client, expect):
+    """/api/sales/list بالمؤشر: كل فاتورة مرة واحدة بترتيب (date, id) والصفوف بلا تاريخ آخراً"""
+    from app import Sale
+
+    with app.app_context():
+        same_moment = datetime(2025, 4, 1, 9, 30)
+        db.session.execute(Sale.__table__.insert(), [
+            {'subtotal': 1, 'discount': 0, 'total': 1, 'payment_status': 'unpaid', 'paid_amount': 0,
+             'branch_code': '', 'date': date} for date in [same_moment] * 4 + [None] * 3
+        ])
+        db.session.commit()
+        expected = [row.id for row in db.session.query(Sale.id).filter(Sale.date.isnot(None))
+                    .order_by(Sale.date.desc(), Sale.id.desc())]
+        expected += [row.id for row in db.session.query(Sale.id).filter(Sale.date.is_(None)).order_by(Sale.id.desc())]
+
+    seen, cursor = [], None
+    for _ in range(len(expected) + 1):
+        data = client.get('/api/sales/list?limit=3' + (f'&cursor={cursor}' if cursor else '')).get_json()
+        seen += [row['id'] for row in data['sales']]
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    expect('ترقيم القوائم بالمؤشر', seen == expected)
+
+def check_autocomplete_invalidation(app, db, client, expect):
+    """الإضافة والتعديل يظهران في الإكمال التلقائي فوراً، والتراجع لا يظهر"""
+    from app import Product
+
+    def names(prefix):
+        return [row['name'] for row in client.get(f'/api/autocomplete/products?prefix={prefix}').get_json()['results']]
+
+    with app.app_context():
+        db.session.add(Product(name='زعتر بلدي', price=5))
+        db.session.commit()
+    first = names('زعت')
+    with app.app_context():
+        db.session.add(Product(name='زعفران', price=9))
+        db.session.commit()
+        product = Product.query.filter_by(name='زعتر بلدي').one()
+        product.name = 'نعناع'
+        db.session.commit()
+        db.session.add(Product(name='زنجبيل', price=3))
+        db.session.flush()
+        db.session.rollback()
+    expect('الإكمال التلقائي بعد التعديل',
+           first == ['زعتر بلدي'] and names('زع') == ['زعفران'] and names('نعن') == ['نعناع'] and names('زنج') == [])
+
+def check_snapshot_routing(app, db, client, expect):
+    """مسارات التقارير تقرأ من نسخة SQLite حتى تحديثها، ومن القاعدة مباشرة على PostgreSQL"""
+    from app import reporting_snapshot_store
+
+    def sales_count():
+        response = client.get('/api/reports/periods?type=sales&grain=month')
+        data = response.get_json()
+        return sum(row['count'] for row in data['periods']), response.headers.get('X-Snapshot-At')
+
+    with app.app_context():
+        source = db.engine.url.database
+        sqlite = db.engine.dialect.name == 'sqlite'
+
+    if sqlite:
+        # عمر كبير حتى لا يبدأ تحديث خلفي أثناء الاختبار، والتحديث هنا متزامن
+        max_age, reporting_snapshot_store.max_age = reporting_snapshot_store.max_age, 3600
+        reporting_snapshot_store.refresh(source)
+    try:
+        before, snapshot_at = sales_count()
+        client.post('/api/sales/create', json={'subtotal': 4, 'total': 4})
+        after, _ = sales_count()
+        if sqlite:
+            reporting_snapshot_store.refresh(source)
+            refreshed, _ = sales_count()
+            expect('توجيه التقارير إلى النسخة', bool(snapshot_at) and after == before and refreshed == before + 1)
+        else:
+            expect('التقارير من القاعدة مباشرة', not snapshot_at and after == before + 1)
+    finally:
+        if sqlite:
+            reporting_snapshot_store.max_age = max_age
+
+# مسارات القوائم والطباعة: عدد استعلاماتها يجب ألا يتغير مع عدد الصفوف
+QUERY_BUDGET_ROUTES = [
+    '/sales', '/purchases', '/employee_payroll',
+    '/print_invoices/sales', '/print_invoices/purchases', '/print_invoices/payroll',
+    '/print_all_invoices/sales', '/print_all_invoices/purchases', '/print_all_invoices/payroll',
+]
+
+def seed_documents(db, count):
+    """count فاتورة مبيعات ومشتريات وراتب، كل منها بطرف مقابل خاص (عميل، مورد، موظف)"""
+    from app import Customer, Employee, Payroll, Purchase, Sale, Supplier
+
+    for index in range(count):
+        customer, supplier = Customer(name=f'عميل {index}'), Supplier(name=f'مورد {index}')
+        employee = Employee(name=f'موظف {index}', salary=1000)
+        db.session.add_all([customer, supplier, employee])
+        db.session.flush()
+        db.session.add_all([
+            Sale(customer_id=customer.id, subtotal=10, total=10),
+            Purchase(supplier_id=supplier.id, subtotal=20, total=20),
+            Payroll(employee_id=employee.id, amount=1000, month=datetime.now().strftime('%Y-%m')),
+        ])
+    db.session.commit()
+
+def check_query_budgets(app, db, client, expect):
+    """نفس عدد الاستعلامات بعد إضافة صفوف أخرى، مع QUERY_BUDGET_STRICT
+
+    فحص query_budget يعمل عند إغلاق الاستجابة (بعد انتهاء بث الطباعة)، لذلك تقرأ
+    الاستجابة كاملة وتغلق هنا فيرفع AssertionError إذا تجاوز المسار ميزانيته.
+    """
+    from sqlalchemy.engine import Engine
+
+    def query_count(url):
+        counter = {'count': 0}
+
+        def count(*args):
+            counter['count'] += 1
+
+        db.event.listen(Engine, 'before_cursor_execute', count)
+        try:
+            response = client.get(url)
+            response.get_data()
+            response.close()
+            return response.status_code, counter['count']
+        finally:
+            db.event.remove(Engine, 'before_cursor_execute', count)
+
+    counts = {}
+    for rows in (2, 5):
+        with app.app_context():
+            seed_documents(db, rows)
+        for url in QUERY_BUDGET_ROUTES:
+            try:
+                counts.setdefault(url, []).append(query_count(url))
+            except AssertionError as e:
+                counts.setdefault(url, []).append((None, str(e)))
+
+    for url, results in counts.items():
+        expect(f"ميزانية الاستعلامات {url} ({' / '.join(str(queries) for _, queries in results)})",
+               all(status == 200 for status, _ in results) and len({queries for _, queries in results}) == 1)
+
+def main():
+    if '--suite' in sys.argv:
+        sys.exit(0 if run_suite() else 1)
+
+    workdir = tempfile.mkdtemp(prefix='accounting_test_')
+    backends = [('SQLite', f"sqlite:///{os.path.join(workdir, 'accounting.db')}")]
+    if os.environ.get('TEST_POSTGRES_URL'):
+        backends.append(('PostgreSQL', os.environ['TEST_POSTGRES_URL']))
+    else:
+        print("⚠️ TEST_POSTGRES_URL غير محدد - تخطي PostgreSQL")
+
+    results = {}
+    for name, url in backends:
+        print(f"\n{'=' * 60}\n🧪 {name}\n{'=' * 60}")
+        env = dict(os.environ, DATABASE_URL=url)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--suite'],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        results[name] = process.returncode == 0
+
+    print()
+    for name, ok in results.items():
+        print(f"{'✅' if ok else '❌'} {name}")
+    sys.exit(0 if all(results.values()) else 1)
+
+if __name__ == '__main__':
+    main()
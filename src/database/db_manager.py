@@ -10,6 +10,15 @@ import hashlib
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+from .search_index import SearchSource, ensure_search_index, ensure_search_key_column
+from ..utils.arabic_normalization import search_key
+
+# فهرس البحث في المنتجات: كل كلمة من الرمز والاسم والفئة والوصف (نفس تعريف main_app)
+SEARCH_SOURCES = [
+    SearchSource(0, 'products', 'products', "{product_code} || ' ' || {product_name}",
+                 ['category', 'description', 'name_search_key']),
+]
+
 class DatabaseManager:
     """مدير قاعدة البيانات الرئيسي"""
     
@@ -99,6 +108,7 @@ class DatabaseManager:
             min_stock_level INTEGER DEFAULT 0,
             current_stock INTEGER DEFAULT 0,
             is_active BOOLEAN DEFAULT 1,
+            name_search_key TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -234,6 +244,14 @@ class DatabaseManager:
         
         for table in tables:
             self.execute_query(table)
+        
+        # فهرس (الفرع، تاريخ الفاتورة) لترقيم فواتير اليوم ومرشحات الفترات
+        self.execute_query('CREATE INDEX IF NOT EXISTS ix_sales_branch_id_invoice_date ON sales (branch_id, invoice_date)')
+        
+        # اسم المنتج بعد التطبيع العربي (للقواعد القديمة أيضاً)
+        ensure_search_key_column(self.connection, 'products', 'name_search_key', ['product_name'])
+        ensure_search_index(self.connection, SEARCH_SOURCES)
+        self.connection.commit()
     
     def hash_password(self, password: str) -> str:
         """تشفير كلمة المرور"""
@@ -306,9 +324,11 @@ class DatabaseManager:
             for product_code, name, desc, cost, price, category, unit, min_stock, current_stock in sample_products:
                 self.execute_query(
                     """INSERT INTO products (product_code, product_name, description, unit_cost,
-                       selling_price, category, unit_type, min_stock_level, current_stock, is_active)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)""",
-                    (product_code, name, desc, cost, price, category, unit, min_stock, current_stock)
+                       selling_price, category, unit_type, min_stock_level, current_stock, is_active,
+                       name_search_key)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)""",
+                    (product_code, name, desc, cost, price, category, unit, min_stock, current_stock,
+                     search_key(name))
                 )
 
             print("تم إنشاء منتجات تجريبية")
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+دفتر الأستاذ العام - دليل الحسابات وقواعد الترحيل
+General ledger: chart of accounts and posting rules
+
+كل مستند (مبيعة، مشترى، مصروف، راتب) يرحل إلى قيد مزدوج متوازن حسب قيمه الحالية.
+الدفتر إلحاقي فقط: تعديل المستند أو حذفه يعكس قيده بقيد معاكس بنفس التاريخ ثم يرحل
+القيد الجديد. مجموع المدين والدائن لكل (حساب، شهر) محفوظ في account_balance ويحدث
+بجملة UPSERT في نفس المعاملة، فميزان المراجعة يقرأ صفاً لكل حساب وشهر بدلاً من مسح
+كل سطور القيود.
+
+نفس الجمل تعمل مع SQLite و PostgreSQL عبر SQLAlchemy text().
+"""
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+ACCOUNT_TYPES = ('asset', 'liability', 'equity', 'revenue', 'expense')
+# الرصيد الطبيعي مدين: الرصيد = المدين - الدائن، وبقية الأنواع العكس
+DEBIT_NORMAL_TYPES = ('asset', 'expense')
+
+# (الرمز، المفتاح، الاسم العربي، الاسم الإنجليزي، النوع) - المفتاح ثابت ويستخدمه قالب القوائم المالية
+CHART_OF_ACCOUNTS = (
+    ('1110', 'cash', 'الصندوق', 'Cash', 'asset'),
+    ('1120', 'bank', 'البنك', 'Bank', 'asset'),
+    ('1130', 'accounts_receivable', 'العملاء', 'Accounts Receivable', 'asset'),
+    ('1140', 'inventory', 'المخزون', 'Inventory', 'asset'),
+    ('1210', 'equipment', 'المعدات', 'Equipment', 'asset'),
+    ('1220', 'furniture', 'الأثاث', 'Furniture', 'asset'),
+    ('2110', 'accounts_payable', 'الموردون', 'Accounts Payable', 'liability'),
+    ('2120', 'vat_payable', 'ضريبة القيمة المضافة المستحقة', 'VAT Payable', 'liability'),
+    ('2130', 'salaries_payable', 'الرواتب المستحقة', 'Salaries Payable', 'liability'),
+    ('3100', 'capital', 'رأس المال', 'Capital', 'equity'),
+    ('3200', 'retained_earnings', 'الأرباح المحتجزة', 'Retained Earnings', 'equity'),
+    ('4100', 'sales_revenue', 'إيرادات المبيعات', 'Sales Revenue', 'revenue'),
+    ('5100', 'purchases', 'المشتريات', 'Purchases', 'expense'),
+    ('5200', 'salaries_expense', 'الرواتب والأجور', 'Salaries and Wages', 'expense'),
+    ('5300', 'general_expenses', 'المصروفات العمومية والإدارية', 'General and Administrative Expenses', 'expense'),
+)
+ACCOUNT_CODES = {key: code for code, key, _, _, _ in CHART_OF_ACCOUNTS}
+
+# طرق الدفع التي تقبض في الصندوق؛ بقية الطرق (مدى، فيزا، تحويل) في البنك
+CASH_PAYMENT_METHODS = ('', 'cash', 'نقدي', 'نقداً')
+
+# فرق التقريب المقبول بين مدين القيد ودائنه
+BALANCE_TOLERANCE = 0.005
+
+Line = Tuple[str, float, float]  # (رمز الحساب، مدين، دائن)
+
+ACCOUNT_BALANCE_UPSERT_SQL = '''
+    INSERT INTO account_balance (account_code, month, debit, credit)
+    VALUES (:account_code, :month, :debit, :credit)
+    ON CONFLICT (account_code, month)
+    DO UPDATE SET debit = account_balance.debit + excluded.debit,
+                  credit = account_balance.credit + excluded.credit
+'''
+
+def payment_account(method) -> str:
+    """حساب التحصيل أو السداد لطريقة الدفع"""
+    return ACCOUNT_CODES['cash' if (method or '').strip().lower() in CASH_PAYMENT_METHODS else 'bank']
+
+def signed_lines(amounts: Iterable[Tuple[str, float]]) -> List[Line]:
+    """[(رمز، مبلغ موجب للمدين وسالب للدائن)] -> سطور بدمج الحساب المكرر وحذف الأصفار"""
+    net: Dict[str, float] = {}
+    for code, amount in amounts:
+        net[code] = net.get(code, 0) + amount
+    return [(code, max(amount, 0), max(-amount, 0)) for code, amount in net.items()
+            if abs(amount) >= BALANCE_TOLERANCE]
+
+def document_lines(doc_type: str, get: Callable[[str], object]) -> List[Line]:
+    """سطور قيد المستند من قيمه الحالية - get(attr) تعيد قيمة العمود أو None
+
+    المبيعات: العملاء مدين بالإجمالي، والإيراد دائن بالصافي والضريبة دائنة بمبلغها، ثم
+    المدفوع ينقل من العملاء إلى الصندوق أو البنك. المشتريات والمصروفات والرواتب: الحساب
+    مدين بالمبلغ، والمدفوع دائن في الصندوق أو البنك والباقي في الموردين أو الرواتب المستحقة.
+    """
+    paid = get('paid_amount') or 0
+    cash = payment_account(get('payment_method'))
+
+    if doc_type == 'sales':
+        total = get('total') or 0
+        tax = get('tax_amount') or 0
+        return signed_lines([
+            (cash, paid),
+            (ACCOUNT_CODES['accounts_receivable'], total - paid),
+            (ACCOUNT_CODES['sales_revenue'], -(total - tax)),
+            (ACCOUNT_CODES['vat_payable'], -tax),
+        ])
+
+    debit_key, payable_key, amount_attr = {
+        'purchases': ('purchases', 'accounts_payable', 'total'),
+        'expenses': ('general_expenses', 'accounts_payable', 'amount'),
+        'payroll': ('salaries_expense', 'salaries_payable', 'amount'),
+    }[doc_type]
+    amount = get(amount_attr) or 0
+    return signed_lines([
+        (ACCOUNT_CODES[debit_key], amount),
+        (cash, -paid),
+        (ACCOUNT_CODES[payable_key], -(amount - paid)),
+    ])
+
+def account_balance(account_type: str, debit: float, credit: float) -> float:
+    """الرصيد بإشارة الجانب الطبيعي لنوع الحساب"""
+    return debit - credit if account_type in DEBIT_NORMAL_TYPES else credit - debit
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+جداول التجميع اليومية والشهرية
+Daily and monthly rollups
+
+صف لكل (نوع المستند، اليوم أو الشهر، الفرع، الفئة، حالة الدفع) يحمل العدد والمجاميع.
+كل حفظ يضيف فرقه بجملة UPSERT واحدة داخل نفس المعاملة، فيقرأ تقرير سنة كاملة بضع
+مئات من الصفوف بدلاً من مسح كل الفواتير. التقرير يقسم الفترة المطلوبة: الأشهر الكاملة
+من الجدول الشهري، وبقية الأيام من الجدول اليومي، واليوم المفتوح من الصفوف نفسها.
+
+نفس الجمل تعمل مع SQLite و PostgreSQL عبر SQLAlchemy text().
+"""
+
+from datetime import date, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+ROLLUP_DIMENSIONS = ('branch_code', 'category', 'payment_status')
+ROLLUP_MEASURES = ('count', 'amount', 'discount', 'tax_amount', 'paid_amount')
+
+# الفترات المدعومة؛ الجدول الشهري يخدم ما كان الشهر جزءاً منه
+ROLLUP_GRAINS = ('day', 'week', 'month', 'quarter', 'year')
+MONTH_GRAINS = ('month', 'quarter', 'year')
+
+def rollup_upsert_sql(table: str, period_column: str) -> str:
+    """إضافة فروقات صف واحد: الإدراج الأول ينشئ الصف وما بعده يزيد أعمدته ذرياً"""
+    key = ', '.join(('doc_type', period_column) + ROLLUP_DIMENSIONS)
+    columns = ', '.join(ROLLUP_MEASURES)
+    values = ', '.join(f':{name}' for name in ('doc_type', 'period') + ROLLUP_DIMENSIONS + ROLLUP_MEASURES)
+    updates = ', '.join(f'{name} = {table}.{name} + excluded.{name}' for name in ROLLUP_MEASURES)
+    return f'''
+    INSERT INTO {table} ({key}, {columns})
+    VALUES ({values})
+    ON CONFLICT ({key})
+    DO UPDATE SET {updates}
+'''
+
+DAILY_ROLLUP_UPSERT_SQL = rollup_upsert_sql('daily_rollup', 'day')
+MONTHLY_ROLLUP_UPSERT_SQL = rollup_upsert_sql('monthly_rollup', 'month')
+
+def period_key(grain: str, day: date) -> str:
+    """مفتاح الفترة لليوم: 2025-08-14، 2025-W33، 2025-08، 2025-Q3، 2025"""
+    if grain == 'day':
+        return day.strftime('%Y-%m-%d')
+    if grain == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+    if grain == 'month':
+        return day.strftime('%Y-%m')
+    if grain == 'quarter':
+        return f'{day.year}-Q{(day.month - 1) // 3 + 1}'
+    if grain == 'year':
+        return str(day.year)
+    raise ValueError(f'الفترة يجب أن تكون واحدة من {", ".join(ROLLUP_GRAINS)}')
+
+def month_start(month: str) -> date:
+    """أول يوم من مفتاح الشهر YYYY-MM"""
+    return date(int(month[:4]), int(month[5:7]), 1)
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def iter_months(date_from: date, date_to: date) -> Iterator[Tuple[date, date]]:
+    """(أول يوم، آخر يوم) لكل شهر يتقاطع مع الفترة، مقصوصاً على حدودها"""
+    start = date_from
+    while start <= date_to:
+        end = min(next_month(start) - timedelta(days=1), date_to)
+        yield start, end
+        start = end + timedelta(days=1)
+
+def split_period(date_from: date, date_to: date, open_day: Optional[date],
+                 use_months: bool) -> Tuple[List[str], List[Tuple[date, date]], Optional[date]]:
+    """تقسيم الفترة إلى (أشهر كاملة، نطاقات أيام، اليوم المفتوح إن وقع فيها)
+
+    الشهر يؤخذ من الجدول الشهري فقط إذا كان كاملاً داخل الفترة ولا يضم اليوم المفتوح،
+    لأن اليوم المفتوح يقرأ من الصفوف مباشرة. open_day=None إذا كان الجدول الشهري
+    محدثاً حتى اليوم الحالي (أرصدة دفتر الأستاذ).
+    """
+    months, day_ranges = [], []
+    for start, end in iter_months(date_from, date_to):
+        whole_month = start.day == 1 and end == next_month(start) - timedelta(days=1)
+        if open_day is None or not start <= open_day <= end:
+            if use_months and whole_month:
+                months.append(start.strftime('%Y-%m'))
+            else:
+                day_ranges.append((start, end))
+            continue
+        if start < open_day:
+            day_ranges.append((start, open_day - timedelta(days=1)))
+        if open_day < end:
+            day_ranges.append((open_day + timedelta(days=1), end))
+
+    # نطاقات الأيام المتجاورة تدمج حتى يبقى شرط BETWEEN واحد لكل منها
+    merged = []
+    for start, end in day_ranges:
+        if merged and merged[-1][1] + timedelta(days=1) == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return months, merged, open_day if open_day and date_from <= open_day <= date_to else None
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس البحث النصي (SQLite FTS5)
+Full-text search index
+
+جدول FTS5 واحد (search_index) يضم صفاً لكل سجل قابل للبحث من عدة جداول،
+وتحافظ عليه محفزات (triggers) على كل جدول مصدر. لذلك يعطي استعلام MATCH واحد
+نتائج مرتبة من كل الأنواع، ولا تتكرر كلمة LIKE '%x%' على كل ضغطة مفتاح.
+
+rowid في الفهرس = id السجل * ENTITY_SLOTS + رقم المصدر، حتى يحذف المحفز صفه
+مباشرة بالمفتاح بدلاً من المسح.
+"""
+
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ..utils.arabic_normalization import search_key
+
+SEARCH_TABLE = 'search_index'
+
+# أقصى عدد مصادر يمكن أن يشترك في فهرس واحد
+ENTITY_SLOTS = 16
+
+SEARCH_TABLE_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        entity UNINDEXED,
+        entity_id UNINDEXED,
+        title,
+        body,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+
+class SearchSource:
+    """مصدر بحث: جدول وأعمدة العنوان والمحتوى"""
+
+    def __init__(self, slot: int, entity: str, table: str, title: str, body: Iterable[str]):
+        if not 0 <= slot < ENTITY_SLOTS:
+            raise ValueError(f'رقم المصدر يجب أن يكون بين 0 و {ENTITY_SLOTS - 1}')
+        self.slot = slot
+        self.entity = entity
+        self.table = table
+        self.title = title  # تعبير SQL على أعمدة الجدول
+        self.body = list(body)
+
+    def _expression(self, alias: str, expression: str) -> str:
+        return re.sub(r'\{(\w+)\}', lambda m: f'{alias}.{m.group(1)}', expression)
+
+    def title_sql(self, alias: str) -> str:
+        return self._expression(alias, self.title)
+
+    def body_sql(self, alias: str) -> str:
+        return " || ' ' || ".join(f"COALESCE({alias}.{column}, '')" for column in self.body) or "''"
+
+    def rowid_sql(self, alias: str) -> str:
+        return f'{alias}.id * {ENTITY_SLOTS} + {self.slot}'
+
+    def insert_sql(self, alias: str) -> str:
+        return (f"INSERT INTO {SEARCH_TABLE} (rowid, entity, entity_id, title, body) "
+                f"VALUES ({self.rowid_sql(alias)}, '{self.entity}', {alias}.id, "
+                f"{self.title_sql(alias)}, {self.body_sql(alias)});")
+
+    def trigger_sql(self) -> List[Tuple[str, str]]:
+        """(الاسم، جملة الإنشاء) لمحفزات الإضافة والتعديل والحذف على الجدول المصدر
+
+        الجملة بالشكل الذي يحفظه SQLite في sqlite_master لمقارنتها عند التشغيل.
+        """
+        prefix = f'{SEARCH_TABLE}_{self.table}'
+        delete_old = f'DELETE FROM {SEARCH_TABLE} WHERE rowid = {self.rowid_sql("old")};'
+        return [
+            (f'{prefix}_ai', f'CREATE TRIGGER {prefix}_ai AFTER INSERT ON {self.table} BEGIN {self.insert_sql("new")} END'),
+            (f'{prefix}_au', f'CREATE TRIGGER {prefix}_au AFTER UPDATE ON {self.table} BEGIN '
+                             f'{delete_old} {self.insert_sql("new")} END'),
+            (f'{prefix}_ad', f'CREATE TRIGGER {prefix}_ad AFTER DELETE ON {self.table} BEGIN {delete_old} END'),
+        ]
+
+    def rebuild_sql(self) -> str:
+        """تعبئة الفهرس من الصفوف الموجودة"""
+        return (f"INSERT INTO {SEARCH_TABLE} (rowid, entity, entity_id, title, body) "
+                f"SELECT {self.rowid_sql('t')}, '{self.entity}', t.id, {self.title_sql('t')}, {self.body_sql('t')} "
+                f"FROM {self.table} t")
+
+def ensure_search_index(conn, sources: Iterable[SearchSource]) -> bool:
+    """إنشاء جدول الفهرس والمحفزات على اتصال sqlite3، وتعبئته عند إنشائه لأول مرة
+
+    المحفز الذي تغير تعريفه (عمود جديد في المحتوى مثلاً) يعاد إنشاؤه ويعاد بناء
+    الفهرس. يعيد True إذا أعيد بناء الفهرس.
+    """
+    sources = list(sources)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).fetchone()
+    conn.execute(SEARCH_TABLE_SQL)
+    current = {row[0]: row[1] for row in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN (%s)"
+        % ', '.join('?' for _ in sources), [source.table for source in sources]
+    )}
+    changed = not exists
+    for source in sources:
+        for name, statement in source.trigger_sql():
+            if current.get(name) != statement:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+                conn.execute(statement)
+                changed = True
+    if changed:
+        rebuild_search_index(conn, sources)
+    return changed
+
+def rebuild_search_index(conn, sources: Iterable[SearchSource]) -> None:
+    """إعادة بناء الفهرس بالكامل (بعد استيراد مباشر يتجاوز المحفزات مثلاً)"""
+    conn.execute(f'DELETE FROM {SEARCH_TABLE}')
+    for source in sources:
+        conn.execute(source.rebuild_sql())
+
+def build_match_query(text: str, normalize: Optional[Callable[[str], str]] = None) -> Optional[str]:
+    """تحويل نص المستخدم إلى استعلام FTS5 آمن: كل كلمة مطلوبة وكمطابقة بادئة
+
+    "قهوة عرب" -> '"قهوة"* AND "عرب"*'. مع normalize تطابق الكلمة شكلها الأصلي أو
+    المطبع: '("أحمد"* OR "احمد"*)'. AND صريحة لأن FTS5 لا يقبل الربط الضمني بجوار
+    مجموعة بين قوسين. يعيد None إذا لم تبق كلمات.
+    """
+    tokens = [token.replace('"', '') for token in re.split(r'[\s\-_/.,;:()\[\]{}*^+]+', text or '')]
+    tokens = [token for token in tokens if token]
+    if not tokens:
+        return None
+    terms = []
+    for token in tokens:
+        variant = normalize(token).replace('"', '') if normalize else token
+        if variant and variant != token:
+            terms.append(f'("{token}"* OR "{variant}"*)')
+        else:
+            terms.append(f'"{token}"*')
+    return ' AND '.join(terms)
+
+def search_sql(entities: Optional[Iterable[str]] = None) -> str:
+    """استعلام البحث الموحد - النتائج مرتبة بـ bm25 مع وزن أعلى للعنوان
+
+    المعاملات: :query (من build_match_query) و :limit وأسماء الأنواع :entity_0 ...
+    """
+    entity_filter = ''
+    if entities:
+        placeholders = ', '.join(f':entity_{index}' for index, _ in enumerate(entities))
+        entity_filter = f'AND entity IN ({placeholders})'
+    return f'''
+        SELECT entity, entity_id, title,
+               snippet({SEARCH_TABLE}, 3, '', '', '…', 12) AS snippet,
+               bm25({SEARCH_TABLE}, 0.0, 0.0, 10.0, 1.0) AS rank
+        FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH :query {entity_filter}
+        ORDER BY rank
+        LIMIT :limit
+    '''
+
+def search_params(query: str, limit: int, entities: Optional[Iterable[str]] = None) -> Dict[str, object]:
+    params = {'query': query, 'limit': limit}
+    for index, entity in enumerate(entities or []):
+        params[f'entity_{index}'] = entity
+    return params
+
+def matching_ids_sql(entity: str) -> str:
+    """معرفات نوع واحد تطابق :query - للاستخدام داخل id IN (...)"""
+    return f"SELECT entity_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query AND entity = '{entity}'"
+
+def ensure_search_key_column(conn, table: str, key_column: str, source_columns: Iterable[str]) -> int:
+    """عمود مفتاح بحث مطبع (src/utils/arabic_normalization.py) مع فهرسه على اتصال sqlite3
+
+    يضاف العمود للجداول القديمة، وتعبأ الصفوف التي ليس لها مفتاح. يعيد عدد
+    الصفوف التي عبئت.
+    """
+    source_columns = list(source_columns)
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if key_column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {key_column} TEXT')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_{key_column} ON {table} ({key_column})')
+
+    has_source = ' OR '.join(f'{column} IS NOT NULL' for column in source_columns)
+    rows = conn.execute(
+        f'SELECT id, {", ".join(source_columns)} FROM {table} WHERE {key_column} IS NULL AND ({has_source})'
+    ).fetchall()
+    conn.executemany(
+        f'UPDATE {table} SET {key_column} = ? WHERE id = ?',
+        [(search_key(*row[1:]), row[0]) for row in rows]
+    )
+    return len(rows)
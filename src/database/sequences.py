@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+مولد أرقام المستندات
+Document number sequences
+
+عداد لكل (نوع المستند، الفرع، الفترة) في جدول document_sequence. الحجز يتم
+بجملة UPSERT واحدة داخل نفس معاملة الإدراج، فلا يحصل جهازا نقاط بيع على نفس
+الرقم ولا حاجة للبحث عن آخر رقم وتحليله. يمكن حجز كتلة أرقام دفعة واحدة
+ليستخدمها جهاز بدون اتصال.
+
+نفس الجمل تعمل مع sqlite3 (معاملات مسماة) ومع SQLAlchemy text().
+"""
+
+from datetime import date, datetime
+from typing import Optional, Union
+
+# أكبر كتلة يمكن حجزها في طلب واحد
+MAX_RESERVATION_BLOCK = 500
+
+SEQUENCE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS document_sequence (
+        doc_type VARCHAR(20) NOT NULL,
+        branch_code VARCHAR(20) NOT NULL DEFAULT '',
+        period VARCHAR(8) NOT NULL DEFAULT '',
+        last_value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (doc_type, branch_code, period)
+    )
+'''
+
+# الإدراج الأول ينشئ العداد بقيمة count، وما بعده يزيده ذرياً ويعيد آخر رقم محجوز
+RESERVE_SEQUENCE_SQL = '''
+    INSERT INTO document_sequence (doc_type, branch_code, period, last_value)
+    VALUES (:doc_type, :branch_code, :period, :count)
+    ON CONFLICT (doc_type, branch_code, period)
+    DO UPDATE SET last_value = document_sequence.last_value + excluded.last_value
+    RETURNING last_value
+'''
+
+# وجود عداد الفترة - إنشاؤه من الأرقام الموجودة يحدث مرة واحدة
+SEQUENCE_EXISTS_SQL = '''
+    SELECT 1 FROM document_sequence
+    WHERE doc_type = :doc_type AND branch_code = :branch_code AND period = :period
+'''
+
+# إنشاء العداد بأكبر رقم مستخدم؛ إذا سبق اتصال آخر إلى إنشائه يبقى كما هو
+SEED_SEQUENCE_SQL = '''
+    INSERT INTO document_sequence (doc_type, branch_code, period, last_value)
+    VALUES (:doc_type, :branch_code, :period, :last_value)
+    ON CONFLICT (doc_type, branch_code, period) DO NOTHING
+'''
+
+def day_period(day: Optional[Union[date, datetime]] = None) -> str:
+    """مفتاح الفترة اليومية YYYYMMDD (اليوم الحالي افتراضياً)"""
+    return (day or datetime.now()).strftime('%Y%m%d')
+
+def sequence_params(doc_type: str, branch_code: str = '', period: str = '', count: int = 1) -> dict:
+    """معاملات RESERVE_SEQUENCE_SQL بعد التحقق من حجم الكتلة"""
+    if not 1 <= count <= MAX_RESERVATION_BLOCK:
+        raise ValueError(f'حجم الكتلة يجب أن يكون بين 1 و {MAX_RESERVATION_BLOCK}')
+    return {
+        'doc_type': doc_type,
+        'branch_code': branch_code or '',
+        'period': period or '',
+        'count': count,
+    }
+
+def block_range(last_value: int, count: int) -> range:
+    """الأرقام المحجوزة من آخر رقم أعاده RESERVE_SEQUENCE_SQL"""
+    return range(last_value - count + 1, last_value + 1)
+
+def ensure_sequence_table(conn) -> None:
+    """إنشاء جدول العدادات على اتصال sqlite3"""
+    conn.execute(SEQUENCE_TABLE_SQL)
+
+def reserve_numbers(conn, doc_type: str, branch_code: str = '', period: str = '', count: int = 1) -> range:
+    """حجز count رقماً متتالياً على اتصال sqlite3
+
+    لا يعمل commit - الحجز يثبت مع معاملة المستند نفسه أو يلغى معها.
+    """
+    params = sequence_params(doc_type, branch_code, period, count)
+    last_value = conn.execute(RESERVE_SEQUENCE_SQL, params).fetchone()[0]
+    return block_range(last_value, count)
+
+def document_number_prefix(prefix: str = '', branch_code: str = '', period: str = '') -> str:
+    """الجزء الثابت من الرقم قبل التسلسل: PREFIX-BRANCH-PERIOD- مع حذف الأجزاء الفارغة"""
+    parts = [part for part in (prefix, branch_code, period) if part]
+    return '-'.join(parts) + '-' if parts else ''
+
+def existing_last_value(conn, table: str, column: str, prefix: str = '',
+                        branch_code: str = '', period: str = '') -> int:
+    """أكبر تسلسل مستخدم في table.column بصيغة PREFIX-BRANCH-PERIOD- (0 إن لم يوجد)"""
+    number_prefix = document_number_prefix(prefix, branch_code, period)
+    last_value = conn.execute(
+        f'SELECT MAX(CAST(substr({column}, ?) AS INTEGER)) FROM {table} WHERE {column} LIKE ?',
+        (len(number_prefix) + 1, number_prefix + '%')
+    ).fetchone()[0]
+    return last_value or 0
+
+def seed_sequence(conn, doc_type: str, table: str, column: str, prefix: str = '',
+                  branch_code: str = '', period: str = '') -> None:
+    """إنشاء عداد الفترة على اتصال sqlite3 من أكبر رقم موجود في table.column
+
+    الأرقام التي صدرت قبل جدول العدادات (من آخر رقم في الجدول) تبقى بنفس الصيغة،
+    فلو بدأ عداد اليوم من 1 لتكرر رقم صدر اليوم. يقرأ الجدول فقط عند إنشاء العداد.
+    """
+    params = sequence_params(doc_type, branch_code, period)
+    if conn.execute(SEQUENCE_EXISTS_SQL, params).fetchone():
+        return
+    last_value = existing_last_value(conn, table, column, prefix, branch_code, period)
+    if last_value:
+        conn.execute(SEED_SEQUENCE_SQL, dict(params, last_value=last_value))
+
+def peek_number(conn, doc_type: str, table: str, column: str, prefix: str = '',
+                branch_code: str = '', period: str = '') -> int:
+    """الرقم التالي المتوقع على اتصال sqlite3 دون حجزه (للعرض فقط)
+
+    لا يكتب شيئاً، فلا تضيع أرقام من الطلبات التي لا تحفظ. الرقم الفعلي يحجز
+    بـ reserve_numbers داخل معاملة الحفظ وقد يختلف إذا سبق جهاز آخر.
+    """
+    row = conn.execute(
+        'SELECT last_value FROM document_sequence '
+        'WHERE doc_type = :doc_type AND branch_code = :branch_code AND period = :period',
+        sequence_params(doc_type, branch_code, period)
+    ).fetchone()
+    last_value = row[0] if row else existing_last_value(conn, table, column, prefix, branch_code, period)
+    return last_value + 1
+
+def format_document_number(prefix: str, sequence: int, branch_code: str = '', period: str = '',
+                           width: int = 4) -> str:
+    """تنسيق الرقم: PREFIX-BRANCH-PERIOD-0001 مع حذف الأجزاء الفارغة"""
+    return document_number_prefix(prefix, branch_code, period) + f'{sequence:0{width}d}'
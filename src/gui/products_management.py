@@ -10,6 +10,8 @@ from datetime import datetime
 
 from ..utils.language_manager import language_manager
 from ..utils.arabic_support import ArabicSupport
+from ..utils.arabic_normalization import normalize_arabic, search_key
+from ..database.search_index import build_match_query, matching_ids_sql
 
 class ProductsManagementWindow:
     """شاشة إدارة المنتجات"""
@@ -291,17 +293,17 @@ class ProductsManagementWindow:
         for item in self.products_tree.get_children():
             self.products_tree.delete(item)
         
-        # تحديد استعلام البحث
-        if search_term:
-            query = """
+        # تحديد استعلام البحث: كل كلمة تطابق بداية كلمة في الرمز أو الاسم أو الفئة (فهرس FTS5)
+        match_query = build_match_query(search_term, normalize_arabic)
+        if match_query:
+            query = f"""
                 SELECT id, product_code, product_name, category, unit_cost, 
                        selling_price, current_stock, is_active
                 FROM products
-                WHERE product_name LIKE ? OR product_code LIKE ? OR category LIKE ?
+                WHERE id IN ({matching_ids_sql('products')})
                 ORDER BY product_name
             """
-            search_pattern = f"%{search_term}%"
-            products = self.db_manager.execute_query(query, (search_pattern, search_pattern, search_pattern))
+            products = self.db_manager.execute_query(query, {'query': match_query})
         else:
             # إذا كان البحث فارغاً، عرض جميع المنتجات
             self.load_products()
@@ -393,7 +395,8 @@ class ProductsManagementWindow:
             self.unit_type_var.get(),
             min_stock,
             current_stock,
-            self.is_active_var.get()
+            self.is_active_var.get(),
+            search_key(self.product_name_var.get())
         )
         
         try:
@@ -404,7 +407,7 @@ class ProductsManagementWindow:
                         product_code = ?, product_name = ?, description = ?,
                         unit_cost = ?, selling_price = ?, category = ?,
                         unit_type = ?, min_stock_level = ?, current_stock = ?,
-                        is_active = ?, updated_at = CURRENT_TIMESTAMP
+                        is_active = ?, name_search_key = ?, updated_at = CURRENT_TIMESTAMP
                     WHERE id = ?
                 """
                 self.db_manager.execute_query(query, product_data + (self.selected_product_id,))
@@ -415,8 +418,8 @@ class ProductsManagementWindow:
                     INSERT INTO products (
                         product_code, product_name, description, unit_cost,
                         selling_price, category, unit_type, min_stock_level,
-                        current_stock, is_active
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        current_stock, is_active, name_search_key
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """
                 self.db_manager.execute_query(query, product_data)
                 messagebox.showinfo("نجح", "تم إضافة المنتج بنجاح")
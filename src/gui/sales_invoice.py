@@ -6,15 +6,19 @@ Sales Invoice Screen
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 
 from ..utils.language_manager import language_manager
 from ..utils.arabic_support import ArabicSupport
+from ..utils.autocomplete import PrefixIndex, word_keys
 
 class SalesInvoiceWindow:
     """شاشة فاتورة المبيعات"""
     
+    # عدد المنتجات المعروضة في القائمة المنسدلة
+    PRODUCT_SUGGESTIONS = 20
+    
     def __init__(self, parent, db_manager, user_data, branch_id="PI"):
         """تهيئة شاشة فاتورة المبيعات"""
         self.parent = parent
@@ -146,6 +150,7 @@ class SalesInvoiceWindow:
         self.product_var = tk.StringVar()
         self.product_combo = ttk.Combobox(add_item_frame, textvariable=self.product_var, width=20)
         self.product_combo.grid(row=0, column=1, padx=5)
+        self.product_combo.bind('<KeyRelease>', self.filter_products)
         
         ttk.Label(add_item_frame, text=language_manager.get_text("quantity")).grid(row=0, column=2, padx=5, sticky=tk.W)
         self.quantity_var = tk.StringVar(value="1")
@@ -266,11 +271,21 @@ class SalesInvoiceWindow:
     
     def load_initial_data(self):
         """تحميل البيانات الأولية"""
-        # تحميل قائمة المنتجات
-        products = self.db_manager.execute_query("SELECT product_name FROM products WHERE is_active = 1")
-        if products:
-            product_names = [product['product_name'] for product in products]
-            self.product_combo['values'] = product_names
+        # فهرس بادئات المنتجات - القائمة المنسدلة تعرض أول النتائج فقط
+        self.product_index = PrefixIndex(lambda product: word_keys(product['name'], product['code']))
+        products = self.db_manager.execute_query(
+            "SELECT id, product_name, product_code FROM products WHERE is_active = 1"
+        )
+        self.product_index.load(
+            {'id': product['id'], 'name': product['product_name'], 'code': product['product_code']}
+            for product in products or []
+        )
+        self.filter_products()
+    
+    def filter_products(self, event=None):
+        """تحديث خيارات المنتج حسب ما كُتب"""
+        matches = self.product_index.search(self.product_var.get(), self.PRODUCT_SUGGESTIONS)
+        self.product_combo['values'] = [product['name'] for product in matches]
     
     def generate_invoice_number(self):
         """توليد رقم فاتورة تلقائي"""
@@ -278,13 +293,15 @@ class SalesInvoiceWindow:
         today = datetime.now()
         date_part = today.strftime("%Y%m%d")
         
-        # البحث عن آخر رقم فاتورة لهذا اليوم والفرع
+        # البحث عن آخر رقم فاتورة لهذا اليوم والفرع (فترة نصف مفتوحة على العمود نفسه)
         query = """
         SELECT COUNT(*) as count FROM sales 
         WHERE branch_id = (SELECT id FROM branches WHERE branch_code = ?) 
-        AND DATE(invoice_date) = DATE(?)
+        AND invoice_date >= ? AND invoice_date < ?
         """
-        result = self.db_manager.execute_query(query, (self.branch_id, today.strftime("%Y-%m-%d")))
+        result = self.db_manager.execute_query(query, (
+            self.branch_id, today.strftime("%Y-%m-%d"), (today + timedelta(days=1)).strftime("%Y-%m-%d")
+        ))
         
         sequence = 1
         if result and result[0]['count']:
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+تطبيع النص العربي للبحث
+Arabic text normalization for search
+
+يوحد أشكال الألف والهمزة (أ إ آ ٱ -> ا)، والتاء المربوطة (ة -> ه)، والألف
+المقصورة (ى -> ي)، ويحذف التشكيل والتطويل، ويحول الأرقام العربية الهندية إلى
+أرقام لاتينية. الناتج يخزن في أعمدة *_search_key المفهرسة ويطبق على نص البحث
+نفسه، فتكون المطابقة مساواة أو بادئة على الفهرس بدلاً من LIKE '%x%'.
+
+لا يعتمد على tkinter حتى يستخدمه خادم الويب والواجهة المكتبية معاً.
+"""
+
+import re
+import unicodedata
+from typing import Optional
+
+# أقصى طول لمفتاح البحث المخزن
+SEARCH_KEY_LENGTH = 200
+
+# التشكيل وعلامات القرآن والألف الخنجرية
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e8\u06ea-\u06ed]')
+TATWEEL = '\u0640'
+
+ARABIC_LETTER_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي', 'ئ': 'ي', 'ی': 'ي',
+    'ؤ': 'و',
+    'ک': 'ك',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # ٠-٩
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},  # ۰-۹
+})
+
+def normalize_arabic(text: Optional[str]) -> str:
+    """تطبيع نص للمقارنة: الأشكال الموحدة بدون تشكيل وبأحرف صغيرة ومسافات مفردة"""
+    if not text:
+        return ''
+    # NFKC يحول أشكال العرض (ﻻ ﺍ ...) إلى الأحرف الأساسية
+    text = unicodedata.normalize('NFKC', str(text))
+    text = ARABIC_DIACRITICS.sub('', text).replace(TATWEEL, '')
+    return ' '.join(text.translate(ARABIC_LETTER_MAP).casefold().split())
+
+def search_key(*values: Optional[str]) -> Optional[str]:
+    """قيمة عمود *_search_key من عمود أو أكثر - None إذا كانت كلها فارغة"""
+    key = ' '.join(part for part in (normalize_arabic(value) for value in values) if part)
+    return key[:SEARCH_KEY_LENGTH] or None
+
+def prefix_upper_bound(key: str) -> str:
+    """الحد الأعلى المفتوح لبحث البادئة: column >= key AND column < prefix_upper_bound(key)
+
+    ترتيب SQLite الافتراضي (BINARY على UTF-8) يطابق ترتيب نقاط الترميز، لذلك
+    يكفي زيادة آخر حرف ويستخدم الاستعلام الفهرس كنطاق.
+    """
+    return key[:-1] + chr(ord(key[-1]) + 1)
@@ -9,6 +9,8 @@ from tkinter import font
 import sys
 import os
 
+from .arabic_normalization import normalize_arabic
+
 try:
     import arabic_reshaper
     import bidi.algorithm
@@ -53,6 +55,11 @@ class ArabicSupport:
             print(f"خطأ في إعادة تشكيل النص العربي: {e}")
             return text
     
+    @staticmethod
+    def normalize_search_text(text):
+        """تطبيع النص للبحث (نفس التطبيع المخزن في أعمدة *_search_key)"""
+        return normalize_arabic(text)
+    
     @staticmethod
     def get_arabic_font(size=10, weight="normal"):
         """الحصول على خط عربي مناسب"""
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس الإكمال التلقائي في الذاكرة
+In-memory autocomplete index
+
+قائمة مرتبة من (مفتاح، معرف) لكل كلمة في الاسم والرمز، والبحث عن البادئة يتم
+بـ bisect ثم قراءة الصفوف المتتالية التي تبدأ بها - O(log n + limit) بدون أي
+استعلام على القاعدة. الإضافة والتعديل والحذف تحدث المفاتيح المتأثرة فقط.
+
+الفهرس محلي للعملية: العمليات الأخرى (عمال الخادم الآخرون، واجهة سطح المكتب)
+لا تراه، لذلك يقارن مستخدمه رقم إصدار للجدول تزيده كل معاملة كتابة قبل البحث
+ويعيد البناء من القاعدة إذا تغير أو إذا تجاوز الفهرس عمراً محدداً.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .arabic_normalization import normalize_arabic
+
+def autocomplete_key(text: str) -> str:
+    """تطبيع النص قبل الفهرسة والبحث (نفس تطبيع أعمدة *_search_key)"""
+    return normalize_arabic(text)
+
+def word_keys(*values: Optional[str]) -> List[str]:
+    """مفاتيح السجل: النص من بداية كل كلمة حتى نهايته
+
+    "قهوة عربية" -> ["قهوة عربية", "عربية"] فتطابق "عر" و "قهوة ع".
+    """
+    keys = set()
+    for value in values:
+        words = autocomplete_key(value).split(' ')
+        for index, word in enumerate(words):
+            if word:
+                keys.add(' '.join(words[index:]))
+    return sorted(keys)
+
+class PrefixIndex:
+    """فهرس بادئات مرتب مع حمولة لكل معرف (ما يعاد للواجهة)"""
+
+    def __init__(self, keys_for: Callable[[dict], Iterable[str]]):
+        self._keys_for = keys_for
+        self._entries: List[Tuple[str, int]] = []
+        self._records: Dict[int, Tuple[dict, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def load(self, records: Iterable[dict]) -> None:
+        """بناء الفهرس كاملاً من سجلات تحتوي على id"""
+        entries, stored = [], {}
+        for record in records:
+            keys = list(self._keys_for(record))
+            stored[record['id']] = (record, keys)
+            entries.extend((key, record['id']) for key in keys)
+        entries.sort()
+        with self._lock:
+            self._entries, self._records = entries, stored
+
+    def upsert(self, record: dict) -> None:
+        """إضافة سجل أو استبدال مفاتيحه بعد التعديل"""
+        keys = list(self._keys_for(record))
+        with self._lock:
+            self._remove_locked(record['id'])
+            self._records[record['id']] = (record, keys)
+            for key in keys:
+                insort(self._entries, (key, record['id']))
+
+    def remove(self, record_id: int) -> None:
+        with self._lock:
+            self._remove_locked(record_id)
+
+    def _remove_locked(self, record_id: int) -> None:
+        stored = self._records.pop(record_id, None)
+        if not stored:
+            return
+        for key in stored[1]:
+            position = bisect_left(self._entries, (key, record_id))
+            if position < len(self._entries) and self._entries[position] == (key, record_id):
+                del self._entries[position]
+
+    def search(self, prefix: str, limit: int = 10) -> List[dict]:
+        """أول limit سجلات (بالترتيب الأبجدي للمفتاح) تبدأ إحدى كلماتها بالبادئة"""
+        prefix = autocomplete_key(prefix)
+        results, seen = [], set()
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            while position < len(self._entries) and len(results) < limit:
+                key, record_id = self._entries[position]
+                if not key.startswith(prefix):
+                    break
+                if record_id not in seen:
+                    seen.add(record_id)
+                    results.append(self._records[record_id][0])
+                position += 1
+        return results
@@ -0,0 +1,76 @@
+/**
+ * الإكمال التلقائي لقوائم الاختيار
+ * Autocomplete for select lists
+ *
+ * حقل بحث يحمل data-autocomplete="<النوع>" و data-autocomplete-target="<معرف القائمة>"
+ * يملأ القائمة من /api/autocomplete/<النوع> أثناء الكتابة بدلاً من تضمين كل الصفوف في الصفحة.
+ */
+
+class AutocompleteSelect {
+    constructor(input) {
+        this.input = input;
+        this.entity = input.dataset.autocomplete;
+        this.select = document.getElementById(input.dataset.autocompleteTarget);
+        this.limit = parseInt(input.dataset.autocompleteLimit || '20', 10);
+        this.delay = 150;
+        this.timer = null;
+        this.lastPrefix = null;
+
+        this.input.addEventListener('input', () => this.schedule());
+        this.load('');
+    }
+
+    schedule() {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.load(this.input.value.trim()), this.delay);
+    }
+
+    async load(prefix) {
+        if (prefix === this.lastPrefix) return;
+        this.lastPrefix = prefix;
+
+        try {
+            const params = new URLSearchParams({ prefix, limit: this.limit });
+            const response = await fetch(`/api/autocomplete/${this.entity}?${params}`);
+            const data = await response.json();
+            // تجاهل الردود المتأخرة لبادئة قديمة
+            if (data.success && prefix === this.lastPrefix) {
+                this.fill(data.results);
+            }
+        } catch (error) {
+            console.error('خطأ في الإكمال التلقائي:', error);
+        }
+    }
+
+    fill(results) {
+        const selected = this.select.value;
+        // الخيار الأول (عميل نقدي / اختر المورد) يبقى ثابتاً
+        while (this.select.options.length > 1) {
+            this.select.remove(1);
+        }
+        results.forEach(record => this.select.add(new Option(record.name, record.id)));
+
+        if (selected && Array.from(this.select.options).some(option => option.value === selected)) {
+            this.select.value = selected;
+        } else if (this.input.value.trim() && results.length > 0) {
+            this.select.value = String(results[0].id);
+        }
+    }
+}
+
+// إضافة خيار غير موجود في القائمة (عند فتح مستند محفوظ للتعديل)
+function ensureSelectOption(select, id, name) {
+    if (!id) return;
+    if (!Array.from(select.options).some(option => option.value === String(id))) {
+        select.add(new Option(name || id, id));
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('[data-autocomplete]').forEach(input => new AutocompleteSelect(input));
+});
+
+// تصدير
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = { AutocompleteSelect, ensureSelectOption };
+}
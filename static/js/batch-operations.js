@@ -3,6 +3,9 @@
  * Batch Operations System
  */
 
+// الكيانات التي يقبلها /api/batch/process
+const BATCH_ENTITIES = ['sales', 'purchases', 'expenses', 'employees'];
+
 class BatchOperationSystem {
     constructor() {
         this.queue = [];
@@ -70,9 +73,11 @@ class BatchOperationSystem {
         const operation = batch[0];
         
         try {
-            if (batch.length === 1) {
-                // عملية واحدة
-                await this.processSingleOperation(operation);
+            if (batch.length === 1 || !this.supportsBatch(operation)) {
+                // عملية واحدة أو نوع لا يدعمه الحفظ المجمع (التعديل)
+                for (const op of batch) {
+                    await this.processSingleOperation(op);
+                }
             } else {
                 // عمليات متعددة
                 await this.processMultipleOperations(batch);
@@ -142,11 +147,25 @@ class BatchOperationSystem {
         }
     }
 
+    // نوع الكيان صريح: من الخيار entity أو من مسار الـ endpoint مثل /api/sales/create
+    getEntity(operation) {
+        if (operation.entity) return operation.entity;
+        const match = (operation.endpoint || '').match(/^\/api\/([a-z_]+)\//);
+        return match ? match[1] : null;
+    }
+
+    supportsBatch(operation) {
+        return ['save', 'delete'].includes(operation.type) &&
+            BATCH_ENTITIES.includes(this.getEntity(operation));
+    }
+
     async processMultipleOperations(operations) {
         // إعداد البيانات للحفظ المجمع
         const batchData = {
             operations: operations.map(op => ({
+                id: op.id,
                 type: op.type,
+                entity: this.getEntity(op),
                 data: op.data,
                 targetId: op.targetId
             }))
@@ -161,22 +180,39 @@ class BatchOperationSystem {
 
             const result = await response.json();
             
-            if (result.success) {
-                operations.forEach((op, index) => {
+            if (!result.success) {
+                throw new Error(result.message || 'فشل في العملية المجمعة');
+            }
+
+            // نتيجة لكل عملية حسب operation_id - الناجح يخرج من الطابور والفاشل فقط يبقى لإعادة المحاولة
+            const resultsById = new Map(result.results.map(r => [r.operation_id, r]));
+            operations.forEach(op => {
+                const opResult = resultsById.get(op.id);
+                if (opResult && opResult.success) {
                     op.status = 'completed';
-                    op.result = result.results[index];
+                    op.result = opResult.result;
                     this.removeFromQueue(op.id);
-                });
-                
+                } else {
+                    op.status = 'failed';
+                    op.error = opResult ? opResult.error : 'لم تصل نتيجة العملية';
+                    op.retryable = opResult ? opResult.retryable : true;
+                }
+            });
+
+            const failed = result.failed_ids || [];
+            if (failed.length === 0) {
                 showSuccess(`تم حفظ ${operations.length} عنصر بنجاح`);
             } else {
-                throw new Error(result.message || 'فشل في العملية المجمعة');
+                showError(`فشلت ${failed.length} من ${operations.length} عملية - يمكن إعادة محاولة الفاشلة فقط`);
             }
         } catch (error) {
-            // في حالة فشل العملية المجمعة، نعالج كل عملية منفردة
-            for (const operation of operations) {
-                await this.processSingleOperation(operation);
-            }
+            // فشل الطلب نفسه (الشبكة أو الخادم): لم يحفظ شيء لأن الدفعة معاملة واحدة
+            operations.forEach(op => {
+                op.status = 'failed';
+                op.error = error.message;
+                op.retryable = true;
+            });
+            showError(`فشل في العملية المجمعة: ${error.message}`);
         }
     }
 
@@ -233,7 +269,8 @@ class BatchOperationSystem {
 
     // إعادة محاولة العمليات الفاشلة
     async retryFailedOperations() {
-        const failedOps = this.queue.filter(op => op.status === 'failed');
+        // أخطاء التحقق (retryable = false) لن تنجح بإعادة الإرسال كما هي
+        const failedOps = this.queue.filter(op => op.status === 'failed' && op.retryable !== false);
         
         if (failedOps.length === 0) {
             showInfo('لا توجد عمليات فاشلة لإعادة المحاولة');
@@ -0,0 +1,33 @@
+// جلب كل صفحات قوائم API
+// /api/{sales,purchases,expenses,payroll}/list تعيد صفحة واحدة (الأحدث أولاً) مع next_cursor،
+// فالشاشات التي تحتاج كل الصفوف (الطباعة، الكشوف) تتبع المؤشر حتى آخر صفحة.
+
+const LIST_PAGE_MAX = 500;
+
+async function fetchAllListPages(url, key) {
+    // url قد يحمل مرشحات (?date_from=...&payment_status=...)؛ key اسم مصفوفة الصفوف في الاستجابة
+    const rows = [];
+    let cursor = null;
+
+    do {
+        const pageUrl = new URL(url, window.location.origin);
+        pageUrl.searchParams.set('limit', LIST_PAGE_MAX);
+        if (cursor) {
+            pageUrl.searchParams.set('cursor', cursor);
+        }
+
+        const response = await fetch(pageUrl);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.message || 'فشل في تحميل البيانات');
+        }
+
+        rows.push(...(data[key] || []));
+        cursor = data.next_cursor;
+    } while (cursor);
+
+    return rows;
+}
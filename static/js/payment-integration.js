@@ -8,6 +8,9 @@ class PaymentIntegrationSystem {
         this.updateInterval = 30000; // 30 ثانية
         this.isMonitoring = false;
         this.lastUpdate = null;
+        this.eventSource = null;
+        this.pollingTimer = null;
+        this.summaryTimer = null;
         this.pendingUpdates = new Set();
         
         this.init();
@@ -27,9 +30,44 @@ class PaymentIntegrationSystem {
         if (this.isMonitoring) return;
         
         this.isMonitoring = true;
-        
+
+        // البث من الخادم (SSE) أولاً، والفحص الدوري احتياطي فقط
+        if (window.EventSource) {
+            this.connectEventStream();
+        } else {
+            this.startPolling();
+        }
+    }
+
+    connectEventStream() {
+        const query = this.lastUpdate !== null ? `?last_event_id=${this.lastUpdate}` : '';
+        this.eventSource = new EventSource(`/api/events${query}`);
+
+        this.eventSource.addEventListener('ready', (event) => {
+            this.lastUpdate = event.lastEventId;
+        });
+
+        this.eventSource.addEventListener('change', async (event) => {
+            this.lastUpdate = event.lastEventId;
+            await this.applyUpdate(JSON.parse(event.data));
+            this.scheduleSummaryUpdate();
+        });
+
+        this.eventSource.onerror = () => {
+            // المتصفح يعيد الاتصال تلقائياً مع Last-Event-ID؛ إذا أغلق نهائياً (مثل 503 عند بلوغ
+            // حد القنوات في الخادم) نرجع للفحص الدوري
+            if (this.eventSource.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.startPolling();
+            }
+        };
+    }
+
+    startPolling() {
+        if (this.pollingTimer) return;
+
         // تحديث دوري للبيانات
-        setInterval(() => {
+        this.pollingTimer = setInterval(() => {
             this.checkForUpdates();
         }, this.updateInterval);
         
@@ -39,6 +77,14 @@ class PaymentIntegrationSystem {
         });
     }
 
+    scheduleSummaryUpdate() {
+        // دمج تحديثات البطاقات عند وصول عدة أحداث متتالية
+        clearTimeout(this.summaryTimer);
+        this.summaryTimer = setTimeout(() => {
+            this.updateSummaryCards();
+        }, 500);
+    }
+
     setupEventListeners() {
         // مراقبة تغييرات النماذج
         document.addEventListener('DOMContentLoaded', () => {
@@ -189,20 +235,25 @@ class PaymentIntegrationSystem {
 
     async checkForUpdates() {
         try {
-            const response = await fetch('/api/payments/check-updates', {
-                method: 'GET',
-                headers: {
-                    'X-Last-Update': this.lastUpdate || '0'
-                }
-            });
-            
-            if (response.ok) {
+            let hasMore = true;
+
+            // مزامنة الفروقات فقط: كل طلب يعيد الصفوف التي تغيرت بعد آخر إصدار
+            while (hasMore) {
+                const query = this.lastUpdate !== null ? `?since=${this.lastUpdate}` : '';
+                const response = await fetch(`/api/payments/check-updates${query}`, {
+                    method: 'GET'
+                });
+
+                if (!response.ok) return;
+
                 const result = await response.json();
-                
+                if (!result.success) return;
+
                 if (result.hasUpdates) {
                     await this.processUpdates(result.updates);
-                    this.lastUpdate = result.timestamp;
                 }
+                this.lastUpdate = result.version;
+                hasMore = result.hasMore;
             }
             
         } catch (error) {
@@ -215,28 +266,41 @@ class PaymentIntegrationSystem {
             await this.applyUpdate(update);
         }
         
-        // تحديث الواجهة
-        this.refreshCurrentScreen();
+        // تحديث الإحصائيات مرة واحدة بعد تطبيق كل الفروقات
+        this.updateSummaryCards();
     }
 
     async applyUpdate(update) {
-        const { type, action, data } = update;
-        
+        const { type, action, id, data } = update;
+        const rowType = this.getRowType(type);
+        const row = document.querySelector(`[data-${rowType}-id="${id}"]`);
+
         switch (action) {
-            case 'payment_registered':
-                await this.updatePaymentStatus(type, data.id, data.payment_status);
-                break;
-                
-            case 'payment_deleted':
-                await this.updatePaymentStatus(type, data.id, 'unpaid');
+            case 'insert':
+            case 'update':
+                if (row) {
+                    this.updateTableRow(row, data);
+                }
                 break;
-                
-            case 'amount_updated':
-                await this.updateAmount(type, data.id, data.new_amount);
+
+            case 'delete':
+                if (row) {
+                    row.remove();
+                }
                 break;
         }
     }
 
+    getRowType(type) {
+        const rowTypes = {
+            'sales': 'sale',
+            'purchases': 'purchase',
+            'expenses': 'expense',
+            'payroll': 'payroll'
+        };
+        return rowTypes[type] || type;
+    }
+
     async updatePaymentStatus(type, id, status) {
         // تحديث حالة الدفع في الواجهة
         const row = document.querySelector(`[data-${type}-id="${id}"]`);
@@ -291,11 +355,11 @@ class PaymentIntegrationSystem {
 
     async refreshSalesScreen() {
         try {
-            const response = await fetch('/api/sales/list');
+            // نفس المرشحات والمؤشر في رابط الصفحة: تحديث الصفوف المعروضة فعلاً وليس أحدث صفحة فقط
+            const response = await fetch('/api/sales/list' + window.location.search);
             if (response.ok) {
                 const data = await response.json();
                 this.updateSalesTable(data.sales);
-                this.updateSalesSummary(data.summary);
             }
         } catch (error) {
             console.error('خطأ في تحديث شاشة المبيعات:', error);
@@ -304,11 +368,11 @@ class PaymentIntegrationSystem {
 
     async refreshPurchasesScreen() {
         try {
-            const response = await fetch('/api/purchases/list');
+            // نفس المرشحات والمؤشر في رابط الصفحة: تحديث الصفوف المعروضة فعلاً وليس أحدث صفحة فقط
+            const response = await fetch('/api/purchases/list' + window.location.search);
             if (response.ok) {
                 const data = await response.json();
                 this.updatePurchasesTable(data.purchases);
-                this.updatePurchasesSummary(data.summary);
             }
         } catch (error) {
             console.error('خطأ في تحديث شاشة المشتريات:', error);
@@ -317,11 +381,11 @@ class PaymentIntegrationSystem {
 
     async refreshExpensesScreen() {
         try {
-            const response = await fetch('/api/expenses/list');
+            // نفس المرشحات والمؤشر في رابط الصفحة: تحديث الصفوف المعروضة فعلاً وليس أحدث صفحة فقط
+            const response = await fetch('/api/expenses/list' + window.location.search);
             if (response.ok) {
                 const data = await response.json();
                 this.updateExpensesTable(data.expenses);
-                this.updateExpensesSummary(data.summary);
             }
         } catch (error) {
             console.error('خطأ في تحديث شاشة المصروفات:', error);
@@ -330,11 +394,11 @@ class PaymentIntegrationSystem {
 
     async refreshPayrollScreen() {
         try {
-            const response = await fetch('/api/payroll/list');
+            // نفس المرشحات والمؤشر في رابط الصفحة: تحديث الصفوف المعروضة فعلاً وليس أحدث صفحة فقط
+            const response = await fetch('/api/payroll/list' + window.location.search);
             if (response.ok) {
                 const data = await response.json();
                 this.updatePayrollTable(data.payrolls);
-                this.updatePayrollSummary(data.summary);
             }
         } catch (error) {
             console.error('خطأ في تحديث شاشة الرواتب:', error);
@@ -347,13 +411,30 @@ class PaymentIntegrationSystem {
             if (response.ok) {
                 const data = await response.json();
                 this.updatePaymentsSummary(data.summary);
-                this.updatePaymentsTable(data.transactions);
             }
         } catch (error) {
             console.error('خطأ في تحديث شاشة المدفوعات:', error);
         }
     }
 
+    updatePaymentsSummary(summary) {
+        if (!summary) return;
+
+        const values = {
+            'total-amount': this.formatCurrency(summary['total-payments'] || 0),
+            'total-paid': this.formatCurrency(summary['paid-payments'] || 0),
+            'total-due': this.formatCurrency(summary['pending-payments'] || 0),
+            'unpaid-count': summary.count - ((summary.by_status && summary.by_status.paid) ? summary.by_status.paid.count : 0)
+        };
+
+        Object.keys(values).forEach(id => {
+            const element = document.getElementById(id);
+            if (element) {
+                element.textContent = values[id];
+            }
+        });
+    }
+
     updateSummaryCards() {
         // تحديث بطاقات الملخص في جميع الشاشات
         this.updateSalesCards();
@@ -409,11 +490,12 @@ class PaymentIntegrationSystem {
             const response = await fetch(endpoint);
             if (response.ok) {
                 const data = await response.json();
+                const summary = data.summary || {};
                 
                 Object.keys(elements).forEach(key => {
                     const element = elements[key];
-                    if (element && data[key] !== undefined) {
-                        element.textContent = this.formatCurrency(data[key]);
+                    if (element && summary[key] !== undefined) {
+                        element.textContent = this.formatCurrency(summary[key]);
                         
                         // إضافة تأثير بصري للتحديث
                         element.classList.add('updated');
@@ -515,6 +597,18 @@ class PaymentIntegrationSystem {
         });
     }
 
+    updatePayrollTable(payrollData) {
+        const tbody = document.querySelector('#payroll-table tbody');
+        if (!tbody) return;
+
+        payrollData.forEach(payroll => {
+            const row = tbody.querySelector(`[data-payroll-id="${payroll.id}"]`);
+            if (row) {
+                this.updateTableRow(row, payroll);
+            }
+        });
+    }
+
     updateTableRow(row, data) {
         // تحديث حالة الدفع
         const statusCell = row.querySelector('.payment-status');
@@ -16,13 +16,8 @@ async function printSalesInvoices() {
         let salesData = [];
 
         try {
-            const response = await fetch('/api/sales/list');
-            if (response.ok) {
-                const data = await response.json();
-                if (data.success && data.sales) {
-                    salesData = data.sales;
-                }
-            }
+            // كل الصفحات وليس أحدث 50 فقط
+            salesData = await fetchAllListPages('/api/sales/list', 'sales');
         } catch (apiError) {
             console.warn('⚠️ فشل جلب البيانات من API، سيتم استخدام البيانات من الجدول');
         }
@@ -72,13 +67,8 @@ async function printPurchasesInvoices() {
         let purchasesData = [];
 
         try {
-            const response = await fetch('/api/purchases/list');
-            if (response.ok) {
-                const data = await response.json();
-                if (data.success && data.purchases) {
-                    purchasesData = data.purchases;
-                }
-            }
+            // كل الصفحات وليس أحدث 50 فقط
+            purchasesData = await fetchAllListPages('/api/purchases/list', 'purchases');
         } catch (apiError) {
             console.warn('⚠️ فشل جلب البيانات من API، سيتم استخدام البيانات من الجدول');
         }
@@ -128,13 +118,8 @@ async function printExpensesInvoices() {
         let expensesData = [];
 
         try {
-            const response = await fetch('/api/expenses/list');
-            if (response.ok) {
-                const data = await response.json();
-                if (data.success && data.expenses) {
-                    expensesData = data.expenses;
-                }
-            }
+            // كل الصفحات وليس أحدث 50 فقط
+            expensesData = await fetchAllListPages('/api/expenses/list', 'expenses');
         } catch (apiError) {
             console.warn('⚠️ فشل جلب البيانات من API، سيتم استخدام البيانات من الجدول');
         }
@@ -179,21 +164,16 @@ async function printPayrollInvoices() {
     console.log('🖨️ طباعة كشف الرواتب من قاعدة البيانات');
 
     try {
-        // جلب البيانات الحقيقية من قاعدة البيانات
-        const response = await fetch('/api/payroll/list');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const data = await response.json();
+        // جلب البيانات الحقيقية من قاعدة البيانات - كل الصفحات
+        const payrolls = await fetchAllListPages('/api/payroll/list', 'payrolls');
 
-        if (!data.success || !data.payrolls || data.payrolls.length === 0) {
+        if (payrolls.length === 0) {
             alert('لا توجد رواتب للطباعة');
             return;
         }
 
         // إنشاء HTML للطباعة من البيانات الحقيقية
-        let printHTML = createPrintHTMLFromData('كشف الرواتب', data.payrolls, [
+        let printHTML = createPrintHTMLFromData('كشف الرواتب', payrolls, [
             'رقم الراتب', 'تاريخ الراتب', 'اسم الموظف', 'الشهر', 'المبلغ', 'حالة الدفع'
         ], 'payroll');
 